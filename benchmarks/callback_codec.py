@@ -0,0 +1,63 @@
+"""
+Compact callback data codec vs. the legacy base64(JSON) encoding.
+
+    python -m benchmarks.callback_codec
+"""
+import base64
+import timeit
+
+import ujson
+from bson import ObjectId
+from pydantic import BaseModel
+
+from core.aiogram_nodes import callback_codec
+from core.aiogram_nodes.util import Shortcuts, encode_callback_data, decode_callback_data
+from core.money import Money
+
+NUMBER = 20000
+
+
+class AmountProps(BaseModel):
+    amounts: list = []
+    amount: Money = Money(0)
+    error_msg: str = ''
+
+
+class RequestProps(BaseModel):
+    r: ObjectId = None
+    msg: str = ''
+
+    class Config:
+        arbitrary_types_allowed = True
+
+
+def legacy_encode(data: dict) -> str:
+    return base64.b64encode(ujson.dumps(data, default=str).encode('utf-8')).decode('utf-8')
+
+
+def legacy_decode(encoded: str) -> dict:
+    return ujson.loads(base64.b64decode(encoded))
+
+
+def main():
+    callback_codec.register_schema('5', AmountProps)
+    callback_codec.register_schema('16', RequestProps)
+    cases = {
+        'no props': {Shortcuts.TRANSITION_TO_NODE: '7', Shortcuts.TRANSITION_TO_NODE_PROPS: {}},
+        'money': {Shortcuts.TRANSITION_TO_NODE: '5', Shortcuts.TRANSITION_TO_NODE_PROPS: {'amount': Money.ton('50.25')}},
+        'object id': {Shortcuts.TRANSITION_TO_NODE: '16', Shortcuts.TRANSITION_TO_NODE_PROPS: {'r': ObjectId()}},
+    }
+    print(f'{"case":>10} {"legacy len":>10} {"len":>4} {"legacy enc/dec, us":>19} {"enc/dec, us":>12}')
+    for name, data in cases.items():
+        legacy = legacy_encode(data)
+        compact = encode_callback_data(data)
+        legacy_enc = timeit.timeit(lambda: legacy_encode(data), number=NUMBER) / NUMBER * 1e6
+        legacy_dec = timeit.timeit(lambda: legacy_decode(legacy), number=NUMBER) / NUMBER * 1e6
+        enc = timeit.timeit(lambda: encode_callback_data(data), number=NUMBER) / NUMBER * 1e6
+        dec = timeit.timeit(lambda: decode_callback_data(compact), number=NUMBER) / NUMBER * 1e6
+        print(f'{name:>10} {len(legacy):>10} {len(compact):>4} '
+              f'{legacy_enc:>9.2f}/{legacy_dec:<9.2f} {enc:>5.2f}/{dec:<6.2f}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,200 @@
+"""
+End-to-end throughput of the dispatcher: synthetic updates through init_dispatcher() with the middlewares,
+routing, nodes and outbox, against a stubbed Bot API and in-memory collections.
+
+    python -m benchmarks.dispatcher --updates 20000 --users 200 --concurrency 64 --json before.json
+
+Reports updates/s, p50/p99 latency per update kind and allocations per update.
+Compare the --json outputs of two commits to see the effect of a change.
+"""
+import argparse
+import asyncio
+import logging
+import platform
+import random
+import statistics
+import time
+import tracemalloc
+from collections import defaultdict
+from typing import List, Tuple, Dict
+
+import ujson
+from aiogram import types, Bot
+
+from benchmarks.fakes import stub_bot, collection_sizes
+from bot import bot
+from core.aiogram_nodes.util import encode_callback_data
+from core.config_loader import config
+from core.logging_config import root_logger
+from core.outbox import outbox, TokenBucket
+from db.engine import use_storage
+from db.ledger import ledger
+from db.user_cache import user_cache
+from handlers_bot.nodes.decimal_input import DecimalInput
+
+COMMANDS = ['/start', '/menu', '/settings', '/referral']
+# an amount every DecimalInput node accepts
+DECIMAL_TEXT = '7'
+# props of nodes that cannot be opened without them
+PROPS = {'Confirm': {'msg': 'continue', 'next_state': 'MainMenu'}}
+
+
+def _user(user_id: int) -> dict:
+    return {'id': user_id, 'is_bot': False, 'first_name': f'user{user_id}', 'username': f'user{user_id}',
+            'language_code': 'en'}
+
+
+def message_update(update_id: int, user_id: int, text: str) -> types.Update:
+    entities = [{'type': 'bot_command', 'offset': 0, 'length': len(text)}] if text.startswith('/') else []
+    return types.Update(update_id=update_id, message={
+        'message_id': update_id, 'date': 0, 'chat': {'id': user_id, 'type': 'private'},
+        'from': _user(user_id), 'text': text, 'entities': entities})
+
+
+def callback_update(update_id: int, user_id: int, data: str) -> types.Update:
+    return types.Update(update_id=update_id, callback_query={
+        'id': str(update_id), 'from': _user(user_id), 'chat_instance': str(user_id), 'data': data,
+        'message': {'message_id': 1, 'date': 0, 'chat': {'id': user_id, 'type': 'private'}}})
+
+
+def scenario(nodes) -> List[Tuple[str, str, str]]:
+    """
+    :return: (label, kind, payload) steps of one user: every command, a callback to every node
+        and an amount typed into every decimal input
+    """
+    steps = [(command, 'message', command) for command in COMMANDS]
+    for node in nodes:
+        data = encode_callback_data({'n': node.state(), 'x': PROPS.get(node.__name__, {})})
+        steps.append((node.__name__, 'callback', data))
+        if issubclass(node, DecimalInput):
+            steps.append((f'{node.__name__} text', 'message', DECIMAL_TEXT))
+    return steps
+
+
+def make_streams(nodes, updates: int, users: int, seed: int) -> List[List[Tuple[str, types.Update]]]:
+    """
+    :return: per user, updates in the order the user sends them
+    """
+    rng = random.Random(seed)
+    steps = scenario(nodes)
+    streams = [[] for _ in range(users)]
+    update_id = 0
+    while update_id < updates:
+        index = update_id % users
+        stream = streams[index]
+        user_id = 1000 + index
+        if not stream:
+            label, kind, payload = steps[0]
+        else:
+            label, kind, payload = rng.choice(steps)
+        update_id += 1
+        update = message_update(update_id, user_id, payload) if kind == 'message' \
+            else callback_update(update_id, user_id, payload)
+        stream.append((label, update))
+    return streams
+
+
+async def run(dp, streams, concurrency: int) -> Tuple[float, Dict[str, List[float]]]:
+    """
+    Users are processed concurrently, each user's updates in order like UpdatePool does
+    """
+    latencies = defaultdict(list)
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def feed(stream):
+        async with semaphore:
+            for label, update in stream:
+                start = time.perf_counter()
+                await dp.process_updates([update])
+                latencies[label].append(time.perf_counter() - start)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(feed(stream) for stream in streams))
+    return time.perf_counter() - start, latencies
+
+
+async def allocations(dp, streams, count: int) -> float:
+    """
+    :return: peak traced KiB per update, updates processed one by one
+    """
+    updates = [update for stream in streams for _, update in stream][:count]
+    peaks = []
+    for update in updates:
+        tracemalloc.start()
+        await dp.process_updates([update])
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        peaks.append(peak)
+    return statistics.mean(peaks) / 1024
+
+
+def percentile(values: List[float], q: float) -> float:
+    values = sorted(values)
+    return values[min(len(values) - 1, int(q * len(values)))]
+
+
+async def main():
+    parser = argparse.ArgumentParser(description='Dispatcher throughput benchmark')
+    parser.add_argument('--updates', type=int, default=10000)
+    parser.add_argument('--users', type=int, default=100)
+    parser.add_argument('--concurrency', type=int, default=64)
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--traced', type=int, default=300, help='updates measured for allocations')
+    parser.add_argument('--log-level', default='WARNING')
+    parser.add_argument('--json', help='write the results to this file')
+    args = parser.parse_args()
+
+    root_logger.setLevel(args.log_level)
+    logging.getLogger('aiogram').setLevel(args.log_level)
+    config.debug = False
+    use_storage('memory')
+    stub_bot(bot)
+    Bot.set_current(bot)
+    # Telegram's limits would measure the outbox pacing, not the code
+    outbox.global_bucket = TokenBucket(1e9, 1e9)
+    outbox.chat_interval = 0
+
+    # imported here: the dispatcher is built for the patched config
+    from core.aiogram_nodes.registry import load_nodes
+    from server import init_dispatcher
+    dp = init_dispatcher()
+    nodes = load_nodes()
+
+    # warm up: users are created, caches and imports are loaded
+    warmup = make_streams(nodes, args.users * 5, args.users, args.seed + 1)
+    await run(dp, warmup, args.concurrency)
+
+    streams = make_streams(nodes, args.updates, args.users, args.seed)
+    elapsed, latencies = await run(dp, streams, args.concurrency)
+    kib = await allocations(dp, streams, args.traced)
+    await outbox.close()
+    await ledger.close()
+    await user_cache.close()
+
+    total = sum(len(values) for values in latencies.values())
+    results = {
+        'python': platform.python_version(),
+        'updates': total,
+        'users': args.users,
+        'concurrency': args.concurrency,
+        'updates_per_second': total / elapsed,
+        'kib_per_update': kib,
+        'latency': {label: {'count': len(values),
+                            'p50_ms': percentile(values, 0.5) * 1e3,
+                            'p99_ms': percentile(values, 0.99) * 1e3}
+                    for label, values in sorted(latencies.items())},
+        'documents': collection_sizes(),
+    }
+
+    print(f'{total} updates in {elapsed:.2f} s: {results["updates_per_second"]:.0f} updates/s, '
+          f'{kib:.1f} KiB peak per update')
+    print(f'{"":>24} {"count":>6} {"p50, ms":>8} {"p99, ms":>8}')
+    for label, row in results['latency'].items():
+        print(f'{label:>24} {row["count"]:>6} {row["p50_ms"]:>8.2f} {row["p99_ms"]:>8.2f}')
+    if args.json:
+        with open(args.json, 'w') as f:
+            ujson.dump(results, f, indent=2, escape_forward_slashes=False)
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
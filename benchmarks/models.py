@@ -0,0 +1,53 @@
+"""
+Cost of building models from database documents: validating constructor vs. MongoModel.from_db.
+
+    python -m benchmarks.models
+
+A User is built on every user cache miss, an Invoice per deposit and a WithdrawRequest per confirmation.
+"""
+import timeit
+import tracemalloc
+import bson
+from bson.int64 import Int64
+
+from core.money import Money
+from db.codecs import codec_options
+from db.models import User, Invoice, WithdrawRequest, MongoModel
+
+NUMBER = 20000
+
+
+def stored(model: MongoModel) -> dict:
+    # as the driver returns it
+    return bson.decode(bson.encode(model.dict(), codec_options=codec_options), codec_options=codec_options)
+
+
+def documents():
+    user = stored(User(user_id=5123456789, first_name='Alice', last_name='Smith', username='alice',
+                       balance=Money.ton('12.50'), sum_deposit=Money.ton(40), referrer_user_id=42, state='7'))
+    user['user_id'] = Int64(user['user_id'])
+    yield 'User', User, user
+    yield 'Invoice', Invoice, stored(Invoice(user_id=5123456789, amount=Money.ton(10), hash='IVx1y2z3'))
+    yield 'WithdrawRequest', WithdrawRequest, stored(WithdrawRequest(user_id=5123456789, amount=Money.ton(5)))
+
+
+def measure(build, document: dict):
+    seconds = timeit.timeit(lambda: build(document), number=NUMBER) / NUMBER
+    tracemalloc.start()
+    build(document)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return seconds, peak
+
+
+def main():
+    print(f'{"":>16} {"validate, us":>13} {"from_db, us":>12} {"speedup":>8} {"peak, KiB":>16}')
+    for name, model, document in documents():
+        validated, validated_peak = measure(lambda d: model(**d), document)
+        trusted, trusted_peak = measure(model.from_db, document)
+        print(f'{name:>16} {validated * 1e6:>13.2f} {trusted * 1e6:>12.2f} {validated / trusted:>7.1f}x '
+              f'{validated_peak / 1024:>7.1f} / {trusted_peak / 1024:<6.1f}')
+
+
+if __name__ == '__main__':
+    main()
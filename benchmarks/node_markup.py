@@ -0,0 +1,68 @@
+"""
+Cost of MainMenu._compile_markup with buttons reading node descriptors vs. instantiating their target nodes.
+
+    python -m benchmarks.node_markup
+"""
+import statistics
+import timeit
+import tracemalloc
+from contextlib import contextmanager
+
+from core.aiogram_nodes.node import TransitionButton
+from handlers_bot.nodes import main_menu
+from handlers_bot.nodes.main_menu import MainMenu
+
+NUMBER = 2000
+REPEAT = 15
+WARMUP = 500
+
+
+class InstantiatingTransitionButton(TransitionButton):
+    # the way labels used to be built: a full node instance per button
+    def __init__(self, to_node, props: dict = None, text: str = ''):
+        super().__init__(to_node, props=props, text=text)
+        if not isinstance(to_node, str):
+            self.to_node = to_node(**(props or {}))
+
+
+@contextmanager
+def instantiating_buttons():
+    main_menu.TransitionButton = InstantiatingTransitionButton
+    try:
+        yield
+    finally:
+        main_menu.TransitionButton = TransitionButton
+
+
+def peak_memory(node: MainMenu) -> int:
+    tracemalloc.start()
+    node._compile_markup()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return peak
+
+
+def main():
+    node = MainMenu()
+    timer = timeit.Timer(node._compile_markup)
+    legacy, current = [], []
+    with instantiating_buttons():
+        timer.timeit(WARMUP)
+        legacy_peak = peak_memory(node)
+    timer.timeit(WARMUP)
+    peak = peak_memory(node)
+    # alternated, so drift of the machine affects both
+    for _ in range(REPEAT):
+        with instantiating_buttons():
+            legacy.append(timer.timeit(NUMBER) / NUMBER)
+        current.append(timer.timeit(NUMBER) / NUMBER)
+
+    print(f'{REPEAT} runs of {NUMBER} calls')
+    print(f'{"":>14} {"min, us":>8} {"median, us":>11} {"peak, KiB":>10}')
+    for name, times, peak_bytes in (('instantiating', legacy, legacy_peak), ('descriptors', current, peak)):
+        print(f'{name:>14} {min(times) * 1e6:>8.2f} {statistics.median(times) * 1e6:>11.2f} '
+              f'{peak_bytes / 1024:>10.1f}')
+
+
+if __name__ == '__main__':
+    main()
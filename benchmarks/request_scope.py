@@ -0,0 +1,102 @@
+"""
+Stress test of the per-update request scope: many users' updates processed concurrently, every update checks
+that the current user and locale are still its own after the handlers ran.
+
+    python -m benchmarks.request_scope --updates 20000 --users 500
+
+Users alternate between the en and ru locales. Exits with 1 if any update saw another update's user or locale.
+"""
+import argparse
+import asyncio
+import logging
+import random
+from typing import Optional
+
+from aiogram import types, Bot
+from aiogram.dispatcher.middlewares import BaseMiddleware
+
+from benchmarks.dispatcher import make_streams, run
+from benchmarks.fakes import stub_bot
+from bot import bot
+from core.aiogram_nodes.context import current_user, current_locale
+from core.config_loader import config
+from core.logging_config import root_logger
+from core.outbox import outbox, TokenBucket
+from db.engine import use_storage
+from db.ledger import ledger
+from db.user_cache import user_cache
+
+LOCALES = ['en', 'ru']
+
+
+def locale_of(user_id: int) -> str:
+    return LOCALES[user_id % len(LOCALES)]
+
+
+class ScopeProbe(BaseMiddleware):
+    """
+    Yields to the other updates, then compares the request scope with the update's sender
+    """
+
+    def __init__(self):
+        super().__init__()
+        self.checked = 0
+        self.leaks = 0
+
+    async def _check(self, sender: Optional[types.User]):
+        await asyncio.sleep(random.random() / 1000)
+        user = current_user()
+        self.checked += 1
+        if user is None or sender is None:
+            return
+        if user.user_id != sender.id or current_locale() != locale_of(sender.id):
+            self.leaks += 1
+            root_logger.error('update of %s sees user %s, locale %s', sender.id, user.user_id, current_locale())
+
+    async def on_post_process_message(self, message: types.Message, results, data: dict):
+        await self._check(message.from_user)
+
+    async def on_post_process_callback_query(self, query: types.CallbackQuery, results, data: dict):
+        await self._check(query.from_user)
+
+
+async def main():
+    parser = argparse.ArgumentParser(description='Request scope isolation under concurrency')
+    parser.add_argument('--updates', type=int, default=10000)
+    parser.add_argument('--users', type=int, default=300)
+    parser.add_argument('--concurrency', type=int, default=300)
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+
+    root_logger.setLevel(logging.WARNING)
+    logging.getLogger('aiogram').setLevel(logging.WARNING)
+    config.debug = False
+    use_storage('memory')
+    stub_bot(bot)
+    Bot.set_current(bot)
+    outbox.global_bucket = TokenBucket(1e9, 1e9)
+    outbox.chat_interval = 0
+
+    from core.aiogram_nodes.registry import load_nodes
+    from server import init_dispatcher
+    dp = init_dispatcher()
+    probe = ScopeProbe()
+    dp.middleware.setup(probe)
+
+    streams = make_streams(load_nodes(), args.updates, args.users, args.seed)
+    for stream in streams:
+        for _, update in stream:
+            sender = (update.message or update.callback_query).from_user
+            sender.language_code = locale_of(sender.id)
+    elapsed, _ = await run(dp, streams, args.concurrency)
+    await outbox.close()
+    await ledger.close()
+    await user_cache.close()
+
+    print(f'{probe.checked} updates of {args.users} users in {elapsed:.2f} s, '
+          f'concurrency {args.concurrency}: {probe.leaks} saw another user or locale')
+    return probe.leaks
+
+
+if __name__ == '__main__':
+    raise SystemExit(1 if asyncio.run(main()) else 0)
@@ -0,0 +1,70 @@
+"""
+Callback query routing cost vs. number of registered nodes.
+
+    python -m benchmarks.routing
+"""
+import asyncio
+import time
+
+from aiogram import Bot, types
+
+from core.aiogram_nodes.telegram_dispatcher import TelegramDispatcher
+from core.aiogram_nodes.util import Shortcuts, encode_callback_data, decode_callback_data
+
+FAKE_TOKEN = '123456:AAEhBOweik6ad9r_QXMENQjcrGbqCr4K8a0'
+ROUNDS = 2000
+
+
+class FakeNode:
+    commands = []
+    on_text = False
+
+    def __init__(self, state: str):
+        self._state = state
+
+    def state(self):
+        return self._state
+
+
+def make_filter(node: FakeNode):
+    # the way nodes used to be matched: one filter per node, each decoding call.data
+    async def filter_callback_query(call: types.CallbackQuery):
+        data = decode_callback_data(call.data)
+        return node.state() == data.get(Shortcuts.TRANSITION_TO_NODE)
+
+    return filter_callback_query
+
+
+async def per_node_filters(nodes, call) -> float:
+    filters = [make_filter(node) for node in nodes]
+    start = time.perf_counter()
+    for _ in range(ROUNDS):
+        for f in filters:
+            if await f(call):
+                break
+    return (time.perf_counter() - start) / ROUNDS
+
+
+async def routing_table(dp: TelegramDispatcher, call) -> float:
+    start = time.perf_counter()
+    for _ in range(ROUNDS):
+        await dp._match_callback_query(call)
+    return (time.perf_counter() - start) / ROUNDS
+
+
+async def main():
+    print(f'{"nodes":>6} {"filters, us":>12} {"router, us":>12}')
+    for count in (10, 50, 100, 500):
+        dp = TelegramDispatcher(Bot(FAKE_TOKEN))
+        nodes = [FakeNode(str(i)) for i in range(1, count + 1)]
+        for node in nodes:
+            dp.connect(node)
+        # worst case for the filters: the target node is registered last
+        call = types.CallbackQuery(id='1', data=encode_callback_data({Shortcuts.TRANSITION_TO_NODE: str(count)}))
+        filters = await per_node_filters(nodes, call)
+        router = await routing_table(dp, call)
+        print(f'{count:>6} {filters * 1e6:>12.2f} {router * 1e6:>12.2f}')
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
@@ -1,6 +1,10 @@
+import time
+from typing import Optional, Dict
+
 from aiogram import Bot
 from aiogram.bot.api import TelegramAPIServer
 
+from core import metrics
 from core.config_loader import config
 
 
@@ -14,9 +18,21 @@ class TelegramAPIServerTest(TelegramAPIServer):
         )
 
 
+class MeteredBot(Bot):
+    async def request(self, method: str, data: Optional[Dict] = None, files: Optional[Dict] = None, **kwargs):
+        start = time.perf_counter()
+        try:
+            return await super().request(method, data, files, **kwargs)
+        except Exception:
+            metrics.bot_api_errors.labels(method).inc()
+            raise
+        finally:
+            metrics.bot_api_requests.labels(method).observe(time.perf_counter() - start)
+
+
 if config.dev_mode:
-    bot = Bot(token=config.token, server=TelegramAPIServerTest.make())
+    bot = MeteredBot(token=config.token, server=TelegramAPIServerTest.make())
 else:
-    bot = Bot(token=config.token)
+    bot = MeteredBot(token=config.token)
 
 Bot.set_current(bot)
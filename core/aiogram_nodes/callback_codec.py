@@ -0,0 +1,308 @@
+"""
+Compact binary encoding of callback data.
+
+Layout (URL-safe base64 without padding)::
+
+    version | varint state | 16-bit schema tag | varint presence bitmap | fields...
+
+Fields are written in the declaration order of the target node's ``Props`` model,
+so no keys are stored. The schema tag changes whenever the field layout does:
+buttons rendered by an older deploy keep their target node but lose their props,
+so do buttons of version 1, which had an 8-bit tag.
+"""
+import base64
+import binascii
+import copy
+import functools
+import zlib
+from decimal import Decimal
+from typing import Type, Dict, Tuple, List, Callable, Any, Optional
+
+import ujson
+from bson import ObjectId
+from pydantic import BaseModel
+from pydantic.fields import SHAPE_SINGLETON
+
+from core.money import Money
+
+VERSION = 2
+# 8-bit schema tag: only the target state is read
+LEGACY_VERSION = 1
+
+Encoder = Callable[[bytearray, Any], None]
+Decoder = Callable[[bytes, int], Tuple[Any, int]]
+
+
+class Schema:
+    __slots__ = ('tag', 'fields')
+
+    def __init__(self, tag: int, fields: List[Tuple[str, Encoder, Decoder]]):
+        self.tag = tag
+        self.fields = fields
+
+
+_schemas: Dict[int, Schema] = {}
+_NO_SCHEMA = Schema(0, [])
+
+
+# primitives
+
+def _write_varint(buf: bytearray, n: int):
+    while n > 0x7f:
+        buf.append((n & 0x7f) | 0x80)
+        n >>= 7
+    buf.append(n)
+
+
+def _read_varint(data: bytes, pos: int) -> Tuple[int, int]:
+    result = shift = 0
+    while True:
+        byte = data[pos]
+        pos += 1
+        result |= (byte & 0x7f) << shift
+        if byte < 0x80:
+            return result, pos
+        shift += 7
+
+
+def _write_int(buf: bytearray, value: Any):
+    n = int(value)
+    _write_varint(buf, (n << 1) if n >= 0 else ((-n << 1) - 1))
+
+
+def _read_int(data: bytes, pos: int) -> Tuple[int, int]:
+    n, pos = _read_varint(data, pos)
+    return (n >> 1) if not n & 1 else -((n + 1) >> 1), pos
+
+
+def _read_money(data: bytes, pos: int) -> Tuple[Money, int]:
+    n, pos = _read_int(data, pos)
+    return Money(n), pos
+
+
+def _write_bool(buf: bytearray, value: Any):
+    buf.append(1 if value else 0)
+
+
+def _read_bool(data: bytes, pos: int) -> Tuple[bool, int]:
+    return data[pos] == 1, pos + 1
+
+
+def _write_decimal(buf: bytearray, value: Any):
+    if not isinstance(value, Decimal):
+        value = Decimal(str(value))
+    sign, digits, exponent = value.as_tuple()
+    if not isinstance(exponent, int):
+        raise ValueError(f'Cannot encode {value}')
+    coefficient = int(''.join(map(str, digits)) or 0)
+    _write_int(buf, -coefficient if sign else coefficient)
+    _write_int(buf, exponent)
+
+
+def _read_decimal(data: bytes, pos: int) -> Tuple[Decimal, int]:
+    coefficient, pos = _read_int(data, pos)
+    exponent, pos = _read_int(data, pos)
+    digits = tuple(int(x) for x in str(abs(coefficient)))
+    return Decimal((1 if coefficient < 0 else 0, digits, exponent)), pos
+
+
+def _write_str(buf: bytearray, value: Any):
+    raw = str(value).encode('utf-8')
+    _write_varint(buf, len(raw))
+    buf += raw
+
+
+def _read_str(data: bytes, pos: int) -> Tuple[str, int]:
+    length, pos = _read_varint(data, pos)
+    return data[pos:pos + length].decode('utf-8'), pos + length
+
+
+def _write_object_id(buf: bytearray, value: Any):
+    buf += ObjectId(value).binary
+
+
+def _read_object_id(data: bytes, pos: int) -> Tuple[ObjectId, int]:
+    return ObjectId(data[pos:pos + 12]), pos + 12
+
+
+# values of fields without a fixed type are prefixed with a type tag
+
+_T_NONE, _T_FALSE, _T_TRUE, _T_INT, _T_DECIMAL, _T_STR, _T_OBJECT_ID, _T_FLOAT, _T_JSON, _T_MONEY = range(10)
+
+
+def _write_any(buf: bytearray, value: Any):
+    if value is None:
+        buf.append(_T_NONE)
+    elif isinstance(value, bool):
+        buf.append(_T_TRUE if value else _T_FALSE)
+    elif isinstance(value, Money):
+        buf.append(_T_MONEY)
+        _write_int(buf, value)
+    elif isinstance(value, int):
+        buf.append(_T_INT)
+        _write_int(buf, value)
+    elif isinstance(value, Decimal):
+        buf.append(_T_DECIMAL)
+        _write_decimal(buf, value)
+    elif isinstance(value, float):
+        buf.append(_T_FLOAT)
+        _write_decimal(buf, value)
+    elif isinstance(value, str):
+        buf.append(_T_STR)
+        _write_str(buf, value)
+    elif isinstance(value, ObjectId):
+        buf.append(_T_OBJECT_ID)
+        _write_object_id(buf, value)
+    else:
+        buf.append(_T_JSON)
+        _write_str(buf, ujson.dumps(value, default=str))
+
+
+def _read_any(data: bytes, pos: int) -> Tuple[Any, int]:
+    tag = data[pos]
+    pos += 1
+    if tag == _T_NONE:
+        return None, pos
+    if tag == _T_FALSE or tag == _T_TRUE:
+        return tag == _T_TRUE, pos
+    if tag == _T_INT:
+        return _read_int(data, pos)
+    if tag == _T_MONEY:
+        return _read_money(data, pos)
+    if tag == _T_DECIMAL:
+        return _read_decimal(data, pos)
+    if tag == _T_FLOAT:
+        value, pos = _read_decimal(data, pos)
+        return float(value), pos
+    if tag == _T_STR:
+        return _read_str(data, pos)
+    if tag == _T_OBJECT_ID:
+        return _read_object_id(data, pos)
+    if tag == _T_JSON:
+        value, pos = _read_str(data, pos)
+        return ujson.loads(value), pos
+    raise ValueError(f'Unknown type tag {tag}')
+
+
+def _field_codec(field) -> Tuple[str, Encoder, Decoder]:
+    type_ = field.outer_type_ if field.shape == SHAPE_SINGLETON else None
+    if type_ is bool:
+        return 'bool', _write_bool, _read_bool
+    if type_ is int:
+        return 'int', _write_int, _read_int
+    if type_ is Money:
+        return 'money', _write_int, _read_money
+    if type_ is Decimal:
+        return 'decimal', _write_decimal, _read_decimal
+    if type_ is str:
+        return 'str', _write_str, _read_str
+    if isinstance(type_, type) and issubclass(type_, ObjectId):
+        return 'oid', _write_object_id, _read_object_id
+    return 'any', _write_any, _read_any
+
+
+def register_schema(state: str, props: Type[BaseModel]):
+    fields = []
+    signature = []
+    for name, field in props.__fields__.items():
+        kind, encoder, decoder = _field_codec(field)
+        fields.append((name, encoder, decoder))
+        signature.append(f'{name}:{kind}')
+    tag = zlib.crc32(','.join(signature).encode('utf-8')) & 0xffff
+    _schemas[int(state)] = Schema(tag, fields)
+    _encode_cached.cache_clear()
+    _decode_cached.cache_clear()
+
+
+def _hashable(props: dict) -> Optional[tuple]:
+    try:
+        # types are part of the key: 1 == True == Decimal(1), but they are encoded differently
+        items = tuple((key, type(value), value) for key, value in props.items())
+        hash(items)
+    except TypeError:
+        return None
+    return items
+
+
+def encode(state: str, props: Optional[dict] = None) -> str:
+    items = _hashable(props) if props else ()
+    if items is None:
+        return _encode(int(state), props)
+    return _encode_cached(int(state), items)
+
+
+@functools.lru_cache(maxsize=4096)
+def _encode_cached(state: int, items: tuple) -> str:
+    return _encode(state, {key: value for key, _, value in items})
+
+
+def _encode(state: int, props: Optional[dict]) -> str:
+    schema = _schemas.get(state, _NO_SCHEMA)
+    buf = bytearray((VERSION,))
+    _write_varint(buf, state)
+    buf += schema.tag.to_bytes(2, 'little')
+    if props:
+        if schema is _NO_SCHEMA:
+            _write_any(buf, props)
+        else:
+            bitmap = 0
+            body = bytearray()
+            for i, (name, encoder, _) in enumerate(schema.fields):
+                value = props.get(name)
+                if value is None:
+                    continue
+                bitmap |= 1 << i
+                encoder(body, value)
+            _write_varint(buf, bitmap)
+            buf += body
+    return base64.urlsafe_b64encode(buf).rstrip(b'=').decode('ascii')
+
+
+# values that a shallow copy of the cached props can share
+_IMMUTABLE = (int, float, str, Decimal, ObjectId, type(None))
+
+
+def decode(encoded: str) -> Tuple[str, dict]:
+    """
+    :return: target state and props, a new dict the caller may change. Raises ValueError on malformed data
+    """
+    state, props, shallow = _decode_cached(encoded)
+    return state, dict(props) if shallow else copy.deepcopy(props)
+
+
+@functools.lru_cache(maxsize=4096)
+def _decode_cached(encoded: str) -> Tuple[str, Any, bool]:
+    """
+    :return: target state, props, which must not be changed, and whether a shallow copy of them is enough
+    """
+    try:
+        data = base64.urlsafe_b64decode(encoded + '=' * (-len(encoded) % 4))
+    except (binascii.Error, ValueError):
+        raise ValueError('Malformed callback data')
+    if not data or data[0] not in (VERSION, LEGACY_VERSION):
+        raise ValueError('Unknown callback data version')
+    try:
+        state, pos = _read_varint(data, 1)
+        if data[0] == LEGACY_VERSION:
+            return str(state), {}, True
+        if pos + 2 > len(data):
+            raise IndexError
+        tag = int.from_bytes(data[pos:pos + 2], 'little')
+        pos += 2
+        props = {}
+        if pos < len(data):
+            schema = _schemas.get(state, _NO_SCHEMA)
+            if tag != schema.tag:
+                # rendered by a deploy with another props layout
+                return str(state), {}, True
+            if schema is _NO_SCHEMA:
+                props, pos = _read_any(data, pos)
+            else:
+                bitmap, pos = _read_varint(data, pos)
+                for i, (name, _, decoder) in enumerate(schema.fields):
+                    if bitmap & (1 << i):
+                        props[name], pos = decoder(data, pos)
+    except (IndexError, UnicodeDecodeError):
+        raise ValueError('Malformed callback data')
+    shallow = isinstance(props, dict) and all(isinstance(value, _IMMUTABLE) for value in props.values())
+    return str(state), props, shallow
@@ -0,0 +1,39 @@
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Optional
+
+from core.logging_config import new_log_context, reset_log_context, bind
+from db.models import User
+
+_current_user: ContextVar[Optional[User]] = ContextVar('current_user', default=None)
+_current_locale: ContextVar[Optional[str]] = ContextVar('current_locale', default=None)
+
+
+@contextmanager
+def request_scope():
+    """
+    Isolates per-update state, so updates can be processed concurrently
+    """
+    user_token = _current_user.set(None)
+    locale_token = _current_locale.set(None)
+    log_token = new_log_context()
+    try:
+        yield
+    finally:
+        reset_log_context(log_token)
+        _current_locale.reset(locale_token)
+        _current_user.reset(user_token)
+
+
+def set_current_user(user: User):
+    _current_user.set(user)
+    _current_locale.set(user.language_code)
+    bind(user_id=user.user_id)
+
+
+def current_user() -> Optional[User]:
+    return _current_user.get()
+
+
+def current_locale() -> Optional[str]:
+    return _current_locale.get()
@@ -1,12 +1,15 @@
-from aiogram import types, Dispatcher
+from aiogram import types
 from aiogram.dispatcher.middlewares import BaseMiddleware
 
-from bot import bot
+from core import metrics
 from core.aiogram_nodes.util import get_current_user
 from core.config_loader import config
 from core.logging_config import root_logger
+from core.outbox import outbox
 from i18n import _
 
+_rejections = metrics.middleware_rejections.labels('DebugWhitelistMiddleware')
+
 
 class DebugWhitelistMiddleware(BaseMiddleware):
     logger = root_logger.getChild('DebugWhitelistMiddleware')
@@ -14,7 +17,8 @@ class DebugWhitelistMiddleware(BaseMiddleware):
     async def on_pre_process_update(self, update: types.Update, data: dict):
         user = get_current_user()
         if config.debug and user.user_id not in config.debug_whitelist:
-            await bot.send_message(
+            _rejections.inc()
+            await outbox.send_message(
                 chat_id=user.user_id,
                 text=_('🆕 We are updating the bot now.\n'
                        '⏰ Please try again later.\n'
@@ -22,6 +26,3 @@ class DebugWhitelistMiddleware(BaseMiddleware):
                        'Use this command to open the menu 👉🏻 /menu')
             )
             raise ValueError('Bot in debug mode. User rejected')
-
-        dp = Dispatcher.get_current()
-        dp.current_user = user
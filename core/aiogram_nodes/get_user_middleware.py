@@ -1,27 +1,28 @@
-from aiogram import types, Dispatcher
+from aiogram import types
 from aiogram.dispatcher.middlewares import BaseMiddleware
 
+from core import metrics
+from core.aiogram_nodes.context import set_current_user
+from core.aiogram_nodes.util import extract_user
 from core.logging_config import root_logger
+from core.tracing import span
 from db.helpers import get_or_create_user
 
+_rejections = metrics.middleware_rejections.labels('GetUserMiddleware')
+
 
 class GetUserMiddleware(BaseMiddleware):
     logger = root_logger.getChild('GetUserMiddleware')
 
     async def on_pre_process_update(self, update: types.Update, data: dict):
         self.logger.info('active')
-        if update.message:
-            user_data = update.message.from_user
-        elif update.callback_query:
-            user_data = update.callback_query.from_user
-        elif update.inline_query:
-            user_data = update.inline_query.from_user
-        else:
+        user_data = extract_user(update)
+        if user_data is None:
             self.logger.error('Cannot extract user.')
+            _rejections.inc()
             raise ValueError('Cannot extract user.')
-        user = await get_or_create_user(user_data)
-
-        dp = Dispatcher.get_current()
-        dp.current_user = user
+        with span('get_user'):
+            user = await get_or_create_user(user_data)
+        set_current_user(user)
         # state = dp.decode_state(user.state).__repr_name__()
         self.logger.info('user: %s; state: %s', user, user.state)
\ No newline at end of file
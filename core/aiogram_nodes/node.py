@@ -1,27 +1,30 @@
 import functools
+import logging
+import time
+from contextvars import ContextVar
 from typing import Union, Any, Type, List, Optional
 
-from aiogram import types, Bot
+from aiogram import types
 from aiogram.utils.exceptions import MessageNotModified
 from pydantic import BaseModel
 
+from core import metrics
 from core.config_loader import config
 from core.constants import URL_SUPPORT
-from core.logging_config import root_logger
+from core.logging_config import root_logger, bind
+from core.outbox import outbox
+from core.tracing import span
+from core.aiogram_nodes import callback_codec
+from core.aiogram_nodes.render_cache import render_cache, RenderScope
 from core.aiogram_nodes.telegram_dispatcher import TelegramDispatcher
 from core.aiogram_nodes.util import encode_callback_data, decode_callback_data, is_msg, is_cq, \
-    get_current_user
+    get_current_user, Shortcuts, classproperty
 from core.aiogram_nodes.state_management import StateManager
 from db.engine import dbs
+from db.user_cache import user_cache
 from i18n import _
 
 
-class Shortcuts:
-    BUTTON_TYPE = 't'
-    TRANSITION_TO_NODE = 'n'
-    TRANSITION_TO_NODE_PROPS = 'x'
-
-
 class Button:
     text: str = ''
     data: dict
@@ -35,25 +38,18 @@ class Button:
 
 
 class TransitionButton(Button):
-    to_node: Union['Node', None]
+    to_node: Optional['NodeDescriptor']
 
     def __init__(self, to_node: Union[Type['Node'], str], props: dict = None, text: str = ''):
         self.text = text
-        data = {}
-        if not props:
-            props = {}
-
         if isinstance(to_node, str):
-            if to_node.isdigit():
-                data[Shortcuts.TRANSITION_TO_NODE] = to_node
-            else:
-                data[Shortcuts.TRANSITION_TO_NODE] = StateManager.get(to_node)
             self.to_node = None
+            state = to_node if to_node.isdigit() else StateManager.get(to_node)
         else:
-            self.to_node = to_node(**props)
-            data[Shortcuts.TRANSITION_TO_NODE] = to_node.state()
-        data[Shortcuts.TRANSITION_TO_NODE_PROPS] = props
-        self.data = data
+            self.to_node = to_node.describe()
+            state = self.to_node.state
+        self.data = {Shortcuts.TRANSITION_TO_NODE: state,
+                     Shortcuts.TRANSITION_TO_NODE_PROPS: props or {}}
 
     def _compile_text(self) -> str:
         text = super(TransitionButton, self)._compile_text()
@@ -91,14 +87,55 @@ class SkipMessageEditing(Exception):
     pass
 
 
+# user fields changed by every dispatch. changes of other fields invalidate the user's rendered nodes
+NAVIGATION_FIELDS = {'state', 'menu_message_id'}
+
+
+class RenderContext:
+    """
+    Per-dispatch state of a node. Registered nodes are shared between concurrent
+    dispatches, so everything that changes during a dispatch lives here.
+    """
+    __slots__ = ('node', '_props')
+
+    def __init__(self, node: 'Node', props: Optional[BaseModel] = None):
+        self.node = node
+        self._props = props
+
+    @property
+    def props(self) -> BaseModel:
+        if self._props is None:
+            self._props = self.node.Props()
+        return self._props
+
+
+_render_context: ContextVar[Optional[RenderContext]] = ContextVar('render_context', default=None)
+
+
+class NodeDescriptor:
+    """
+    Class-level metadata of a node: everything a button needs without instantiating the node
+    """
+    __slots__ = ('node', 'state', 'emoji', 'Props')
+
+    def __init__(self, node: Type['Node']):
+        self.node = node
+        self.state = node.state()
+        self.emoji = node.emoji
+        self.Props = node.Props
+
+    @property
+    def title(self) -> str:
+        # translated into the locale of the current update
+        return self.node.title
+
+
 class Node:
     emoji = ''
 
     show_header = True
     show_footer = True
 
-    props: Any = None
-
     commands = []
     on_text = False
 
@@ -109,32 +146,62 @@ class Node:
 
     parse_mode: Optional[str] = 'markdown'
 
+    # what the compiled text and keyboard depend on, see RenderScope
+    text_scope: str = RenderScope.DYNAMIC
+    markup_scope: str = RenderScope.DYNAMIC
+
     class Props(BaseModel):
         any: Any
 
     def __init__(self, back_to=None, **kwargs):
         if back_to:
             self.back_to = back_to
-        self._logger = root_logger.getChild('Node.' + self.__repr_name__() + ' ' + self.state())
-        self.props = self.Props(**kwargs)
+        self._props = self.Props(**kwargs) if kwargs else None
 
     def __repr_name__(self):
         return self.__class__.__name__
 
     _state = ''
-    _logger = None
 
     @classmethod
     @functools.lru_cache()
     def state(cls):
         if cls._state and cls.__base__._state != cls._state:
             return cls._state
-        state = StateManager.generate_simple(cls)
+        state = StateManager.state_of(cls)
         cls._state = state
         return cls._state
 
+    @classmethod
+    @functools.lru_cache()
+    def describe(cls) -> NodeDescriptor:
+        return NodeDescriptor(cls)
+
+    @classmethod
+    @functools.lru_cache()
+    def logger(cls) -> logging.Logger:
+        return root_logger.getChild('Node.' + cls.__name__ + ' ' + cls.state())
+
+    @classmethod
+    @functools.lru_cache()
+    def dispatch_seconds(cls) -> metrics.HistogramChild:
+        return metrics.node_dispatch.labels(cls.__name__, cls.state())
+
     @property
-    def title(self) -> str:
+    def _logger(self) -> logging.Logger:
+        return self.logger()
+
+    @property
+    def props(self) -> Any:
+        context = _render_context.get()
+        if context is not None and context.node is self:
+            return context.props
+        if self._props is None:
+            return self.Props()
+        return self._props
+
+    @classproperty
+    def title(cls) -> str:
         return 'Nothing'
 
     @property
@@ -170,69 +237,100 @@ class Node:
 
     @property
     def dispatch(self):
-        async def _dispatch(update: Union[types.CallbackQuery, types.Message]):
+        async def _dispatch(update: Union[types.CallbackQuery, types.Message], callback_data: dict = None):
+            """
+            :param callback_data: decoded ``update.data``, if the router has already decoded it
+            """
+            bind(node=self.__class__.__name__)
             self._logger.info('start dispatch')
             # before
+            props = self._props
             if is_cq(update):
-                decoded_data = decode_callback_data(update.data)
-                if decoded_data[Shortcuts.TRANSITION_TO_NODE] == self.state() and decoded_data.get(
+                if callback_data is None:
+                    callback_data = decode_callback_data(update.data)
+                if callback_data.get(Shortcuts.TRANSITION_TO_NODE) == self.state() and callback_data.get(
                         Shortcuts.TRANSITION_TO_NODE_PROPS):
-                    self.props = self.Props(**decoded_data.get(Shortcuts.TRANSITION_TO_NODE_PROPS))
-            self._logger.info('props: %s', self.props)
-
-            user = get_current_user()
-            user.state = self.state()
-            if is_cq(update):
-                user.menu_message_id = update.message.message_id
+                    props = self.Props(**callback_data.get(Shortcuts.TRANSITION_TO_NODE_PROPS))
+            token = _render_context.set(RenderContext(self, props))
+            start = time.perf_counter()
+            try:
+                with span('node', self.__class__.__name__):
+                    await self._run(update, callback_data)
+            finally:
+                self.dispatch_seconds().observe(time.perf_counter() - start)
+                _render_context.reset(token)
 
-            # process
-            self._logger.info('process()')
-            if self.only_admin and update.from_user.id != config.operator_id:
-                self._logger.info('skip process. user is not an operator')
-                switch_node = NullNode()
-            else:
-                switch_node = await self.process(update)
+        return _dispatch
 
-            await dbs.users.update_one({'_id': user.id}, {'$set': user.dict()})
+    async def _run(self, update: Union[types.CallbackQuery, types.Message], callback_data: Optional[dict]):
+        self._logger.info('props: %s', self.props)
 
-            # switch
-            if switch_node:
-                self._logger.info('switching node to %s', switch_node)
-                # reset
-                self.props = self.Props()
-                if isinstance(switch_node, NullNode):
-                    return
-                await switch_node.dispatch(update)
-                return
+        user = get_current_user()
+        user.state = self.state()
+        if is_cq(update):
+            user.menu_message_id = update.message.message_id
 
-            # compile
-            text = await self._compile_text()
-            markup = self._compile_markup()
-            # reset
-            self.props = self.Props()
+        # process
+        self._logger.info('process()')
+        if self.only_admin and update.from_user.id != config.operator_id:
+            self._logger.info('skip process. user is not an operator')
+            switch_node = NullNode()
+        else:
+            with span('process'):
+                switch_node = await self.process(update)
 
-            # send
-            try:
-                if is_msg(update) and update.is_command():
-                    raise SkipMessageEditing
-                await Bot.get_current().edit_message_text(
+        changes = user.pop_changes()
+        if changes:
+            await dbs.users.update_one({'_id': user.id}, {'$set': changes})
+            user_cache.updated(user.user_id)
+            if changes.keys() - NAVIGATION_FIELDS:
+                render_cache.invalidate_user(user.user_id)
+
+        # switch
+        if switch_node:
+            self._logger.info('switching node to %s', switch_node)
+            if isinstance(switch_node, NullNode):
+                return
+            await switch_node.dispatch(update, callback_data)
+            return
+
+        # compile
+        text_key = render_cache.key(self, self.text_scope, 'text')
+        text = render_cache.get(text_key)
+        if text is None:
+            with span('compile_text'):
+                text = await self._compile_text()
+            render_cache.put(text_key, text)
+        markup_key = render_cache.key(self, self.markup_scope, 'markup')
+        markup = render_cache.get(markup_key)
+        if markup is None:
+            with span('compile_markup'):
+                markup = self._compile_markup()
+            render_cache.put(markup_key, markup)
+
+        # send
+        try:
+            if is_msg(update) and update.is_command():
+                raise SkipMessageEditing
+            with span('send', 'edit_message_text'):
+                await outbox.edit_message_text(
                     chat_id=user.user_id,
                     message_id=user.menu_message_id,
                     text=text,
                     reply_markup=markup,
                     parse_mode=self.parse_mode)
-            except (MessageNotModified, SkipMessageEditing):
-                await Bot.get_current().send_message(
+        except (MessageNotModified, SkipMessageEditing):
+            with span('send', 'send_message'):
+                await outbox.send_message(
                     chat_id=user.user_id,
                     text=text,
                     reply_markup=markup,
                     parse_mode=self.parse_mode)
 
-            if is_cq(update):
+        if is_cq(update):
+            with span('send', 'answer_callback_query'):
                 await update.answer()
 
-        return _dispatch
-
     async def _compile_text(self):
         """
         :return: Compiled text to be rendered to user
@@ -243,25 +341,14 @@ class Node:
         return text
 
     def setup(self, dp: TelegramDispatcher):
-        async def filter_callback_query(call: types.CallbackQuery):
-
-            data = decode_callback_data(call.data)
-            return self.state() == data.get(Shortcuts.TRANSITION_TO_NODE)
-
-        async def filter_on_text(message: types.Message):
-            return get_current_user().state == self.state() and not message.is_command()
-
         if not dp.is_connected(self):
             dp.connect(self)
-            self._logger.info('     setup. connect callback query handler')
-            dp.register_callback_query_handler(self.dispatch, filter_callback_query)
-
+            callback_codec.register_schema(self.state(), self.Props)
+            self._logger.info('     setup. connect callback query route')
             if self.commands:
                 self._logger.info(f'     setup. connect commands: {self.commands}')
-                dp.register_message_handler(self.dispatch, commands=self.commands)
             if self.on_text:
                 self._logger.info(f'     setup. connect on_text')
-                dp.register_message_handler(self.dispatch, filter_on_text)
 
 
 class NullNode(Node):
@@ -271,12 +358,14 @@ class NullNode(Node):
 class ErrorNode(Node):
     emoji = '🚫'
     menu_btn = True
+    text_scope = RenderScope.STATIC
+    markup_scope = RenderScope.STATIC
 
     class Props(BaseModel):
         msg: str = ''
 
-    @property
-    def title(self) -> str:
+    @classproperty
+    def title(cls) -> str:
         return _('Something went wrong....')
 
     async def text(self) -> str:
@@ -0,0 +1,154 @@
+"""
+Frozen registry of nodes: class path -> state id, kept in files/node_registry.json and loaded once at startup.
+
+    python -m core.aiogram_nodes.registry build   # register new nodes, retire removed ones
+    python -m core.aiogram_nodes.registry check   # the registry is up to date and node references resolve
+"""
+import argparse
+import ast
+import importlib
+import pkgutil
+import sys
+from pathlib import Path
+from typing import List, Type, Dict, Iterator, Tuple
+
+from core.aiogram_nodes.node import Node
+from core.aiogram_nodes.state_management import StateManager, class_path, store_registry
+from core.constants import BASE_DIR
+from core.logging_config import root_logger
+
+logger = root_logger.getChild('registry')
+
+# nodes are defined in these packages and next to Node itself
+NODE_PACKAGES = ['handlers_bot.nodes']
+# scanned for string references to nodes, e.g. TransitionButton(to_node='MainMenu')
+SOURCE_DIRS = ['core', 'handlers_bot', 'handlers_server']
+
+
+def load_nodes() -> List[Type[Node]]:
+    """
+    :return: registered node classes in state id order
+    """
+    if not StateManager.is_loaded:
+        StateManager.load()
+    nodes = []
+    for path, _ in sorted(StateManager.states.items(), key=lambda x: x[1]):
+        module, name = path.rsplit('.', 1)
+        nodes.append(getattr(importlib.import_module(module), name))
+    return nodes
+
+
+def discover() -> List[Type[Node]]:
+    """
+    Imports every module of the node packages.
+
+    :return: node classes defined there, sorted by class path
+    """
+    for package in NODE_PACKAGES:
+        for module in pkgutil.walk_packages(importlib.import_module(package).__path__, package + '.'):
+            importlib.import_module(module.name)
+
+    def _all_subclasses(cls: Type) -> Iterator[Type]:
+        for sub in cls.__subclasses__():
+            yield sub
+            yield from _all_subclasses(sub)
+
+    nodes = {node for node in _all_subclasses(Node)
+             if node.__module__ == Node.__module__
+             or any(node.__module__.startswith(package + '.') for package in NODE_PACKAGES)}
+    return sorted(nodes, key=class_path)
+
+
+def _load_for_build() -> Dict[str, int]:
+    try:
+        StateManager.load()
+    except FileNotFoundError:
+        StateManager.is_loaded = True
+    registered = dict(StateManager.states)
+    StateManager.allow_new = True
+    return registered
+
+
+def build():
+    registered = _load_for_build()
+    nodes = {class_path(node): int(node.state()) for node in discover()}
+    retired = dict(StateManager.retired)
+    for path, state in registered.items():
+        if path not in nodes:
+            logger.info('retire %s (%s)', path, state)
+            retired[path] = state
+    for path, state in nodes.items():
+        if path not in registered:
+            logger.info('register %s (%s)', path, state)
+    store_registry({'nodes': dict(sorted(nodes.items(), key=lambda x: x[1])),
+                    'retired': dict(sorted(retired.items(), key=lambda x: x[1]))})
+
+
+def _string_references() -> Iterator[Tuple[str, int, str]]:
+    """
+    :return: file, line and value of every ``to_node='...'`` and ``back_to='...'`` argument
+    """
+    for directory in SOURCE_DIRS:
+        for file in sorted((BASE_DIR / directory).rglob('*.py')):
+            tree = ast.parse(file.read_text(encoding='utf-8'))
+            for call in ast.walk(tree):
+                if not isinstance(call, ast.Call):
+                    continue
+                for keyword in call.keywords:
+                    if keyword.arg in ('to_node', 'back_to') and isinstance(keyword.value, ast.Constant) \
+                            and isinstance(keyword.value.value, str):
+                        yield str(Path(file).relative_to(BASE_DIR)), call.lineno, keyword.value.value
+
+
+def check() -> List[str]:
+    """
+    :return: problems found
+    """
+    registered = _load_for_build()
+    problems = []
+    nodes = discover()
+    paths = {class_path(node) for node in nodes}
+    for path in sorted(paths - set(registered)):
+        problems.append(f'{path} is not registered')
+    for path in sorted(set(registered) - paths):
+        problems.append(f'{path} is registered but does not exist')
+
+    names: Dict[str, str] = {}
+    for node in nodes:
+        other = names.setdefault(node.__name__, class_path(node))
+        if other != class_path(node):
+            problems.append(f'{other} and {class_path(node)} have the same name')
+
+    states = {str(state) for state in registered.values()}
+    by_name = {path.rsplit('.', 1)[-1] for path in registered}
+
+    def resolves(reference: str) -> bool:
+        return reference in states if reference.isdigit() else reference in by_name
+
+    for node in nodes:
+        for attr in ('back_to', 'next_state'):
+            reference = getattr(node, attr, None)
+            if isinstance(reference, str) and not resolves(reference):
+                problems.append(f'{class_path(node)}.{attr}: unknown node {reference!r}')
+    for file, line, reference in _string_references():
+        if not resolves(reference):
+            problems.append(f'{file}:{line}: unknown node {reference!r}')
+    return problems
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Maintain the node registry')
+    parser.add_argument('command', choices=['build', 'check'])
+    args = parser.parse_args()
+    if args.command == 'build':
+        build()
+    else:
+        problems = check()
+        for problem in problems:
+            logger.error(problem)
+        logger.info('check. %s problems', len(problems))
+        sys.exit(1 if problems else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,84 @@
+from collections import OrderedDict
+from typing import Optional, Any, Hashable
+
+from core import metrics
+from core.aiogram_nodes.context import current_user, current_locale
+from core.config_loader import config
+from core.invalidation import bus
+
+
+class RenderScope:
+    # depends only on the node state, locale, back_to and props
+    STATIC = 'static'
+    # also depends on the current user, e.g. on the user's name
+    PER_USER = 'per_user'
+    # never cached: balances, referral stats, props unique to one render (invoice hash, request id)
+    DYNAMIC = 'dynamic'
+
+
+class RenderCache:
+    """
+    Process-local LRU cache of compiled node texts and keyboards, so it starts empty on every deploy.
+    """
+
+    def __init__(self, size: int):
+        self.size = size
+        self._entries: 'OrderedDict[Hashable, Any]' = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def key(node, scope: str, part: str) -> Optional[tuple]:
+        """
+        :return: None if the part must not be cached
+        """
+        if scope == RenderScope.DYNAMIC:
+            return None
+        user_id = None
+        if scope == RenderScope.PER_USER:
+            user = current_user()
+            if user is None:
+                return None
+            user_id = user.user_id
+        # repr keeps values of different types apart: Money(5) and 5 are rendered differently
+        return node.state(), part, user_id, current_locale(), node.back_to, repr(node.props.dict())
+
+    def get(self, key: Optional[tuple]) -> Optional[Any]:
+        if key is None:
+            return None
+        value = self._entries.get(key)
+        if value is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self._entries.move_to_end(key)
+        return value
+
+    def put(self, key: Optional[tuple], value: Any):
+        if key is None:
+            return
+        self._entries[key] = value
+        while len(self._entries) > self.size:
+            self._entries.popitem(last=False)
+
+    def invalidate_user(self, user_id: int):
+        """
+        Drops the user's entries here and in the other worker processes
+        """
+        self.drop_user(user_id)
+        bus.publish('render', user_id)
+
+    def drop_user(self, user_id: int):
+        for key in [key for key in self._entries if key[2] == user_id]:
+            del self._entries[key]
+
+    def clear(self):
+        self._entries.clear()
+
+
+render_cache = RenderCache(size=config.render_cache.size)
+bus.subscribe('render', render_cache.drop_user)
+metrics.registry.gauge('bot_render_cache_hits_total', 'Node parts served from the render cache',
+                       lambda: render_cache.hits, type='counter')
+metrics.registry.gauge('bot_render_cache_misses_total', 'Node parts compiled', lambda: render_cache.misses,
+                       type='counter')
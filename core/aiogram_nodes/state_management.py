@@ -1,48 +1,70 @@
 from typing import Type, Dict
 
 import ujson
-from ujson import JSONDecodeError
 
 from core.constants import FILES_DIR
 
-STATE_MANAGEMENT_FILE_NAME = 'state_management.json'
+REGISTRY_FILE_NAME = 'node_registry.json'
 
 
-class StateManager:
-    uid = 0
+def class_path(klass: Type) -> str:
+    return f'{klass.__module__}.{klass.__qualname__}'
+
 
-    generated: Dict[str, int] = {}
+class StateManager:
+    """
+    State ids of nodes, read once from the node registry (``python -m core.aiogram_nodes.registry build``).
+    Ids are part of callback data, so they never change and ids of removed nodes are not reused.
+    """
+    # class path -> state id
+    states: Dict[str, int] = {}
+    # removed nodes: class path -> state id
+    retired: Dict[str, int] = {}
+    # class name -> state id
+    names: Dict[str, int] = {}
     is_loaded = False
 
+    # set by the registry build: nodes missing from the registry get new ids instead of failing
+    allow_new = False
+
     @classmethod
-    def generate_simple(cls, klass: Type) -> str:
-        name = klass.__name__
+    def load(cls):
+        registry = load_registry()
+        cls.states = registry.get('nodes', {})
+        cls.retired = registry.get('retired', {})
+        cls.names = {path.rsplit('.', 1)[-1]: state for path, state in cls.states.items()}
+        cls.is_loaded = True
+
+    @classmethod
+    def state_of(cls, klass: Type) -> str:
         if not cls.is_loaded:
-            cls.generated = load_states()
-            cls.is_loaded = True
-            cls.uid = max([x for x in cls.generated.values()] + [0])
-        try:
-            return cls.get(name)
-        except KeyError:
-            pass
-        cls.uid += 1
-        cls.generated[name] = cls.uid
-        store_states(cls.generated)
-        return str(cls.uid)
+            cls.load()
+        path = class_path(klass)
+        state = cls.states.get(path)
+        if state is None:
+            if not cls.allow_new:
+                raise KeyError(f'{path} is not in {REGISTRY_FILE_NAME}. '
+                               f'Run python -m core.aiogram_nodes.registry build')
+            state = max(list(cls.states.values()) + list(cls.retired.values()) + [0]) + 1
+            cls.states[path] = state
+            cls.names[klass.__name__] = state
+        return str(state)
 
     @classmethod
     def get(cls, name: str) -> str:
-        return str(cls.generated[name])
+        """
+        :param name: class name of a node
+        """
+        if not cls.is_loaded:
+            cls.load()
+        return str(cls.names[name])
 
 
-def load_states() -> Dict[str, int]:
-    with open(FILES_DIR / STATE_MANAGEMENT_FILE_NAME, 'r') as f:
-        try:
-            return ujson.loads(f.read())
-        except JSONDecodeError:
-            return {}
+def load_registry() -> dict:
+    with open(FILES_DIR / REGISTRY_FILE_NAME, 'r', encoding='utf-8') as f:
+        return ujson.loads(f.read())
 
 
-def store_states(states: Dict[str, int]):
-    with open(FILES_DIR / STATE_MANAGEMENT_FILE_NAME, 'w') as f:
-        return f.write(ujson.dumps(states))
+def store_registry(registry: dict):
+    with open(FILES_DIR / REGISTRY_FILE_NAME, 'w', encoding='utf-8') as f:
+        f.write(ujson.dumps(registry, indent=2) + '\n')
@@ -1,20 +1,61 @@
-import traceback
-from typing import TypeVar, Type
+import asyncio
+from typing import TypeVar, Type, Dict, Any, Union
 
 from aiogram import Dispatcher, types
 
-from db.models import User
+from core import metrics
+from core.aiogram_nodes.context import request_scope
+from core.logging_config import bind
+from core.aiogram_nodes.util import Shortcuts, decode_callback_data, get_current_user, extract_user
+from core.tracing import tracer
 
 T = TypeVar('T')
 
 
 class TelegramDispatcher(Dispatcher):
-    current_user: User = None
-
     def __init__(self, bot):
-        self.connected_nodes = {}
+        self.connected_nodes: Dict[str, Any] = {}
+        self.command_routes: Dict[str, Any] = {}
+        self.text_routes: Dict[str, Any] = {}
         # self.trees = []
         super().__init__(bot)
+        # one router per update type instead of a filter per node
+        self.register_callback_query_handler(self._route, self._match_callback_query)
+        self.register_message_handler(self._route, self._match_message)
+
+    async def _match_callback_query(self, call: types.CallbackQuery) -> Union[dict, bool]:
+        data = decode_callback_data(call.data)
+        node = self.connected_nodes.get(data.get(Shortcuts.TRANSITION_TO_NODE))
+        if node is None:
+            return False
+        return {'node': node, 'callback_data': data}
+
+    async def _match_message(self, message: types.Message) -> Union[dict, bool]:
+        if message.is_command():
+            node = self.command_routes.get(message.get_command(pure=True).lower())
+        else:
+            node = self.text_routes.get(get_current_user().state)
+        if node is None:
+            return False
+        return {'node': node}
+
+    @staticmethod
+    async def _route(update: Union[types.CallbackQuery, types.Message], node, callback_data: dict = None):
+        await node.dispatch(update, callback_data)
+
+    async def process_updates(self, updates, fast: bool = True):
+        if fast:
+            return await asyncio.gather(*[self._notify(update) for update in updates])
+        return [await self._notify(update) for update in updates]
+
+    async def _notify(self, update: types.Update):
+        update_type = next((key for key in update.values if key != 'update_id'), 'unknown')
+        metrics.updates.labels(update_type).inc()
+        user = extract_user(update)
+        # middlewares run in updates_handler, so the scope has to be opened before it
+        with request_scope(), tracer.trace(update.update_id, update_type, user.id if user else None):
+            bind(update_id=update.update_id)
+            return await self.updates_handler.notify(update)
 
     async def process_update(self, update: types.Update):
         await super(TelegramDispatcher, self).process_update(update)
@@ -27,7 +68,7 @@ class TelegramDispatcher(Dispatcher):
     async def transition(cls, node_state: str):
         dp = Dispatcher.get_current()
         node = dp.connected_nodes[node_state]
-        await node._dispatch(types.CallbackQuery.get_current())
+        await node.dispatch(types.CallbackQuery.get_current())
 
     def get_state_by_name(self, search_for: str):
         for state, node in self.connected_nodes.items():
@@ -39,8 +80,12 @@ class TelegramDispatcher(Dispatcher):
         return self.connected_nodes.get(state)
 
     def is_connected(self, node):
-        return node.__repr_name__() in self.connected_nodes.values()
+        return node.state() in self.connected_nodes
 
     def connect(self, node):
-        self.connected_nodes[node.state] = node
+        self.connected_nodes[node.state()] = node
+        for command in node.commands:
+            self.command_routes[command.lower()] = node
+        if node.on_text:
+            self.text_routes[node.state()] = node
 
@@ -0,0 +1,72 @@
+import asyncio
+import traceback
+from typing import List
+
+from aiogram import types, Dispatcher, Bot
+
+from core.aiogram_nodes.util import extract_user
+from core.logging_config import root_logger
+
+
+class UpdatePool:
+    """
+    Bounded pool of workers processing incoming updates.
+    Updates are sharded by user id: updates of one user are processed in order,
+    updates of different users are processed in parallel.
+    """
+    logger = root_logger.getChild('UpdatePool')
+
+    def __init__(self, dp: Dispatcher, workers: int, queue_size: int):
+        self.dp = dp
+        self.queues: List[asyncio.Queue] = [asyncio.Queue(maxsize=queue_size) for _ in range(workers)]
+        self._tasks: List[asyncio.Task] = []
+
+    def start(self):
+        for queue in self.queues:
+            self._tasks.append(asyncio.create_task(self._worker(queue)))
+        self.logger.info('started %s workers', len(self.queues))
+
+    async def stop(self, timeout: float = 10):
+        try:
+            await asyncio.wait_for(asyncio.gather(*[queue.join() for queue in self.queues]), timeout)
+        except asyncio.TimeoutError:
+            self.logger.warning('stop. %s updates were not processed', self.qsize())
+        for task in self._tasks:
+            task.cancel()
+        self._tasks = []
+
+    def qsize(self) -> int:
+        return sum(queue.qsize() for queue in self.queues)
+
+    def _queue_for(self, update: types.Update) -> asyncio.Queue:
+        user = extract_user(update)
+        key = user.id if user else update.update_id
+        return self.queues[key % len(self.queues)]
+
+    def submit(self, update: types.Update) -> bool:
+        """
+        :return: False if the queue of the update's shard is full
+        """
+        try:
+            self._queue_for(update).put_nowait(update)
+        except asyncio.QueueFull:
+            return False
+        return True
+
+    async def put(self, update: types.Update):
+        """
+        Wait for free space in the queue of the update's shard
+        """
+        await self._queue_for(update).put(update)
+
+    async def _worker(self, queue: asyncio.Queue):
+        Dispatcher.set_current(self.dp)
+        Bot.set_current(self.dp.bot)
+        while True:
+            update = await queue.get()
+            try:
+                await self.dp.process_updates([update])
+            except Exception:
+                self.logger.error(''.join(traceback.format_exc()))
+            finally:
+                queue.task_done()
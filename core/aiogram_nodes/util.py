@@ -1,22 +1,57 @@
 import base64
 import binascii
-from typing import Any
+from typing import Any, Optional
 
 import ujson
-from aiogram import types, Dispatcher
+from aiogram import types
 
+from core.aiogram_nodes import callback_codec
+from core.aiogram_nodes.context import current_user
 from core.logging_config import root_logger
 from db.models import User
 
 
+class classproperty:
+    """
+    Read-only property computed from the class, also available on instances
+    """
+
+    def __init__(self, fget):
+        self.fget = fget
+
+    def __get__(self, instance, owner):
+        return self.fget(owner)
+
+
+class Shortcuts:
+    BUTTON_TYPE = 't'
+    TRANSITION_TO_NODE = 'n'
+    TRANSITION_TO_NODE_PROPS = 'x'
+
+
 def encode_callback_data(data: dict) -> str:
-    out = base64.b64encode(ujson.dumps(data).encode('utf-8')).decode('utf-8')
+    out = callback_codec.encode(data[Shortcuts.TRANSITION_TO_NODE], data.get(Shortcuts.TRANSITION_TO_NODE_PROPS))
     if len(out) > 64:
         raise ValueError('Too much callback data =)')
     return out
 
 
 def decode_callback_data(encoded: str) -> dict:
+    if encoded.startswith(LEGACY_PREFIX):
+        return _decode_legacy_callback_data(encoded)
+    try:
+        state, props = callback_codec.decode(encoded)
+    except ValueError:
+        return {}
+    return {Shortcuts.TRANSITION_TO_NODE: state, Shortcuts.TRANSITION_TO_NODE_PROPS: props}
+
+
+# buttons rendered before the compact codec: base64 of a JSON object. their amounts are floats of TON,
+# which Money props accept as such
+LEGACY_PREFIX = 'ey'
+
+
+def _decode_legacy_callback_data(encoded: str) -> dict:
     try:
         out = ujson.loads(base64.b64decode(encoded))
     except (ujson.JSONDecodeError, binascii.Error):
@@ -32,9 +67,19 @@ def is_cq(update: Any):
     return isinstance(update, types.CallbackQuery)
 
 
+def extract_user(update: types.Update) -> Optional[types.User]:
+    if update.message:
+        return update.message.from_user
+    elif update.callback_query:
+        return update.callback_query.from_user
+    elif update.inline_query:
+        return update.inline_query.from_user
+    return None
+
+
 def get_current_user() -> User:
-    user = Dispatcher.get_current().current_user
+    user = current_user()
     if user:
         return user
-    root_logger.error('TelegramDispatcher.current_user is none')
+    root_logger.error('current user is none')
     raise ValueError('user is none')
\ No newline at end of file
@@ -1,30 +1,108 @@
-from decimal import Decimal
-from typing import List
+from typing import List, Optional, Dict
 
 import ujson
 from pydantic import BaseModel
 import hashlib
 import hmac
 from core.constants import FILES_DIR
+from core.money import Ton
 
 
 class Wallet(BaseModel):
-    min_deposit: Decimal
-    max_deposit: Decimal
-    min_withdraw: Decimal
-    max_withdraw: Decimal
+    min_deposit: Ton
+    max_deposit: Ton
+    min_withdraw: Ton
+    max_withdraw: Ton
 
 
 class Game(BaseModel):
-    min_bet: Decimal
-    max_bet: Decimal
+    min_bet: Ton
+    max_bet: Ton
 
 class WebApps(BaseModel):
     mines: str
     coinflip: str
 
+
+class Workers(BaseModel):
+    count: int = 16
+    queue_size: int = 100
+    shed_load: bool = True
+
+
+class UserCacheConfig(BaseModel):
+    size: int = 10000
+    ttl: float = 300
+    flush_interval: float = 10
+
+
+class CryptoPayConfig(BaseModel):
+    timeout: float = 10
+    retries: int = 3
+    breaker_threshold: int = 5
+    breaker_reset_timeout: float = 30
+
+
+class LedgerConfig(BaseModel):
+    # entries recorded concurrently are written together
+    max_batch: int = 500
+    max_delay: float = 0.002
+
+
+class OutboxConfig(BaseModel):
+    # Telegram limits: ~30 messages per second overall, 1 per second in a chat
+    global_rate: float = 30
+    chat_rate: float = 1
+    max_retries: int = 3
+
+
+class OperatorDigestConfig(BaseModel):
+    # seconds between digests
+    interval: float = 300
+    # events listed per kind
+    top: int = 5
+
+
+class RenderCacheConfig(BaseModel):
+    size: int = 5000
+
+
+class LoggingConfig(BaseModel):
+    level: str = 'INFO'
+    # 'json' or 'text'
+    format: str = 'json'
+    # logger name -> level, e.g. {"Node": "WARNING"} for all nodes
+    levels: Dict[str, str] = {'aiogram': 'WARNING', 'asyncio': 'WARNING'}
+    # INFO and DEBUG records per second kept while processing updates, the rest is dropped
+    update_rate: float = 200
+    # records waiting for the writer thread. when it is full, records are dropped
+    queue_size: int = 10000
+
+
+class TracingConfig(BaseModel):
+    # share of updates traced, 0..1
+    sample_rate: float = 0.01
+    # finished traces kept in memory
+    buffer_size: int = 500
+    # seconds, traces at least this long are logged. null to disable
+    slow_threshold: Optional[float] = 1
+    # always traced, e.g. a user who reported slowness
+    users: List[int] = list()
+    # GET /debug/traces. traces contain user ids, keep it off on public servers
+    endpoint: bool = False
+
+
+class MetricsConfig(BaseModel):
+    # GET /metrics on the main app
+    enabled: bool = True
+
+
 class Config(BaseModel):
     mongodb: str
+    # 'mongodb' or 'memory': in-process collections for load tests and local runs, lost on exit
+    storage: str = 'mongodb'
+    # None: used if the server is a replica set or mongos
+    mongodb_transactions: Optional[bool] = None
     wallet: Wallet
     webapps: WebApps
     game: Game
@@ -39,6 +117,17 @@ class Config(BaseModel):
     referral_deposit_bonus: int
     debug_whitelist: List[int] = list()
 
+    workers: Workers = Workers()
+    user_cache: UserCacheConfig = UserCacheConfig()
+    crypto_pay: CryptoPayConfig = CryptoPayConfig()
+    ledger: LedgerConfig = LedgerConfig()
+    outbox: OutboxConfig = OutboxConfig()
+    operator_digest: OperatorDigestConfig = OperatorDigestConfig()
+    render_cache: RenderCacheConfig = RenderCacheConfig()
+    metrics: MetricsConfig = MetricsConfig()
+    tracing: TracingConfig = TracingConfig()
+    logging: LoggingConfig = LoggingConfig()
+
     secret: bytes = b''
 
     def __init__(self, **data):
@@ -0,0 +1,164 @@
+import asyncio
+import random
+import time
+from typing import Optional, Any
+
+import aiohttp
+import ujson
+from pydantic import BaseModel, ValidationError
+from ujson import JSONDecodeError
+
+from core import metrics
+from core.config_loader import config
+from core.constants import CRYPTO_PAY_URL
+from core.logging_config import root_logger
+from core.money import Money
+
+
+class CryptoPayError(Exception):
+    pass
+
+
+class CryptoPayUnavailable(CryptoPayError):
+    """
+    Crypto Pay did not answer, or the circuit breaker is open
+    """
+
+
+class CryptoPayInvoice(BaseModel):
+    invoice_id: int
+    hash: str
+    status: str
+    asset: str
+    amount: Money
+    pay_url: str = ''
+
+
+class CryptoPayTransfer(BaseModel):
+    transfer_id: int
+    user_id: int
+    asset: str
+    amount: Money
+    status: str
+
+
+class CircuitBreaker:
+    """
+    Opens after ``threshold`` consecutive failures and fails fast for ``reset_timeout`` seconds.
+    After that calls are let through again: a success closes the breaker, a failure opens it again.
+    """
+
+    def __init__(self, threshold: int, reset_timeout: float):
+        self.threshold = threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at = 0.0
+
+    @property
+    def is_open(self) -> bool:
+        return self.failures >= self.threshold and time.monotonic() - self.opened_at < self.reset_timeout
+
+    def success(self):
+        self.failures = 0
+
+    def failure(self):
+        self.failures += 1
+        if self.failures >= self.threshold:
+            self.opened_at = time.monotonic()
+
+
+class CryptoPayClient:
+    """
+    Long-lived Crypto Pay API client. Owned by the aiohttp app: ``start`` on startup, ``close`` on shutdown.
+    """
+    logger = root_logger.getChild('CryptoPayClient')
+
+    def __init__(self, token: str, url: str = CRYPTO_PAY_URL, timeout: float = 10, retries: int = 3,
+                 backoff: float = 0.5, breaker_threshold: int = 5, breaker_reset_timeout: float = 30,
+                 pool_size: int = 20):
+        self.token = token
+        self.url = url
+        self.timeout = timeout
+        self.retries = retries
+        self.backoff = backoff
+        self.pool_size = pool_size
+        self.breaker = CircuitBreaker(breaker_threshold, breaker_reset_timeout)
+        self._session: Optional[aiohttp.ClientSession] = None
+
+    async def start(self):
+        if self._session is None or self._session.closed:
+            self._session = aiohttp.ClientSession(
+                headers={'Crypto-Pay-API-Token': self.token},
+                timeout=aiohttp.ClientTimeout(total=self.timeout),
+                connector=aiohttp.TCPConnector(limit=self.pool_size, keepalive_timeout=60),
+            )
+
+    async def close(self):
+        if self._session is not None:
+            await self._session.close()
+            self._session = None
+
+    async def _call(self, method: str, data: dict, idempotent: bool) -> Any:
+        start = time.perf_counter()
+        try:
+            return await self._call_with_retries(method, data, idempotent)
+        except CryptoPayError:
+            metrics.crypto_pay_errors.labels(method).inc()
+            raise
+        finally:
+            metrics.crypto_pay_requests.labels(method).observe(time.perf_counter() - start)
+
+    async def _call_with_retries(self, method: str, data: dict, idempotent: bool) -> Any:
+        if self.breaker.is_open:
+            raise CryptoPayUnavailable(f'{method}: circuit breaker is open')
+        await self.start()
+        attempts = self.retries if idempotent else 1
+        for attempt in range(1, attempts + 1):
+            try:
+                async with self._session.post(self.url + method, data=data) as resp:
+                    text = await resp.text()
+                    if resp.status >= 500:
+                        raise aiohttp.ClientResponseError(resp.request_info, resp.history, status=resp.status,
+                                                          message=text)
+                payload = ujson.loads(text)
+            except (aiohttp.ClientError, asyncio.TimeoutError, JSONDecodeError) as e:
+                self.breaker.failure()
+                # the repr of aiohttp errors contains request headers, i.e. the API token
+                reason = f'HTTP {e.status}' if isinstance(e, aiohttp.ClientResponseError) else type(e).__name__
+                self.logger.warning('%s failed, attempt %s/%s: %s', method, attempt, attempts, reason)
+                if attempt == attempts or self.breaker.is_open:
+                    raise CryptoPayUnavailable(f'{method}: {reason}')
+                # exponential backoff with full jitter
+                await asyncio.sleep(random.uniform(0, self.backoff * 2 ** (attempt - 1)))
+                continue
+            self.breaker.success()
+            if not payload.get('ok'):
+                raise CryptoPayError(f'{method}: {payload.get("error")}')
+            return payload['result']
+
+    async def create_invoice(self, asset: str, amount: Money) -> CryptoPayInvoice:
+        # not idempotent: a retry could create a second invoice
+        result = await self._call('createInvoice', {'asset': asset, 'amount': str(amount)}, idempotent=False)
+        return self._parse(CryptoPayInvoice, result)
+
+    async def transfer(self, user_id: int, asset: str, amount: Money, spend_id: str) -> CryptoPayTransfer:
+        # spend_id makes repeated transfers a no-op on the Crypto Pay side
+        result = await self._call('transfer', {'user_id': user_id,
+                                               'asset': asset,
+                                               'amount': str(amount),
+                                               'spend_id': spend_id}, idempotent=True)
+        return self._parse(CryptoPayTransfer, result)
+
+    @staticmethod
+    def _parse(model, result: Any):
+        try:
+            return model.parse_obj(result)
+        except ValidationError as e:
+            raise CryptoPayError(f'unexpected response {result}: {e}')
+
+
+crypto_pay = CryptoPayClient(token=config.crypto_pay_token,
+                             timeout=config.crypto_pay.timeout,
+                             retries=config.crypto_pay.retries,
+                             breaker_threshold=config.crypto_pay.breaker_threshold,
+                             breaker_reset_timeout=config.crypto_pay.breaker_reset_timeout)
@@ -0,0 +1,69 @@
+import asyncio
+import socket
+import traceback
+from typing import Dict, Callable, Optional, Any
+
+import ujson
+
+from core.logging_config import root_logger
+
+
+class InvalidationBus:
+    """
+    Broadcasts cache invalidations (and operator digest events) to the other worker processes of ``runner.py``.
+    Every worker is connected to the master with a socket pair; the master relays each message
+    to all other workers. Without a connection (one process) ``publish`` does nothing.
+
+    Delivery is asynchronous: another worker may serve a stale entry until the message arrives.
+    """
+    logger = root_logger.getChild('InvalidationBus')
+
+    def __init__(self):
+        self._handlers: Dict[str, Callable[[Any], None]] = {}
+        self._sock: Optional[socket.socket] = None
+        self._writer: Optional[asyncio.StreamWriter] = None
+        self._reader_task: Optional[asyncio.Task] = None
+
+    def subscribe(self, channel: str, handler: Callable[[Any], None]):
+        """
+        :param handler: drops ``key`` from the local cache. Must not publish
+        """
+        self._handlers[channel] = handler
+
+    def connect(self, sock: socket.socket):
+        self._sock = sock
+
+    def publish(self, channel: str, key: Any):
+        if self._writer is None:
+            return
+        self._writer.write(ujson.dumps([channel, key]).encode('utf-8') + b'\n')
+
+    async def start(self):
+        if self._sock is None:
+            return
+        reader, self._writer = await asyncio.open_unix_connection(sock=self._sock)
+        self._reader_task = asyncio.create_task(self._read(reader))
+
+    async def _read(self, reader: asyncio.StreamReader):
+        while True:
+            line = await reader.readline()
+            if not line:
+                self.logger.warning('connection to the master is closed')
+                self._writer = None
+                return
+            try:
+                channel, key = ujson.loads(line)
+                self._handlers[channel](key)
+            except Exception:
+                self.logger.error(''.join(traceback.format_exc()))
+
+    async def close(self):
+        if self._reader_task:
+            self._reader_task.cancel()
+            self._reader_task = None
+        if self._writer:
+            self._writer.close()
+            self._writer = None
+
+
+bus = InvalidationBus()
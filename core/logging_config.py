@@ -1,24 +1,186 @@
+"""
+Logging without blocking the event loop: handlers only put records into a queue,
+a background thread formats and writes them to stdout.
+
+Records carry the user_id, update_id and node of the update being processed (see ``bind``).
+INFO and DEBUG records of updates are sampled by a token bucket, so a burst of updates
+can't flood the queue; WARNING and above are always kept unless the queue is full.
+"""
+import atexit
 import logging
+import os
+import queue
+import sys
+import threading
+import time
+from contextvars import ContextVar, Token
+from datetime import datetime
 from logging.config import dictConfig
+from logging.handlers import QueueHandler, QueueListener
+from typing import Optional
 
-logging_config = dict(
-    version=1,
-    formatters={
-        'f': {'format': '%(asctime)s | %(name)-23s | %(levelname)-5s | %(message)s'}
-    },
-    handlers={
-        'h': {'class': 'logging.StreamHandler',
-              'formatter': 'f',
-              'level': logging.DEBUG,
-              'stream': 'ext://sys.stdout', }
-    },
-    root={
-        'handlers': ['h'],
-        'level': logging.DEBUG,
-    },
-)
-
-dictConfig(logging_config)
+import ujson
+
+from core import metrics
+from core.config_loader import config
+
+CONTEXT_FIELDS = ('user_id', 'update_id', 'node')
+TEXT_FORMAT = '%(asctime)s | %(name)-23s | %(levelname)-5s | %(message)s'
+
+# fields of the update being processed, a new dict per update
+_fields: ContextVar[Optional[dict]] = ContextVar('log_fields', default=None)
+
+
+def new_log_context() -> Token:
+    return _fields.set({})
+
+
+def reset_log_context(token: Token):
+    _fields.reset(token)
+
+
+def bind(**fields):
+    """
+    Adds ``fields`` to every record logged while the current update is processed
+    """
+    current = _fields.get()
+    if current is not None:
+        current.update(fields)
+
+
+class UpdateContextFilter(logging.Filter):
+    """
+    Copies the update fields to the record and samples records of updates below WARNING
+    """
+
+    def __init__(self, rate: float):
+        super().__init__()
+        self.rate = rate
+        self.tokens = rate
+        self.updated = time.monotonic()
+        self.sampled_out = 0
+        self._lock = threading.Lock()
+
+    def _take(self) -> bool:
+        with self._lock:
+            now = time.monotonic()
+            self.tokens = min(self.rate, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            if self.tokens < 1:
+                return False
+            self.tokens -= 1
+            return True
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        fields = _fields.get()
+        if fields is None:
+            return True
+        if record.levelno < logging.WARNING and not self._take():
+            self.sampled_out += 1
+            return False
+        for name in CONTEXT_FIELDS:
+            setattr(record, name, fields.get(name))
+        return True
+
+
+class NonBlockingQueueHandler(QueueHandler):
+    """
+    Drops records instead of waiting when the writer falls behind
+    """
+
+    def __init__(self, queue_: queue.Queue):
+        super().__init__(queue_)
+        self.dropped = 0
 
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        # the message and traceback are rendered now: the arguments may change before the writer gets to them.
+        # the rest of the formatting happens in the writer thread
+        record.message = record.getMessage()
+        record.msg = record.message
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+    def enqueue(self, record: logging.LogRecord):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record: logging.LogRecord) -> str:
+        out = {
+            'time': datetime.fromtimestamp(record.created).isoformat(timespec='milliseconds'),
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage(),
+        }
+        for name in CONTEXT_FIELDS:
+            value = getattr(record, name, None)
+            if value is not None:
+                out[name] = value
+        if record.exc_text:
+            out['exc'] = record.exc_text
+        return ujson.dumps(out, ensure_ascii=False)
+
+
+class TextFormatter(logging.Formatter):
+    def format(self, record: logging.LogRecord) -> str:
+        text = super().format(record)
+        fields = ' '.join(f'{name}={getattr(record, name)}' for name in CONTEXT_FIELDS
+                          if getattr(record, name, None) is not None)
+        return f'{text} | {fields}' if fields else text
+
+
+def _stream_handler() -> logging.Handler:
+    handler = logging.StreamHandler(sys.stdout)
+    handler.setFormatter(JsonFormatter() if config.logging.format == 'json' else TextFormatter(TEXT_FORMAT))
+    return handler
+
+
+def _start_listener() -> QueueListener:
+    listener = QueueListener(queue_handler.queue, _stream_handler())
+    listener.start()
+    return listener
+
+
+def _restart_after_fork():
+    # the writer thread does not survive fork(), the queue may be locked by it
+    global listener
+    context_filter._lock = threading.Lock()
+    queue_handler.queue = queue.Queue(maxsize=config.logging.queue_size)
+    listener = _start_listener()
+
+
+def stop_logging():
+    """
+    Writes the queued records and stops the writer thread
+    """
+    if listener._thread is not None:
+        listener.stop()
+
+
+queue_handler = NonBlockingQueueHandler(queue.Queue(maxsize=config.logging.queue_size))
+context_filter = UpdateContextFilter(rate=config.logging.update_rate)
+queue_handler.addFilter(context_filter)
+
+dictConfig(dict(
+    version=1,
+    disable_existing_loggers=False,
+    loggers={name: {'level': level} for name, level in config.logging.levels.items()},
+))
 root_logger = logging.getLogger()
-root_logger.setLevel(logging.DEBUG)
+root_logger.handlers = [queue_handler]
+root_logger.setLevel(config.logging.level)
+
+listener = _start_listener()
+os.register_at_fork(after_in_child=_restart_after_fork)
+atexit.register(stop_logging)
+
+metrics.registry.gauge('bot_log_records_sampled_out_total', 'INFO and DEBUG records of updates over the rate',
+                       lambda: context_filter.sampled_out, type='counter')
+metrics.registry.gauge('bot_log_records_dropped_total', 'Records dropped because the log queue was full',
+                       lambda: queue_handler.dropped, type='counter')
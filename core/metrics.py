@@ -0,0 +1,195 @@
+"""
+Process-local metrics in the Prometheus text format, served at ``/metrics``.
+
+Children (one per combination of label values) are created on first use and should be resolved once
+and kept by the caller, so recording a value is a list increment without building label strings.
+With runner.py every worker has its own metrics, see its ``--metrics-port``.
+"""
+import bisect
+from typing import Tuple, Dict, List, Callable, Union
+
+from aiohttp import web
+
+# seconds, from a cached render to a slow Crypto Pay call
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+
+def _escape(value: str) -> str:
+    return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format_labels(names: Tuple[str, ...], values: Tuple[str, ...]) -> str:
+    return ','.join(f'{name}="{_escape(str(value))}"' for name, value in zip(names, values))
+
+
+def _format_value(value: float) -> str:
+    return str(int(value)) if isinstance(value, int) or value.is_integer() else repr(value)
+
+
+class CounterChild:
+    __slots__ = ('value',)
+
+    def __init__(self):
+        self.value = 0
+
+    def inc(self, amount: float = 1):
+        self.value += amount
+
+
+class HistogramChild:
+    __slots__ = ('bounds', 'counts', 'sum')
+
+    def __init__(self, bounds: Tuple[float, ...]):
+        self.bounds = bounds
+        # the last slot counts values above every bound
+        self.counts = [0] * (len(bounds) + 1)
+        self.sum = 0.0
+
+    def observe(self, value: float):
+        self.counts[bisect.bisect_left(self.bounds, value)] += 1
+        self.sum += value
+
+
+class _Metric:
+    type = ''
+
+    def __init__(self, name: str, help: str, labels: Tuple[str, ...] = ()):
+        self.name = name
+        self.help = help
+        self.label_names = labels
+        # label values -> (formatted labels, child)
+        self._children: Dict[Tuple[str, ...], Tuple[str, Union[CounterChild, HistogramChild]]] = {}
+
+    def _new_child(self):
+        raise NotImplementedError
+
+    def labels(self, *values) -> Union[CounterChild, HistogramChild]:
+        entry = self._children.get(values)
+        if entry is None:
+            if len(values) != len(self.label_names):
+                raise ValueError(f'{self.name} expects labels {self.label_names}, got {values}')
+            entry = self._children[values] = (_format_labels(self.label_names, values), self._new_child())
+        return entry[1]
+
+    def _samples(self, labels: str, child) -> List[str]:
+        raise NotImplementedError
+
+    def render(self) -> List[str]:
+        lines = [f'# HELP {self.name} {self.help}', f'# TYPE {self.name} {self.type}']
+        for labels, child in self._children.values():
+            lines.extend(self._samples(labels, child))
+        return lines
+
+
+class Counter(_Metric):
+    type = 'counter'
+
+    def _new_child(self) -> CounterChild:
+        return CounterChild()
+
+    def _samples(self, labels: str, child: CounterChild) -> List[str]:
+        return [f'{self.name}{{{labels}}} {_format_value(child.value)}' if labels
+                else f'{self.name} {_format_value(child.value)}']
+
+
+class Histogram(_Metric):
+    type = 'histogram'
+
+    def __init__(self, name: str, help: str, labels: Tuple[str, ...] = (),
+                 buckets: Tuple[float, ...] = DEFAULT_BUCKETS):
+        super().__init__(name, help, labels)
+        self.buckets = tuple(sorted(buckets))
+        self._bucket_labels = [f'le="{bound}"' for bound in self.buckets] + ['le="+Inf"']
+
+    def _new_child(self) -> HistogramChild:
+        return HistogramChild(self.buckets)
+
+    def _samples(self, labels: str, child: HistogramChild) -> List[str]:
+        prefix = labels + ',' if labels else ''
+        lines = []
+        cumulative = 0
+        for le, count in zip(self._bucket_labels, child.counts):
+            cumulative += count
+            lines.append(f'{self.name}_bucket{{{prefix}{le}}} {cumulative}')
+        suffix = f'{{{labels}}}' if labels else ''
+        lines.append(f'{self.name}_sum{suffix} {_format_value(child.sum)}')
+        lines.append(f'{self.name}_count{suffix} {cumulative}')
+        return lines
+
+
+class Gauge:
+    """
+    Value read from ``function`` at scrape time, e.g. a queue length or a counter kept by another object
+    """
+
+    def __init__(self, name: str, help: str, function: Callable[[], float], type: str = 'gauge'):
+        self.name = name
+        self.help = help
+        self.function = function
+        self.type = type
+
+    def render(self) -> List[str]:
+        return [f'# HELP {self.name} {self.help}', f'# TYPE {self.name} {self.type}',
+                f'{self.name} {_format_value(self.function())}']
+
+
+class Registry:
+    def __init__(self):
+        self._metrics: Dict[str, Union[_Metric, Gauge]] = {}
+
+    def register(self, metric):
+        if metric.name in self._metrics:
+            raise ValueError(f'metric {metric.name} is already registered')
+        self._metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name: str, help: str, labels: Tuple[str, ...] = ()) -> Counter:
+        return self.register(Counter(name, help, labels))
+
+    def histogram(self, name: str, help: str, labels: Tuple[str, ...] = (),
+                  buckets: Tuple[float, ...] = DEFAULT_BUCKETS) -> Histogram:
+        return self.register(Histogram(name, help, labels, buckets))
+
+    def gauge(self, name: str, help: str, function: Callable[[], float], type: str = 'gauge') -> Gauge:
+        return self.register(Gauge(name, help, function, type))
+
+    def render(self) -> str:
+        lines = []
+        for metric in self._metrics.values():
+            lines.extend(metric.render())
+        return '\n'.join(lines) + '\n'
+
+
+registry = Registry()
+
+updates = registry.counter('bot_updates_total', 'Telegram updates received', ('type',))
+middleware_rejections = registry.counter('bot_middleware_rejections_total', 'Updates rejected by a middleware',
+                                         ('middleware',))
+node_dispatch = registry.histogram('bot_node_dispatch_seconds',
+                                   'Node.dispatch duration, including the send and the nodes it switches to',
+                                   ('node', 'state'))
+db_operations = registry.histogram('bot_db_operation_seconds', 'Storage operation duration',
+                                   ('collection', 'operation'))
+bot_api_requests = registry.histogram('bot_api_request_seconds', 'Bot API request duration', ('method',))
+bot_api_errors = registry.counter('bot_api_errors_total', 'Failed Bot API requests', ('method',))
+crypto_pay_requests = registry.histogram('bot_crypto_pay_request_seconds', 'Crypto Pay call duration with retries',
+                                         ('method',))
+crypto_pay_errors = registry.counter('bot_crypto_pay_errors_total', 'Failed Crypto Pay calls', ('method',))
+# the rate limits and RetryAfter keep messages queued for seconds
+outbox_send = registry.histogram('bot_outbox_send_seconds', 'Outbox message time from enqueue to the end of the send',
+                                 ('result',), buckets=(0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60))
+
+
+async def metrics_handler(request: web.Request) -> web.Response:
+    return web.Response(body=registry.render().encode('utf-8'),
+                        headers={'Content-Type': 'text/plain; version=0.0.4; charset=utf-8',
+                                 'Cache-Control': 'no-store'})
+
+
+def metrics_app() -> web.Application:
+    """
+    An application serving only ``/metrics``
+    """
+    app = web.Application()
+    app.router.add_route('GET', '/metrics', metrics_handler)
+    return app
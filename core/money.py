@@ -0,0 +1,148 @@
+"""
+Amounts of TON as integer nano-TON (1 TON = 10^9 nano).
+
+``Money(5)`` is 5 nano-TON, amounts in TON are made with ``Money.ton``::
+
+    Money.ton('1.5') + Money.ton(2)     # Money('3.50')
+    str(Money.ton('0.1'))               # '0.10'
+
+The database keeps amounts as Decimal128 TON, as the webapps write them: bson encodes ``Money`` as
+Decimal128 (in documents, filters, ``$inc`` and bulk writes alike) and ``db.codecs`` decodes it to ``Decimal``.
+Pydantic fields of type ``Money`` take ints as nano-TON (e.g. callback data), Decimals and strings as TON
+(the database, Crypto Pay amounts), floats as TON by their ``repr`` (legacy callback data).
+Raw values read from the database are converted with ``Money.validate``, never ``Money(...)``.
+Amounts written in TON by people, e.g. in the config, are declared as ``Ton``.
+"""
+import decimal
+from decimal import Decimal
+from typing import Union
+
+from bson.decimal128 import Decimal128
+
+DECIMALS = 9
+NANO = 10 ** DECIMALS
+
+
+class Money(int):
+    __slots__ = ()
+    # encoded by bson as Decimal128 TON, see ``bid``
+    _type_marker = Decimal128._type_marker
+
+    def __new__(cls, value: int = 0):
+        if not isinstance(value, int):
+            raise TypeError(f'Money({value!r}): nano-TON must be an int, see Money.ton and Money.validate')
+        return int.__new__(cls, value)
+
+    @classmethod
+    def ton(cls, value: Union[int, str, Decimal], places: int = DECIMALS) -> 'Money':
+        """
+        :param places: decimal places kept, the rest is rounded down (towards zero)
+        :raises ValueError: if ``value`` is not a finite number
+        """
+        if isinstance(value, int):
+            return Money(value * NANO)
+        try:
+            value = Decimal(value)
+        except decimal.InvalidOperation:
+            raise ValueError(f'{value!r} is not a number')
+        if not value.is_finite():
+            raise ValueError(f'{value!r} is not a number')
+        return Money(int(value.scaleb(places)) * 10 ** (DECIMALS - places))
+
+    @classmethod
+    def __get_validators__(cls):
+        yield cls.validate
+
+    @classmethod
+    def validate(cls, value) -> 'Money':
+        if isinstance(value, Money):
+            return value
+        if isinstance(value, int) and not isinstance(value, bool):
+            return Money(value)
+        if isinstance(value, (Decimal, str)):
+            return Money.ton(value)
+        if isinstance(value, float):
+            # as written in the JSON, not its binary approximation
+            return Money.ton(repr(value))
+        raise TypeError(f'{type(value).__name__} is not an amount of money')
+
+    def to_decimal(self) -> Decimal:
+        """
+        The amount in TON
+        """
+        return Decimal(int(self)).scaleb(-DECIMALS)
+
+    @property
+    def bid(self) -> bytes:
+        # the Decimal128 encoding read by bson for values with its ``_type_marker``
+        return Decimal128(self.to_decimal()).bid
+
+    def percent(self, percent: Union[int, Decimal], places: int = 2) -> 'Money':
+        """
+        ``percent`` % of the amount, rounded down to ``places`` decimal places of TON
+        """
+        step = 10 ** (DECIMALS - places)
+        return Money(int(Decimal(int(self)) * percent / (100 * step)) * step)
+
+    def __add__(self, other):
+        if not isinstance(other, int):
+            raise TypeError(f'cannot add {type(other).__name__} to Money')
+        return Money(int.__add__(self, other))
+
+    __radd__ = __add__
+
+    def __sub__(self, other):
+        if not isinstance(other, int):
+            raise TypeError(f'cannot subtract {type(other).__name__} from Money')
+        return Money(int.__sub__(self, other))
+
+    def __rsub__(self, other):
+        if not isinstance(other, int):
+            raise TypeError(f'cannot subtract Money from {type(other).__name__}')
+        return Money(int.__rsub__(self, other))
+
+    def __mul__(self, other):
+        if not isinstance(other, int):
+            raise TypeError(f'cannot multiply Money by {type(other).__name__}, see Money.percent')
+        return Money(int.__mul__(self, other))
+
+    __rmul__ = __mul__
+
+    def __neg__(self):
+        return Money(int.__neg__(self))
+
+    def __pos__(self):
+        return self
+
+    def __abs__(self):
+        return Money(int.__abs__(self))
+
+    def __str__(self):
+        """
+        Exact, with at least two decimal places: ``12.50``, ``0.000000001``
+        """
+        units, nano = divmod(int.__abs__(self), NANO)
+        fraction = f'{nano:09d}'.rstrip('0').ljust(2, '0')
+        return f'-{units}.{fraction}' if self < 0 else f'{units}.{fraction}'
+
+    def __format__(self, format_spec: str):
+        return format(str(self), format_spec)
+
+    def __repr__(self):
+        return f"Money('{self}')"
+
+
+class Ton(Money):
+    """
+    Annotation of amounts written in TON by people: ``"min_withdraw": 0.5`` in the config is 0.5 TON
+    """
+    __slots__ = ()
+
+    @classmethod
+    def validate(cls, value) -> Money:
+        if isinstance(value, Money):
+            return value
+        if isinstance(value, float):
+            # as written in the file, not its binary approximation
+            value = repr(value)
+        return Money.ton(value)
@@ -0,0 +1,117 @@
+import asyncio
+import heapq
+import itertools
+import time
+import traceback
+from collections import deque
+from typing import Dict, Optional, List, Tuple
+
+from core.config_loader import config
+from core.invalidation import bus
+from core.logging_config import root_logger
+from core.money import Money
+from core.outbox import outbox
+
+
+class Event:
+    NEW_USER = 'New users'
+    DEPOSIT = 'Deposits'
+
+
+class _Bucket:
+    __slots__ = ('count', 'total', 'top', 'latest')
+
+    def __init__(self, top: int):
+        self.count = 0
+        self.total = Money(0)
+        # min-heap of (amount, seq, line): the largest events
+        self.top: List[Tuple[Money, int, str]] = []
+        # events without amount: the most recent ones
+        self.latest = deque(maxlen=top)
+
+
+class OperatorDigest:
+    """
+    Notifications for the operator. Routine events are collected and sent periodically as one digest,
+    events that need an action are sent right away.
+    Of the workers of runner.py only one collects the digest, the others forward their events to it.
+    """
+    logger = root_logger.getChild('OperatorDigest')
+
+    def __init__(self, chat_id: int, interval: float, top: int):
+        self.chat_id = chat_id
+        self.interval = interval
+        self.top = top
+        self._buckets: Dict[str, _Bucket] = {}
+        self._seq = itertools.count()
+        self._since = time.monotonic()
+        self._flusher: Optional[asyncio.Task] = None
+        # False in the workers of runner.py but the first one
+        self.collecting = True
+
+    def add(self, event: str, line: str, amount: Optional[Money] = None):
+        if not self.collecting:
+            bus.publish('digest', [event, line, amount])
+            return
+        bucket = self._buckets.get(event)
+        if bucket is None:
+            bucket = self._buckets[event] = _Bucket(self.top)
+        bucket.count += 1
+        if amount is None:
+            bucket.latest.append(line)
+        else:
+            bucket.total += amount
+            item = (amount, next(self._seq), line)
+            if len(bucket.top) < self.top:
+                heapq.heappush(bucket.top, item)
+            else:
+                heapq.heappushpop(bucket.top, item)
+        if self._flusher is None or self._flusher.done():
+            self._flusher = asyncio.create_task(self._flush_periodically())
+
+    def _receive(self, message: list):
+        if self.collecting:
+            event, line, amount = message
+            self.add(event, line, None if amount is None else Money(amount))
+
+    def send_now(self, text: str, **kwargs):
+        outbox.notify(self.chat_id, text=text, **kwargs)
+
+    def _compile(self) -> str:
+        minutes = round((time.monotonic() - self._since) / 60)
+        lines = [f'DIGEST, last {minutes} min']
+        for event, bucket in self._buckets.items():
+            lines.append('')
+            if bucket.top:
+                lines.append(f'{event}: {bucket.count}, total {bucket.total}')
+                lines += [f'  {line}' for _, _, line in sorted(bucket.top, reverse=True)]
+            else:
+                lines.append(f'{event}: {bucket.count}')
+                lines += [f'  {line}' for line in bucket.latest]
+        return '\n'.join(lines)
+
+    def flush(self):
+        if self._buckets:
+            self.send_now(self._compile())
+        self._buckets = {}
+        self._since = time.monotonic()
+
+    async def _flush_periodically(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                self.flush()
+            except Exception:
+                self.logger.error(''.join(traceback.format_exc()))
+
+    async def close(self):
+        if self._flusher:
+            self._flusher.cancel()
+            self._flusher = None
+        self.flush()
+
+
+operator_digest = OperatorDigest(chat_id=config.operator_id,
+                                 interval=config.operator_digest.interval,
+                                 top=config.operator_digest.top)
+bus.subscribe('digest', operator_digest._receive)
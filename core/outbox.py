@@ -0,0 +1,218 @@
+import asyncio
+import heapq
+import itertools
+import time
+from typing import Optional, Dict, List, Tuple, Callable, Awaitable, Set
+
+from aiogram import Bot
+from aiogram.utils.exceptions import RetryAfter
+
+from bot import bot as default_bot
+from core import metrics
+from core.config_loader import config
+from core.logging_config import root_logger
+
+_sent_latency = metrics.outbox_send.labels('sent')
+_failed_latency = metrics.outbox_send.labels('failed')
+
+
+class Priority:
+    # replies to the user's own actions go first
+    INTERACTIVE = 0
+    NOTIFICATION = 1
+
+
+class TokenBucket:
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+
+    def wait_time(self) -> float:
+        """
+        :return: seconds until a token is available
+        """
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        return 0 if self.tokens >= 1 else (1 - self.tokens) / self.rate
+
+    def consume(self):
+        self.tokens -= 1
+
+
+class _Job:
+    __slots__ = ('chat_id', 'call', 'future', 'enqueued', 'retries')
+
+    def __init__(self, chat_id: int, call: Callable[[], Awaitable], future: asyncio.Future):
+        self.chat_id = chat_id
+        self.call = call
+        self.future = future
+        self.enqueued = time.monotonic()
+        self.retries = 0
+
+
+class Outbox:
+    """
+    Scheduler of outgoing Telegram messages.
+    Keeps the global and per-chat rates below Telegram's flood limits and retries after ``RetryAfter``.
+    Errors of a send are raised from the awaiting call, e.g. ``MessageNotModified`` from ``edit_message_text``.
+    """
+    logger = root_logger.getChild('Outbox')
+
+    def __init__(self, global_rate: float, chat_rate: float, max_retries: int):
+        self.set_rates(global_rate, chat_rate)
+        self.max_retries = max_retries
+        # chat id -> earliest time of the next send to the chat
+        self._chat_ready: Dict[int, float] = {}
+        self._seq = itertools.count()
+        # (priority, seq, job)
+        self._ready: List[Tuple[int, int, _Job]] = []
+        # (ready at, priority, seq, job): jobs waiting for their chat
+        self._delayed: List[Tuple[float, int, int, _Job]] = []
+        self._wakeup = asyncio.Event()
+        self._scheduler: Optional[asyncio.Task] = None
+        self._sending: Set[asyncio.Task] = set()
+
+        self.sent = 0
+        self.failed = 0
+        self.retried = 0
+
+    def set_rates(self, global_rate: float, chat_rate: float):
+        """
+        Messages per second overall and per chat. The workers of runner.py share the overall limit,
+        each of them gets its part
+        """
+        self.global_bucket = TokenBucket(global_rate, global_rate)
+        self.chat_interval = 1 / chat_rate
+
+    def qsize(self) -> int:
+        return len(self._ready) + len(self._delayed)
+
+    def submit(self, chat_id: int, call: Callable[[], Awaitable], priority: int) -> asyncio.Future:
+        """
+        :param call: makes the request, e.g. ``functools.partial(bot.send_message, chat_id, text)``
+        :return: future with the result of the call
+        """
+        future = asyncio.get_running_loop().create_future()
+        self._push(priority, _Job(chat_id, call, future))
+        if self._scheduler is None or self._scheduler.done():
+            self._scheduler = asyncio.create_task(self._schedule())
+        return future
+
+    @staticmethod
+    def _bot() -> Bot:
+        # the bot of the update being processed, the default one outside of update handling
+        return Bot.get_current(no_error=True) or default_bot
+
+    async def send_message(self, chat_id: int, text: str, priority: int = Priority.INTERACTIVE, **kwargs):
+        bot = self._bot()
+        return await self.submit(chat_id, lambda: bot.send_message(chat_id, text, **kwargs), priority)
+
+    async def edit_message_text(self, chat_id: int, message_id: int, text: str,
+                                priority: int = Priority.INTERACTIVE, **kwargs):
+        bot = self._bot()
+        return await self.submit(chat_id, lambda: bot.edit_message_text(text, chat_id, message_id, **kwargs),
+                                 priority)
+
+    def notify(self, chat_id: int, text: str, **kwargs):
+        """
+        Sends a message with notification priority without waiting for it. Failures are logged
+        """
+        bot = self._bot()
+        future = self.submit(chat_id, lambda: bot.send_message(chat_id, text, **kwargs), Priority.NOTIFICATION)
+        future.add_done_callback(self._log_failure)
+
+    def _log_failure(self, future: asyncio.Future):
+        if not future.cancelled() and future.exception():
+            self.logger.error('notification failed: %r', future.exception())
+
+    def _push(self, priority: int, job: _Job):
+        heapq.heappush(self._ready, (priority, next(self._seq), job))
+        self._wakeup.set()
+
+    async def _schedule(self):
+        while self._ready or self._delayed:
+            now = time.monotonic()
+            while self._delayed and self._delayed[0][0] <= now:
+                _, priority, seq, job = heapq.heappop(self._delayed)
+                heapq.heappush(self._ready, (priority, seq, job))
+            if not self._ready:
+                self._wakeup.clear()
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), self._delayed[0][0] - now)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+
+            global_wait = self.global_bucket.wait_time()
+            if global_wait:
+                await asyncio.sleep(global_wait)
+                continue
+
+            priority, seq, job = heapq.heappop(self._ready)
+            chat_ready = self._chat_ready.get(job.chat_id, 0)
+            if chat_ready > now:
+                heapq.heappush(self._delayed, (chat_ready, priority, seq, job))
+                continue
+
+            self.global_bucket.consume()
+            self._chat_ready[job.chat_id] = now + self.chat_interval
+            task = asyncio.create_task(self._execute(priority, job))
+            self._sending.add(task)
+            task.add_done_callback(self._sending.discard)
+
+            if len(self._chat_ready) > 10000:
+                self._chat_ready = {chat_id: t for chat_id, t in self._chat_ready.items() if t > now}
+
+    async def _execute(self, priority: int, job: _Job):
+        if job.future.done():
+            return
+        try:
+            result = await job.call()
+        except RetryAfter as e:
+            if job.retries >= self.max_retries:
+                self._fail(job, e)
+                return
+            job.retries += 1
+            self.retried += 1
+            self.logger.warning('chat %s: retry after %ss', job.chat_id, e.timeout)
+            self._chat_ready[job.chat_id] = time.monotonic() + e.timeout
+            self._push(priority, job)
+            if self._scheduler is None or self._scheduler.done():
+                self._scheduler = asyncio.create_task(self._schedule())
+        except Exception as e:
+            self._fail(job, e)
+        else:
+            self.sent += 1
+            _sent_latency.observe(time.monotonic() - job.enqueued)
+            if not job.future.done():
+                job.future.set_result(result)
+
+    def _fail(self, job: _Job, e: Exception):
+        self.failed += 1
+        _failed_latency.observe(time.monotonic() - job.enqueued)
+        if not job.future.done():
+            job.future.set_exception(e)
+
+    async def close(self, timeout: float = 10):
+        started = time.monotonic()
+        while (self.qsize() or self._sending) and time.monotonic() - started < timeout:
+            await asyncio.sleep(0.05)
+        if self._scheduler:
+            self._scheduler.cancel()
+            self._scheduler = None
+        if self.qsize():
+            self.logger.warning('close. %s messages were not sent', self.qsize())
+
+
+outbox = Outbox(global_rate=config.outbox.global_rate,
+                chat_rate=config.outbox.chat_rate,
+                max_retries=config.outbox.max_retries)
+metrics.registry.gauge('bot_outbox_queue_depth', 'Messages waiting for the rate limits', outbox.qsize)
+metrics.registry.gauge('bot_outbox_sent_total', 'Messages sent', lambda: outbox.sent, type='counter')
+metrics.registry.gauge('bot_outbox_failed_total', 'Messages dropped after errors', lambda: outbox.failed,
+                       type='counter')
+metrics.registry.gauge('bot_outbox_retried_total', 'Messages retried after RetryAfter', lambda: outbox.retried,
+                       type='counter')
@@ -0,0 +1,198 @@
+"""
+Sampled per-update traces: where the time of one update went.
+
+    with tracer.trace(update_id, update_type, user_id):   # TelegramDispatcher._notify
+        ...
+        with span('process'):
+            ...
+
+A sampled update records its spans; finished traces are kept in a ring buffer, served at ``/debug/traces``
+when enabled, and logged if slower than ``config.tracing.slow_threshold``.
+Spans are only recorded in the task processing the update, not in background tasks it started
+(outbox scheduler, cache flushers), which serve other updates as well.
+"""
+import asyncio
+import random
+import time
+from collections import deque
+from contextvars import ContextVar
+from datetime import datetime
+from typing import Optional, List, Set
+
+import ujson
+from aiohttp import web
+
+from core.config_loader import config
+from core.logging_config import root_logger
+
+
+class Span:
+    __slots__ = ('name', 'detail', 'depth', 'start', 'end')
+
+    def __init__(self, name: str, detail: Optional[str], depth: int, start: float):
+        self.name = name
+        self.detail = detail
+        self.depth = depth
+        self.start = start
+        self.end = start
+
+
+class Trace:
+    __slots__ = ('update_id', 'update_type', 'user_id', 'date', 'start', 'end', 'spans', 'task', 'depth')
+
+    def __init__(self, update_id: int, update_type: str, user_id: Optional[int]):
+        self.update_id = update_id
+        self.update_type = update_type
+        self.user_id = user_id
+        self.date = datetime.now()
+        self.start = time.perf_counter()
+        self.end = self.start
+        self.spans: List[Span] = []
+        self.task = asyncio.current_task()
+        self.depth = 0
+
+    @property
+    def duration(self) -> float:
+        return self.end - self.start
+
+    def dict(self) -> dict:
+        return {
+            'update_id': self.update_id,
+            'type': self.update_type,
+            'user_id': self.user_id,
+            'date': self.date.isoformat(),
+            'duration_ms': round(self.duration * 1e3, 3),
+            'spans': [{'name': span.name,
+                       'detail': span.detail,
+                       'depth': span.depth,
+                       'offset_ms': round((span.start - self.start) * 1e3, 3),
+                       'duration_ms': round((span.end - span.start) * 1e3, 3)} for span in self.spans],
+        }
+
+    def format(self) -> str:
+        lines = [f'update {self.update_id} ({self.update_type}) of user {self.user_id}: '
+                 f'{self.duration * 1e3:.1f} ms']
+        for span in self.spans:
+            name = f'{span.name} {span.detail}' if span.detail else span.name
+            lines.append(f'{"  " * (span.depth + 1)}{name}: {(span.end - span.start) * 1e3:.1f} ms '
+                         f'at +{(span.start - self.start) * 1e3:.1f}')
+        return '\n'.join(lines)
+
+
+_current_trace: ContextVar[Optional[Trace]] = ContextVar('current_trace', default=None)
+
+
+class _NoSpan:
+    """
+    Returned when the update is not sampled: entering and leaving it costs nothing
+    """
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+
+NO_SPAN = _NoSpan()
+
+
+class _SpanContext:
+    __slots__ = ('trace', 'span')
+
+    def __init__(self, trace: Trace, name: str, detail: Optional[str]):
+        self.trace = trace
+        self.span = Span(name, detail, trace.depth, 0.0)
+
+    def __enter__(self):
+        self.trace.spans.append(self.span)
+        self.trace.depth += 1
+        self.span.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.span.end = time.perf_counter()
+        self.trace.depth -= 1
+        return False
+
+
+def span(name: str, detail: Optional[str] = None):
+    """
+    :param detail: e.g. the node or the collection, kept apart from ``name`` so nothing is formatted
+        for updates that are not sampled
+    """
+    trace = _current_trace.get()
+    if trace is None or trace.task is not asyncio.current_task():
+        return NO_SPAN
+    return _SpanContext(trace, name, detail)
+
+
+class _TraceContext:
+    __slots__ = ('tracer', 'trace', 'token')
+
+    def __init__(self, tracer: 'Tracer', trace: Trace):
+        self.tracer = tracer
+        self.trace = trace
+        self.token = None
+
+    def __enter__(self):
+        self.token = _current_trace.set(self.trace)
+        return self.trace
+
+    def __exit__(self, *exc_info):
+        self.trace.end = time.perf_counter()
+        _current_trace.reset(self.token)
+        self.tracer.finish(self.trace)
+        return False
+
+
+class Tracer:
+    logger = root_logger.getChild('Tracer')
+
+    def __init__(self, sample_rate: float, buffer_size: int, slow_threshold: Optional[float],
+                 users: Set[int] = frozenset()):
+        """
+        :param sample_rate: share of updates traced, 0..1
+        :param slow_threshold: seconds, traces at least this long are logged. None to disable
+        :param users: updates of these users are always traced, e.g. of a user who reported slowness
+        """
+        self.sample_rate = sample_rate
+        self.slow_threshold = slow_threshold
+        self.users = set(users)
+        self.traces: 'deque[Trace]' = deque(maxlen=buffer_size)
+
+    def trace(self, update_id: int, update_type: str, user_id: Optional[int]):
+        if user_id not in self.users and (self.sample_rate <= 0 or random.random() >= self.sample_rate):
+            return NO_SPAN
+        return _TraceContext(self, Trace(update_id, update_type, user_id))
+
+    def finish(self, trace: Trace):
+        self.traces.append(trace)
+        if self.slow_threshold is not None and trace.duration >= self.slow_threshold:
+            self.logger.warning('slow %s', trace.format())
+
+    def dump(self, min_duration: float = 0, user_id: Optional[int] = None) -> List[dict]:
+        """
+        :return: finished traces, newest first
+        """
+        return [trace.dict() for trace in reversed(self.traces)
+                if trace.duration >= min_duration and (user_id is None or trace.user_id == user_id)]
+
+
+tracer = Tracer(sample_rate=config.tracing.sample_rate,
+                buffer_size=config.tracing.buffer_size,
+                slow_threshold=config.tracing.slow_threshold,
+                users=set(config.tracing.users))
+
+
+async def traces_handler(request: web.Request) -> web.Response:
+    """
+    ``GET /debug/traces?min_ms=500&user_id=1``
+    """
+    try:
+        min_duration = float(request.query.get('min_ms', 0)) / 1e3
+        user_id = int(request.query['user_id']) if 'user_id' in request.query else None
+    except ValueError:
+        raise web.HTTPBadRequest(text='min_ms and user_id must be numbers')
+    return web.Response(text=ujson.dumps(tracer.dump(min_duration, user_id), ensure_ascii=False),
+                        content_type='application/json')
@@ -19,6 +19,8 @@ class DecimalCodec(TypeCodec):
         return value.to_decimal()
 
 
+# amounts are stored as Decimal128 TON and read as Decimal, which the models convert to core.money.Money.
+# Money itself is encoded as Decimal128 by bson, without a codec
 decimal_codec = DecimalCodec()
 
 type_registry = TypeRegistry([decimal_codec])
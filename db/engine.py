@@ -1,25 +1,95 @@
+from contextlib import asynccontextmanager
 from dataclasses import dataclass
+from typing import Optional
 
 import motor.motor_asyncio
-from motor.core import AgnosticCollection
 
 from core.config_loader import config
+from core.logging_config import root_logger
 from db.codecs import codec_options
+from db.storage import Collection, MotorCollection, MemoryCollection, MeteredCollection
 
-database = motor.motor_asyncio.AsyncIOMotorClient(config.mongodb).luckyton
+logger = root_logger.getChild('db.engine')
+
+client = motor.motor_asyncio.AsyncIOMotorClient(config.mongodb)
+database = client.luckyton
+
+# attribute of Databases -> collection name
+COLLECTIONS = {
+    'users': 'users',
+    'mines_pref': 'mines_game_preference',
+    'withdraw_requests': 'withdraw_requests',
+    'invoices': 'invoices',
+    'referral_stats': 'referral_stats',
+    'ledger': 'ledger',
+}
 
 
 @dataclass
 class Databases:
-    users: AgnosticCollection
-    mines_pref: AgnosticCollection
-    withdraw_requests: AgnosticCollection
-    invoices: AgnosticCollection
-
-
-dbs = Databases(
-    users=database.get_collection("users", codec_options=codec_options),
-    mines_pref=database.get_collection("mines_game_preference", codec_options=codec_options),
-    withdraw_requests=database.get_collection("withdraw_requests", codec_options=codec_options),
-    invoices=database.get_collection("invoices", codec_options=codec_options),
-)
+    users: Collection
+    mines_pref: Collection
+    withdraw_requests: Collection
+    invoices: Collection
+    referral_stats: Collection
+    ledger: Collection
+
+
+def open_databases(storage: str) -> Databases:
+    """
+    :param storage: 'mongodb' or 'memory'
+    """
+    if storage == 'memory':
+        collections = {attr: MemoryCollection(name) for attr, name in COLLECTIONS.items()}
+    elif storage == 'mongodb':
+        collections = {attr: MotorCollection(database.get_collection(name, codec_options=codec_options))
+                       for attr, name in COLLECTIONS.items()}
+    else:
+        raise ValueError(f'unknown storage {storage!r}')
+    return Databases(**{attr: MeteredCollection(collection) for attr, collection in collections.items()})
+
+
+def use_storage(storage: str):
+    """
+    Switches ``dbs`` to a new, e.g. empty in-memory, backend for modules that already imported it
+    """
+    for attr, collection in vars(open_databases(storage)).items():
+        setattr(dbs, attr, collection)
+
+
+dbs = open_databases(config.storage)
+
+
+# whether the server supports transactions, asked once
+_replica_set: Optional[bool] = None
+
+
+async def transactions_enabled() -> bool:
+    """
+    ``config.mongodb_transactions`` if set, otherwise whether the server is a replica set or mongos
+    """
+    global _replica_set
+    if not dbs.users.supports_transactions:
+        return False
+    if config.mongodb_transactions is not None:
+        return config.mongodb_transactions
+    if _replica_set is None:
+        hello = await client.admin.command('hello')
+        _replica_set = 'setName' in hello or hello.get('msg') == 'isdbgrid'
+        logger.info('transactions %s', 'enabled' if _replica_set else 'unavailable: not a replica set')
+    return _replica_set
+
+
+@asynccontextmanager
+async def transaction():
+    """
+    Yields a session with a started transaction, or None if transactions are disabled (see ``transactions_enabled``)
+    or the storage is in memory.
+    Pass it as ``session=`` to every operation that belongs to the transaction.
+    """
+    if not await transactions_enabled():
+        yield None
+        return
+    async with await client.start_session() as session:
+        async with session.start_transaction():
+            yield session
@@ -1,14 +1,17 @@
 from datetime import datetime, timedelta
-from decimal import Decimal
-from typing import Tuple, List, Optional
+from typing import Tuple, Optional
 
 from aiogram import types
 from pymongo import ReturnDocument
 
+from core.aiogram_nodes.render_cache import render_cache
 from core.logging_config import root_logger
-from core.pure import to_decimal
-from db.engine import dbs
-from db.models import User
+from core.money import Money
+from db.engine import dbs, transaction
+from db.ledger import ledger, has_entry
+from db.models import User, Invoice, LedgerEntry, LedgerKind
+from db.referral_stats import referrer_stats
+from db.user_cache import user_cache, EXTERNAL_FIELDS
 
 logger = root_logger.getChild('db.helpers')
 
@@ -18,7 +21,7 @@ async def get_user_by_user_id(user_id: int) -> Optional[User]:
         return None
     raw = await dbs.users.find_one({'user_id': user_id})
     if raw:
-        return User(**raw)
+        return User.from_db(raw)
     return None
 
 
@@ -27,9 +30,35 @@ async def get_or_create_user(tg_user: types.User) -> User:
     del update_data['id']
     del update_data['is_bot']
     del update_data['language_code']
-    update_data['last_active'] = datetime.now()
+    now = datetime.now()
+
+    cached = user_cache.get(tg_user.id)
+    if cached:
+        db_user, profile = cached
+        projection = {field: 1 for field in EXTERNAL_FIELDS}
+        if profile != update_data:
+            external = await dbs.users.find_one_and_update({'user_id': tg_user.id}, {'$set': update_data},
+                                                           projection, return_document=ReturnDocument.AFTER)
+        else:
+            external = await dbs.users.find_one({'user_id': tg_user.id}, projection)
+        if external is not None:
+            if profile != update_data:
+                for key, value in update_data.items():
+                    if key in User.__fields__:
+                        setattr(db_user, key, value)
+                user_cache.put(db_user, update_data)
+                render_cache.invalidate_user(tg_user.id)
+            for field in EXTERNAL_FIELDS:
+                setattr(db_user, field, Money.validate(external.get(field, 0)))
+            db_user.last_active = now
+            db_user.mark_clean(*update_data, *EXTERNAL_FIELDS, 'last_active')
+            user_cache.touch(tg_user.id, now)
+            return db_user
+        # removed from the database meanwhile
+        user_cache.drop(tg_user.id)
+
     db_user = await dbs.users.find_one_and_update({'user_id': tg_user.id},
-                                                  {'$set': update_data},
+                                                  {'$set': {**update_data, 'last_active': now}},
                                                   return_document=ReturnDocument.AFTER)
     if db_user is None:
         logger.info('new user. adding to database')
@@ -38,24 +67,96 @@ async def get_or_create_user(tg_user: types.User) -> User:
         # mines_game_preference = MinesGamePreference(user_id=db_user.id)
         # await dbs.mines_pref.insert_one(mines_game_preference.dict())
     if isinstance(db_user, dict):
-        db_user = User(**db_user)
+        db_user = User.from_db(db_user)
+    user_cache.put(db_user, update_data)
+    # the profile may have changed since the user was cached
+    render_cache.invalidate_user(tg_user.id)
     return db_user
 
 
-async def user_referral_stats(user: User) -> Tuple[int, Decimal, int]:
-    referrals: List[dict] = await dbs.users.find({'referrer_user_id': user.user_id}).to_list(None)
-    total_revenue = to_decimal(sum([x.get('sum_revenue') for x in referrals if x.get('sum_revenue')]))
-    share = 25
+# invoices pending for longer are left by a crashed process, see finish_pending_invoices
+PENDING_TIMEOUT = timedelta(minutes=10)
+
+
+async def settle_invoice(invoice_hash: str) -> Optional[Tuple[Invoice, User, Money, Money]]:
+    """
+    Marks the invoice as paid and credits the deposit (and the user's deposit bonus, if any) to the user.
+    Safe to call concurrently: only the call that flips ``is_payed`` credits the user.
+
+    Without transactions the invoice keeps ``pending_since`` until the ledger entries are written,
+    invoices left pending by a crash are credited by ``finish_pending_invoices``.
+
+    :return: invoice, user as it was before the deposit, credited amount, bonus part of it.
+        None if the invoice is unknown or already paid
+    """
+    async with transaction() as session:
+        raw_invoice = await dbs.invoices.find_one_and_update({'hash': invoice_hash, 'is_payed': False},
+                                                             {'$set': {'is_payed': True,
+                                                                       'pending_since': datetime.now()}},
+                                                             return_document=ReturnDocument.AFTER,
+                                                             session=session)
+        if raw_invoice is None:
+            return None
+        settlement = await _credit_invoice(Invoice.from_db(raw_invoice), session=session)
+    if settlement is not None:
+        user_cache.invalidate(settlement[1].user_id)
+    return settlement
+
+
+async def _credit_invoice(invoice: Invoice, session=None) -> Optional[Tuple[Invoice, User, Money, Money]]:
+    # the bonus is taken atomically, so two invoices paid at once don't both get it.
+    # sum_deposit is incremented with the balance, by the ledger
+    raw_user = await dbs.users.find_one_and_update({'user_id': invoice.user_id},
+                                                   {'$set': {'deposit_bonus': 0}},
+                                                   return_document=ReturnDocument.BEFORE,
+                                                   session=session)
+    if raw_user is None:
+        logger.error('settle_invoice. user %s of %s not found', invoice.user_id, invoice)
+        await dbs.invoices.update_one({'_id': invoice.id},
+                                      {'$set': {'is_payed': False}, '$unset': {'pending_since': ''}},
+                                      session=session)
+        return None
+    user = User.from_db(raw_user)
+
+    entries = [LedgerEntry(user_id=user.user_id, kind=LedgerKind.DEPOSIT, amount=invoice.amount,
+                           ref=invoice.hash)]
+    bonus = Money(0)
+    if user.deposit_bonus:
+        bonus = invoice.amount.percent(user.deposit_bonus)
+        entries.append(LedgerEntry(user_id=user.user_id, kind=LedgerKind.BONUS, amount=bonus,
+                                   ref=invoice.hash))
+    await ledger.record_all(entries, session=session)
+    await dbs.invoices.update_one({'_id': invoice.id}, {'$unset': {'pending_since': ''}}, session=session)
+    return invoice, user, invoice.amount + bonus, bonus
+
+
+async def finish_pending_invoices() -> int:
+    """
+    Credits invoices claimed by ``settle_invoice`` but left pending for longer than ``PENDING_TIMEOUT``,
+    unless their deposit entry was written. Run by ``python -m db.ledger reconcile``.
+
+    :return: number of invoices credited
+    """
+    credited = 0
+    async for raw in dbs.invoices.find({'pending_since': {'$lt': datetime.now() - PENDING_TIMEOUT}}):
+        # claimed again, so concurrent runs don't both credit it
+        raw = await dbs.invoices.find_one_and_update({'_id': raw['_id'], 'pending_since': raw['pending_since']},
+                                                     {'$set': {'pending_since': datetime.now()}},
+                                                     return_document=ReturnDocument.AFTER)
+        if raw is None:
+            continue
+        invoice = Invoice.from_db(raw)
+        if await has_entry(invoice.user_id, LedgerKind.DEPOSIT, invoice.hash):
+            await dbs.invoices.update_one({'_id': invoice.id}, {'$unset': {'pending_since': ''}})
+            continue
+        if await _credit_invoice(invoice) is not None:
+            credited += 1
+            user_cache.invalidate(invoice.user_id)
+            logger.warning('finish_pending_invoices. credited invoice %s of user %s', invoice.hash, invoice.user_id)
+    return credited
+
 
-    if total_revenue > 50000:
-        share = 90
-    elif total_revenue > 10000:
-        share = 80
-    elif total_revenue > 5000:
-        share = 60
-    elif total_revenue > 1000:
-        share = 45
-    elif total_revenue > 200:
-        share = 35
+async def user_referral_stats(user: User) -> Tuple[int, Money, int]:
+    stats = await referrer_stats(user.user_id)
+    return stats.share, stats.revenue, stats.referrals
 
-    return share, total_revenue, len(referrals)
@@ -0,0 +1,118 @@
+"""
+Creates and checks the indexes declared in ``db.models.INDEXES``.
+
+    python -m db.indexes ensure    # create missing indexes
+    python -m db.indexes report    # missing, undeclared and unused indexes
+    python -m db.indexes explain   # check that helper queries use an index
+"""
+import argparse
+import asyncio
+import sys
+from datetime import datetime
+from typing import List, Tuple, Iterator
+
+from bson import ObjectId
+from pymongo.errors import OperationFailure
+
+from core.logging_config import root_logger
+from db.engine import dbs
+from db.models import INDEXES
+
+logger = root_logger.getChild('db.indexes')
+
+# (code running the query, collection, filter, index expected to serve it).
+# The filters are those of the code, with sample values; keep them in sync when a query changes
+QUERIES: List[Tuple[str, str, dict, str]] = [
+    ('get_user_by_user_id, Ledger._write', 'users', {'user_id': 1}, 'user_id_unique'),
+    ('Node._run', 'users', {'_id': ObjectId()}, '_id_'),
+    ('referral_stats.rebuild', 'users', {'referrer_user_id': {'$gt': 0}}, 'referrer_user_id'),
+    ('settle_invoice', 'invoices', {'hash': '', 'is_payed': False}, 'hash_unique'),
+    ('finish_pending_invoices', 'invoices', {'pending_since': {'$lt': datetime.now()}}, 'pending_since'),
+    ('ConfirmWithdrawalAdmin', 'withdraw_requests', {'_id': ObjectId(), 'is_payed': False}, '_id_'),
+    ('referrer_stats, add_referral', 'referral_stats', {'user_id': 1}, 'user_id_unique'),
+    ('has_entry', 'ledger', {'user_id': 1, 'kind': 'deposit', 'ref': ''}, 'user_id_date'),
+]
+
+
+async def ensure_indexes():
+    for name, indexes in INDEXES.items():
+        try:
+            await getattr(dbs, name).create_indexes(indexes)
+        except OperationFailure as e:
+            logger.error('unable to create indexes of %s: %s', name, e)
+    missing = await missing_indexes()
+    if missing:
+        logger.error('missing indexes: %s', missing)
+
+
+async def missing_indexes() -> List[str]:
+    out = []
+    for name, indexes in INDEXES.items():
+        existing = await getattr(dbs, name).index_information()
+        for index in indexes:
+            document = index.document
+            info = existing.get(document['name'])
+            if info is None or dict(info['key']) != dict(document['key']):
+                out.append(f'{name}.{document["name"]}')
+    return out
+
+
+async def report() -> int:
+    """
+    :return: number of missing indexes
+    """
+    missing = await missing_indexes()
+    for index in missing:
+        print(f'missing     {index}')
+    for name, indexes in INDEXES.items():
+        declared = {index.document['name'] for index in indexes} | {'_id_'}
+        async for stats in getattr(dbs, name).aggregate([{'$indexStats': {}}]):
+            if stats['name'] not in declared:
+                print(f'undeclared  {name}.{stats["name"]}')
+            elif stats['accesses']['ops'] == 0:
+                print(f'unused      {name}.{stats["name"]} since {stats["accesses"]["since"]}')
+    return len(missing)
+
+
+def _plan_stages(plan: dict) -> Iterator[dict]:
+    yield plan
+    for value in plan.values():
+        if isinstance(value, dict):
+            yield from _plan_stages(value)
+        elif isinstance(value, list):
+            for item in value:
+                if isinstance(item, dict):
+                    yield from _plan_stages(item)
+
+
+async def explain() -> int:
+    """
+    :return: number of queries not served by the expected index
+    """
+    failed = 0
+    for where, name, query, expected in QUERIES:
+        plan = await getattr(dbs, name).find(query).explain()
+        stages = list(_plan_stages(plan['queryPlanner']['winningPlan']))
+        used = {stage['indexName'] for stage in stages if 'indexName' in stage}
+        if expected == '_id_' and any(stage.get('stage') == 'IDHACK' for stage in stages):
+            used.add('_id_')
+        ok = expected in used
+        failed += not ok
+        print(f'{"ok" if ok else "FAIL":<5} {where}: {name} {query} -> {", ".join(sorted(used)) or "COLLSCAN"}')
+    return failed
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Manage MongoDB indexes')
+    parser.add_argument('command', choices=['ensure', 'report', 'explain'])
+    args = parser.parse_args()
+    if args.command == 'ensure':
+        asyncio.run(ensure_indexes())
+    elif args.command == 'report':
+        sys.exit(1 if asyncio.run(report()) else 0)
+    else:
+        sys.exit(1 if asyncio.run(explain()) else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,320 @@
+"""
+Append-only ledger of the balance changes made by the bot.
+
+Every change is an immutable ``LedgerEntry`` plus an ``$inc`` of the cached ``User.balance``
+(and of ``sum_deposit`` or ``referral_paid``, in the same update).
+Entries recorded concurrently are written together: one bulk_write and one insert_many per batch.
+Both are written in a transaction when the server supports them. Otherwise the entries are also set in
+``ledger_pending`` of the user by the ``$inc`` itself and removed once inserted, so a crash in between leaves
+them there for ``finish_pending_entries``.
+
+Games in the webapps move money between ``balance`` and ``sum_revenue`` without entries, so the ledger
+is reconciled with ``balance + sum_revenue``:
+
+    python -m db.ledger seed              # opening entries for users without entries
+    python -m db.ledger reconcile         # finish interrupted writes and invoices, report users
+                                          # whose balance + sum_revenue differs from the ledger
+"""
+import argparse
+import asyncio
+import sys
+import traceback
+from datetime import datetime, timedelta
+from typing import List, Tuple, Optional, Dict, AsyncIterator
+
+from pymongo import UpdateOne, ASCENDING
+from pymongo.errors import DuplicateKeyError
+
+from core.config_loader import config
+from core.logging_config import root_logger
+from core.money import Money
+from db.engine import dbs, transaction
+from db.models import LedgerEntry, LedgerKind
+
+logger = root_logger.getChild('db.ledger')
+
+# user fields counting the entries of a kind, incremented with the balance
+KIND_TOTALS = {LedgerKind.DEPOSIT: 'sum_deposit', LedgerKind.REFERRAL_PAYOUT: 'referral_paid'}
+
+BATCH_SIZE = 1000
+# entries pending for longer are left by a crashed process
+PENDING_TIMEOUT = timedelta(minutes=10)
+
+
+class Ledger:
+    logger = root_logger.getChild('Ledger')
+
+    def __init__(self, max_batch: int, max_delay: float):
+        self.max_batch = max_batch
+        self.max_delay = max_delay
+        self._pending: List[Tuple[LedgerEntry, asyncio.Future]] = []
+        self._flusher: Optional[asyncio.Task] = None
+
+    async def record(self, user_id: int, kind: str, amount: Money, ref: Optional[str] = None,
+                     session=None) -> LedgerEntry:
+        """
+        Writes the entry and applies it to the user's balance. Returns once both are written.
+        With a session (see ``db.engine.transaction``) the entry is written immediately, in that session.
+        The cached user is not invalidated: update the in-memory object or call ``user_cache.invalidate``.
+        """
+        entry = _entry(user_id, kind, amount, ref)
+        await self.record_all([entry], session=session)
+        return entry
+
+    async def record_if(self, condition: dict, user_id: int, kind: str, amount: Money,
+                        ref: Optional[str] = None) -> bool:
+        """
+        Writes the entry right away, not batched, if the user's document matches ``condition``,
+        e.g. ``{'balance': {'$gte': amount}}``.
+
+        :return: False if it does not match, nothing is written then
+        """
+        return await self._write([_entry(user_id, kind, amount, ref)], condition=condition)
+
+    async def record_all(self, entries: List[LedgerEntry], session=None):
+        if session is not None:
+            await self._write(entries, session=session)
+            return
+        loop = asyncio.get_running_loop()
+        futures = []
+        for entry in entries:
+            future = loop.create_future()
+            self._pending.append((entry, future))
+            futures.append(future)
+        if self._flusher is None or self._flusher.done():
+            self._flusher = asyncio.create_task(self._flush_pending())
+        await asyncio.gather(*futures)
+
+    async def _flush_pending(self):
+        # let entries recorded by concurrent updates join the batch
+        await asyncio.sleep(self.max_delay)
+        while self._pending:
+            batch, self._pending = self._pending[:self.max_batch], self._pending[self.max_batch:]
+            try:
+                await self._write([entry for entry, _ in batch])
+            except Exception as e:
+                self.logger.error(''.join(traceback.format_exc()))
+                for _, future in batch:
+                    if not future.done():
+                        future.set_exception(e)
+            else:
+                for _, future in batch:
+                    if not future.done():
+                        future.set_result(None)
+
+    @staticmethod
+    async def _write(entries: List[LedgerEntry], session=None, condition: Optional[dict] = None) -> bool:
+        """
+        :param condition: filter the user's document has to match, only for entries of one user
+        :return: False if the condition did not match
+        """
+        if session is not None:
+            return await _apply(entries, session, condition)
+        async with transaction() as session:
+            if session is not None:
+                return await _apply(entries, session, condition)
+        return await _apply_pending(entries, condition)
+
+    async def close(self):
+        if self._flusher:
+            await self._flusher
+            self._flusher = None
+
+
+ledger = Ledger(max_batch=config.ledger.max_batch, max_delay=config.ledger.max_delay)
+
+
+def _entry(user_id: int, kind: str, amount: Money, ref) -> LedgerEntry:
+    return LedgerEntry(user_id=user_id, kind=kind, amount=amount, ref=str(ref) if ref is not None else None)
+
+
+def _increments(entries: List[LedgerEntry]) -> Dict[int, Dict[str, Money]]:
+    increments: Dict[int, Dict[str, Money]] = {}
+    for entry in entries:
+        inc = increments.setdefault(entry.user_id, {'balance': Money(0)})
+        inc['balance'] += entry.amount
+        total = KIND_TOTALS.get(entry.kind)
+        if total:
+            inc[total] = inc.get(total, Money(0)) + entry.amount
+    return increments
+
+
+def _user_filter(user_id: int, condition: Optional[dict]) -> dict:
+    return {'user_id': user_id, **condition} if condition else {'user_id': user_id}
+
+
+async def _apply(entries: List[LedgerEntry], session, condition: Optional[dict]) -> bool:
+    result = await dbs.users.bulk_write([UpdateOne(_user_filter(user_id, condition), {'$inc': inc})
+                                         for user_id, inc in _increments(entries).items()],
+                                        ordered=False, session=session)
+    if condition and not result.matched_count:
+        return False
+    await dbs.ledger.insert_many([entry.dict() for entry in entries], ordered=False, session=session)
+    return True
+
+
+async def _apply_pending(entries: List[LedgerEntry], condition: Optional[dict]) -> bool:
+    documents: Dict[int, Dict[str, dict]] = {}
+    for entry in entries:
+        documents.setdefault(entry.user_id, {})[f'ledger_pending.{entry.id}'] = entry.dict()
+    increments = _increments(entries)
+    result = await dbs.users.bulk_write([UpdateOne(_user_filter(user_id, condition),
+                                                   {'$inc': inc, '$set': documents[user_id]})
+                                         for user_id, inc in increments.items()], ordered=False)
+    if condition and not result.matched_count:
+        return False
+    await dbs.ledger.insert_many([entry.dict() for entry in entries], ordered=False)
+    await dbs.users.bulk_write([UpdateOne({'user_id': user_id}, {'$unset': dict.fromkeys(pending, '')})
+                                for user_id, pending in documents.items()], ordered=False)
+    return True
+
+
+async def has_entry(user_id: int, kind: str, ref: str) -> bool:
+    """
+    Whether the user has an entry of ``kind`` with ``ref``, inserted or still pending
+    """
+    if await dbs.ledger.find_one({'user_id': user_id, 'kind': kind, 'ref': ref}):
+        return True
+    user = await dbs.users.find_one({'user_id': user_id}, {'ledger_pending': 1}) or {}
+    return any(document['kind'] == kind and document['ref'] == ref
+               for document in user.get('ledger_pending', {}).values())
+
+
+async def finish_pending_entries() -> int:
+    """
+    Inserts the entries of writes interrupted between the ``$inc`` and the insert, older than ``PENDING_TIMEOUT``
+
+    :return: number of entries inserted
+    """
+    inserted = 0
+    cutoff = datetime.now() - PENDING_TIMEOUT
+    async for raw in dbs.users.find({'ledger_pending': {'$exists': True, '$ne': {}}}, {'ledger_pending': 1}):
+        stale = {key: document for key, document in raw['ledger_pending'].items() if document['date'] < cutoff}
+        for document in stale.values():
+            try:
+                await dbs.ledger.insert_one(document)
+                inserted += 1
+            except DuplicateKeyError:
+                # inserted before the crash
+                pass
+        if stale:
+            await dbs.users.update_one({'_id': raw['_id']},
+                                       {'$unset': {f'ledger_pending.{key}': '' for key in stale}})
+    return inserted
+
+
+async def _ledger_sums() -> AsyncIterator[Tuple[int, Money]]:
+    pipeline = [
+        {'$group': {'_id': '$user_id', 'amount': {'$sum': '$amount'}}},
+        {'$sort': {'_id': ASCENDING}},
+    ]
+    async for row in dbs.ledger.aggregate(pipeline, allowDiskUse=True):
+        yield row['_id'], Money.validate(row['amount'])
+
+
+async def _next(iterator):
+    try:
+        return await iterator.__anext__()
+    except StopAsyncIteration:
+        return None
+
+
+def _funds(user: dict) -> Money:
+    return Money.validate(user.get('balance', 0)) + Money.validate(user.get('sum_revenue', 0))
+
+
+async def _balances() -> AsyncIterator[Tuple[int, Optional[Money], Optional[Money]]]:
+    """
+    Merges users and ledger sums, both sorted by user_id, without loading either into memory.
+
+    :return: user_id, balance + sum_revenue (None if there is no such user),
+        ledger sum (None if there are no entries)
+    """
+    users = dbs.users.find({}, {'user_id': 1, 'balance': 1, 'sum_revenue': 1}) \
+        .sort('user_id', ASCENDING).__aiter__()
+    sums = _ledger_sums()
+    user = await _next(users)
+    ledger_sum = await _next(sums)
+    while user is not None or ledger_sum is not None:
+        if ledger_sum is None or (user is not None and user['user_id'] < ledger_sum[0]):
+            yield user['user_id'], _funds(user), None
+            user = await _next(users)
+        elif user is None or ledger_sum[0] < user['user_id']:
+            yield ledger_sum[0], None, ledger_sum[1]
+            ledger_sum = await _next(sums)
+        else:
+            yield user['user_id'], _funds(user), ledger_sum[1]
+            user = await _next(users)
+            ledger_sum = await _next(sums)
+
+
+async def seed() -> int:
+    """
+    Records the current balance + sum_revenue of users without ledger entries as their opening entry.
+    Run it once, before the first deploy that records entries.
+
+    :return: number of seeded users
+    """
+    seeded = 0
+    batch = []
+    async for user_id, funds, ledger_sum in _balances():
+        if ledger_sum is not None or not funds:
+            continue
+        batch.append(LedgerEntry(user_id=user_id, kind=LedgerKind.OPENING, amount=funds).dict())
+        if len(batch) >= BATCH_SIZE:
+            await dbs.ledger.insert_many(batch, ordered=False)
+            seeded += len(batch)
+            batch = []
+    if batch:
+        await dbs.ledger.insert_many(batch, ordered=False)
+        seeded += len(batch)
+    logger.info('seed. %s opening entries', seeded)
+    return seeded
+
+
+async def reconcile() -> int:
+    """
+    Reports users whose balance + sum_revenue differs from the sum of their entries.
+    Writes in progress show as mismatches too, run ``finish_pending_entries`` first.
+
+    :return: number of such users
+    """
+    mismatches = 0
+    async for user_id, funds, ledger_sum in _balances():
+        if funds is None:
+            logger.warning('entries of unknown user %s: %s', user_id, ledger_sum)
+            mismatches += 1
+            continue
+        expected = ledger_sum if ledger_sum is not None else Money(0)
+        if funds == expected:
+            continue
+        mismatches += 1
+        logger.warning('mismatch %s: balance + sum_revenue %s, ledger %s', user_id, funds, expected)
+    logger.info('reconcile. %s mismatches', mismatches)
+    return mismatches
+
+
+async def _reconcile() -> int:
+    # db.helpers imports the ledger
+    from db.helpers import finish_pending_invoices
+    inserted = await finish_pending_entries()
+    if inserted:
+        logger.warning('reconcile. %s pending entries inserted', inserted)
+    credited = await finish_pending_invoices()
+    if credited:
+        logger.warning('reconcile. %s pending invoices credited', credited)
+    return await reconcile()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Reconcile user balances with the ledger')
+    parser.add_argument('command', choices=['seed', 'reconcile'])
+    args = parser.parse_args()
+    if args.command == 'seed':
+        asyncio.run(seed())
+    else:
+        sys.exit(1 if asyncio.run(_reconcile()) else 0)
+
+
+if __name__ == '__main__':
+    main()
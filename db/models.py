@@ -1,16 +1,18 @@
 import asyncio
 import base64
 import binascii
+import functools
 import random
 from datetime import datetime
-from decimal import Decimal, ROUND_DOWN
-from typing import Union, Optional
+from typing import Optional, Set, Dict, List, Tuple, Callable
 
 from aiogram import types
 from bson import ObjectId
-from pydantic import BaseModel, Field
+from pydantic import BaseModel, Field, PrivateAttr, ValidationError
+from pydantic.fields import ModelField, SHAPE_SINGLETON
+from pymongo import IndexModel, ASCENDING
 
-from core.pure import to_decimal
+from core.money import Money
 
 
 class PyObjectId(ObjectId):
@@ -32,16 +34,98 @@ class PyObjectId(ObjectId):
 class MongoModel(BaseModel):
     id: PyObjectId = Field(default_factory=PyObjectId, alias="_id")
 
+    # names of fields assigned since the model was loaded or last saved
+    _changed: Set[str] = PrivateAttr(default_factory=set)
+
     class Config:
         allow_population_by_field_name = True
         arbitrary_types_allowed = True
         json_encoders = {ObjectId: int}
         use_enum_values = True
 
+    def __setattr__(self, name, value):
+        if name in self.__fields__ and self.__dict__.get(name) != value:
+            self._changed.add(name)
+        super(MongoModel, self).__setattr__(name, value)
+
     def dict(self, *args, **kwargs):
         kwargs.setdefault('by_alias', True)
         return super(MongoModel, self).dict(*args, **kwargs)
 
+    @classmethod
+    @functools.lru_cache()
+    def _db_fields(cls) -> Tuple[Tuple[str, ModelField, Optional[type], Optional[Callable]], ...]:
+        """
+        :return: name, field, the type a stored value is expected to have (None if it is not checked)
+            and the validator of custom types such as Money, called directly instead of the field's validators
+        """
+        fields = []
+        for name, field in cls.__fields__.items():
+            expected = field.type_ if field.shape == SHAPE_SINGLETON and isinstance(field.type_, type) else None
+            convert = None
+            if expected is not None and issubclass(expected, ObjectId):
+                expected = ObjectId
+            elif expected is not None and hasattr(expected, '__get_validators__'):
+                convert = expected.validate
+            fields.append((name, field, expected, convert))
+        return tuple(fields)
+
+    @classmethod
+    def from_db(cls, document: dict):
+        """
+        Builds the model from a document of our own database, skipping validation of values that already
+        have the declared type. Unknown keys are ignored.
+        Input from users and external APIs must go through the constructor.
+        """
+        values = {}
+        fields_set = set()
+        for name, field, expected, convert in cls._db_fields():
+            if field.alias in document:
+                value = document[field.alias]
+                fields_set.add(name)
+                if expected is not None and not isinstance(value, expected) \
+                        and not (value is None and field.allow_none):
+                    if convert is not None:
+                        # e.g. a Decimal read into a Money field. errors are reported by field.validate
+                        try:
+                            values[name] = convert(value)
+                            continue
+                        except (TypeError, ValueError):
+                            pass
+                    value, errors = field.validate(value, values, loc=field.alias, cls=cls)
+                    if errors:
+                        raise ValidationError([errors], cls)
+            elif field.required:
+                # reports the missing fields
+                return cls(**document)
+            else:
+                value = field.get_default()
+            values[name] = value
+        model = cls.__new__(cls)
+        object.__setattr__(model, '__dict__', values)
+        object.__setattr__(model, '__fields_set__', fields_set)
+        model._init_private_attributes()
+        return model
+
+    def changes(self) -> dict:
+        """
+        Changed fields, ready for ``$set``. In-place mutations of mutable fields are not tracked.
+        """
+        if not self._changed:
+            return {}
+        return self.dict(include=self._changed)
+
+    def pop_changes(self) -> dict:
+        changes = self.changes()
+        self._changed.clear()
+        return changes
+
+    def mark_clean(self, *fields: str):
+        if fields:
+            self._changed.difference_update(fields)
+        else:
+            self._changed.clear()
+
 
 class User(MongoModel):
     user_id: int
@@ -53,13 +137,17 @@ class User(MongoModel):
     last_active: datetime = datetime.now()
     date_registered: datetime = datetime.now()
 
-    balance: Decimal = to_decimal(0)
-    deposit_bonus: Decimal = to_decimal(0)
+    balance: Money = Money(0)
+    # percent added to the next deposit
+    deposit_bonus: int = 0
 
     referrer_user_id: int = 0
 
-    sum_deposit: Decimal = to_decimal(0)
-    sum_revenue: Decimal = to_decimal(0)
+    sum_deposit: Money = Money(0)
+    # net result of the user's games for the house, written by the game webapps together with the balance
+    sum_revenue: Money = Money(0)
+    # referral earnings credited to the balance so far
+    referral_paid: Money = Money(0)
 
     state: str = 0
     menu_message_id: int = 0
@@ -85,11 +173,6 @@ class User(MongoModel):
             name += ' ' + self.last_name
         return name
 
-    def change_balance(self, n: Union[float, Decimal]):
-        value = to_decimal(n)
-        self.balance += value
-        self.sum_revenue -= value
-
     @property
     def ref(self):
         return base64.b64encode(str(self.user_id).encode('utf-8')).decode('utf-8').replace('=', '')
@@ -107,7 +190,7 @@ class User(MongoModel):
 class MinesGamePreference(MongoModel):
     # id: PyObjectId = Field(default_factory=PyObjectId, alias="_id")
     user_id: int
-    last_bet: Decimal = 1
+    last_bet: Money = Money.ton(1)
     last_mines: int = 1
 
     def __str__(self) -> str:
@@ -117,9 +200,11 @@ class MinesGamePreference(MongoModel):
 class Invoice(MongoModel):
     # id: PyObjectId = Field(default_factory=PyObjectId, alias="_id")
     user_id: int
-    amount: Decimal
+    amount: Money
     hash: str
     is_payed: bool = False
+    # set while the paid invoice is being credited, see db.helpers.settle_invoice
+    pending_since: Optional[datetime] = None
 
     def __repr__(self):
         return f'<Invoice {self.id} {self.amount}>'
@@ -128,8 +213,66 @@ class Invoice(MongoModel):
 class WithdrawRequest(MongoModel):
     # id: PyObjectId = Field(default_factory=PyObjectId, alias="_id")
     user_id: int
-    amount: Decimal
+    amount: Money
     is_payed: bool = False
-    date: datetime = datetime.now()
-    spend_id: str = random.randbytes(8).hex()
+    date: datetime = Field(default_factory=datetime.now)
+    spend_id: str = Field(default_factory=lambda: random.randbytes(8).hex())
 
+
+class ReferralStats(MongoModel):
+    # referrer
+    user_id: int
+    referrals: int = 0
+    # net revenue from all referrals
+    revenue: Money = Money(0)
+    share: int = 25
+
+    def __repr__(self):
+        return f'<ReferralStats {self.user_id} {self.referrals} {self.revenue}>'
+
+
+class LedgerKind:
+    DEPOSIT = 'deposit'
+    WITHDRAWAL = 'withdrawal'
+    # a withdrawal returned after its transfer failed
+    REFUND = 'refund'
+    BONUS = 'bonus'
+    REFERRAL_PAYOUT = 'referral_payout'
+    # balance + sum_revenue of the user before the ledger was introduced
+    OPENING = 'opening'
+
+
+class LedgerEntry(MongoModel):
+    """
+    Immutable balance change made by the bot. Games in the webapps move money between ``User.balance``
+    and ``User.sum_revenue`` without entries, so the sum of a user's entries is ``balance + sum_revenue``
+    """
+    user_id: int
+    kind: str
+    # signed: negative for withdrawals
+    amount: Money
+    # invoice hash, withdraw request id
+    ref: Optional[str] = None
+    date: datetime = Field(default_factory=datetime.now)
+
+    def __repr__(self):
+        return f'<LedgerEntry {self.user_id} {self.kind} {self.amount}>'
+
+
+# indexes the queries in this repo rely on. keys are attributes of db.engine.Databases
+INDEXES: Dict[str, List[IndexModel]] = {
+    'users': [
+        IndexModel([('user_id', ASCENDING)], name='user_id_unique', unique=True),
+        IndexModel([('referrer_user_id', ASCENDING)], name='referrer_user_id'),
+    ],
+    'invoices': [
+        IndexModel([('hash', ASCENDING)], name='hash_unique', unique=True),
+        IndexModel([('pending_since', ASCENDING)], name='pending_since'),
+    ],
+    'referral_stats': [
+        IndexModel([('user_id', ASCENDING)], name='user_id_unique', unique=True),
+    ],
+    'ledger': [
+        IndexModel([('user_id', ASCENDING), ('date', ASCENDING)], name='user_id_date'),
+    ],
+}
@@ -0,0 +1,123 @@
+"""
+Referral statistics of every referrer, materialized in the ``referral_stats`` collection and read by the bot.
+
+``referrals`` is incremented when a referred user registers. The game webapps change ``sum_revenue`` of users
+directly, so ``revenue`` can't be counted here: it is set by ``rebuild`` from the users collection,
+which is run periodically (see notes.txt) and also corrects ``referrals``.
+
+    python -m db.referral_stats rebuild
+    python -m db.referral_stats verify     # referrers changed since the last rebuild
+"""
+import argparse
+import asyncio
+import sys
+from typing import Dict, Tuple
+
+from pymongo import UpdateOne
+
+from core.logging_config import root_logger
+from core.money import Money
+from db.engine import dbs
+from db.models import ReferralStats
+
+logger = root_logger.getChild('db.referral_stats')
+
+# (net revenue above, share %), the highest tier first
+SHARE_TIERS = [(Money.ton(threshold), share)
+               for threshold, share in [(50000, 90), (10000, 80), (5000, 60), (1000, 45), (200, 35)]]
+DEFAULT_SHARE = 25
+
+BATCH_SIZE = 1000
+
+
+def referral_share(total_revenue: Money) -> int:
+    for threshold, share in SHARE_TIERS:
+        if total_revenue > threshold:
+            return share
+    return DEFAULT_SHARE
+
+
+def _referrals_pipeline(match: dict) -> list:
+    return [
+        {'$match': match},
+        {'$group': {'_id': '$referrer_user_id',
+                    'referrals': {'$sum': 1},
+                    'revenue': {'$sum': {'$ifNull': ['$sum_revenue', 0]}}}},
+    ]
+
+
+async def referrer_stats(referrer_user_id: int) -> ReferralStats:
+    """
+    Referrals of the referrer and their net revenue as of the last ``rebuild``
+    """
+    raw = await dbs.referral_stats.find_one({'user_id': referrer_user_id})
+    stats = ReferralStats.from_db(raw) if raw else ReferralStats(user_id=referrer_user_id)
+    stats.share = referral_share(stats.revenue)
+    return stats
+
+
+async def add_referral(referrer_user_id: int):
+    await dbs.referral_stats.update_one({'user_id': referrer_user_id}, {'$inc': {'referrals': 1}}, upsert=True)
+
+
+async def aggregate_from_users() -> Dict[int, Tuple[int, Money]]:
+    """
+    :return: referrer user_id -> (referrals, net revenue), computed from the users collection
+    """
+    out = {}
+    async for row in dbs.users.aggregate(_referrals_pipeline({'referrer_user_id': {'$gt': 0}}), allowDiskUse=True):
+        out[row['_id']] = (row['referrals'], Money.validate(row['revenue']))
+    return out
+
+
+async def rebuild():
+    expected = await aggregate_from_users()
+    requests = []
+    for user_id, (referrals, revenue) in expected.items():
+        requests.append(UpdateOne({'user_id': user_id},
+                                  {'$set': {'referrals': referrals,
+                                            'revenue': revenue,
+                                            'share': referral_share(revenue)}},
+                                  upsert=True))
+        if len(requests) >= BATCH_SIZE:
+            await dbs.referral_stats.bulk_write(requests, ordered=False)
+            requests = []
+    if requests:
+        await dbs.referral_stats.bulk_write(requests, ordered=False)
+    removed = await dbs.referral_stats.delete_many({'user_id': {'$nin': list(expected)}})
+    logger.info('rebuild. %s referrers, %s stale removed', len(expected), removed.deleted_count)
+
+
+async def verify() -> int:
+    """
+    :return: number of referrers whose counters differ from the users collection
+    """
+    expected = await aggregate_from_users()
+    mismatches = 0
+    async for raw in dbs.referral_stats.find({}):
+        stats = ReferralStats.from_db(raw)
+        referrals, revenue = expected.pop(stats.user_id, (0, Money(0)))
+        if (stats.referrals, stats.revenue, stats.share) != (referrals, revenue, referral_share(revenue)):
+            mismatches += 1
+            logger.warning('mismatch %s: stored %s/%s/%s%%, expected %s/%s/%s%%',
+                           stats.user_id, stats.referrals, stats.revenue, stats.share,
+                           referrals, revenue, referral_share(revenue))
+    for user_id in expected:
+        mismatches += 1
+        logger.warning('missing stats of referrer %s', user_id)
+    logger.info('verify. %s mismatches', mismatches)
+    return mismatches
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Maintain referral statistics')
+    parser.add_argument('command', choices=['rebuild', 'verify'])
+    args = parser.parse_args()
+    if args.command == 'rebuild':
+        asyncio.run(rebuild())
+    else:
+        sys.exit(1 if asyncio.run(verify()) else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,671 @@
+"""
+Storage backends behind ``db.engine.dbs``: MongoDB through Motor, or in-process memory.
+
+The memory backend keeps documents as MongoDB would return them: every document is encoded to BSON and decoded
+with ``codec_options`` on the way in and out, so amounts (Decimal128), datetimes (millisecond precision) and ObjectIds
+behave the same. Filters and updates go through BSON too, so a ``Money`` in a query is compared as Decimal128 TON. It supports the queries and updates this repo uses and raises NotImplementedError for anything else.
+"""
+from decimal import Decimal
+from typing import Any, Dict, List, Optional, Iterable, Iterator, Tuple, Union
+
+import time
+
+import bson
+from bson import ObjectId
+from motor.core import AgnosticCollection
+from pymongo import ReturnDocument, UpdateOne, UpdateMany, InsertOne, ASCENDING, IndexModel
+from pymongo.errors import DuplicateKeyError
+from pymongo.results import InsertOneResult, InsertManyResult, UpdateResult, DeleteResult, BulkWriteResult
+
+from core import metrics
+from core.tracing import span
+from db.codecs import codec_options
+
+
+class Collection:
+    """
+    Operations on a collection used in this repo, with the signatures of Motor.
+    ``session`` and other keyword arguments are accepted by every operation.
+    """
+    name: str
+    # MongoDB sessions, see db.engine.transaction
+    supports_transactions = False
+
+    async def find_one(self, filter: dict, projection: Optional[dict] = None, **kwargs) -> Optional[dict]:
+        raise NotImplementedError
+
+    async def find_one_and_update(self, filter: dict, update: dict, projection: Optional[dict] = None,
+                                  upsert: bool = False, return_document: bool = ReturnDocument.BEFORE,
+                                  **kwargs) -> Optional[dict]:
+        raise NotImplementedError
+
+    async def update_one(self, filter: dict, update: dict, upsert: bool = False, **kwargs) -> UpdateResult:
+        raise NotImplementedError
+
+    async def update_many(self, filter: dict, update: dict, upsert: bool = False, **kwargs) -> UpdateResult:
+        raise NotImplementedError
+
+    async def insert_one(self, document: dict, **kwargs) -> InsertOneResult:
+        raise NotImplementedError
+
+    async def insert_many(self, documents: Iterable[dict], ordered: bool = True, **kwargs) -> InsertManyResult:
+        raise NotImplementedError
+
+    async def delete_many(self, filter: dict, **kwargs) -> DeleteResult:
+        raise NotImplementedError
+
+    async def bulk_write(self, requests: List[Union[UpdateOne, UpdateMany, InsertOne]], ordered: bool = True,
+                         **kwargs) -> BulkWriteResult:
+        raise NotImplementedError
+
+    def find(self, filter: Optional[dict] = None, projection: Optional[dict] = None, **kwargs):
+        """
+        :return: cursor with ``sort``, ``skip``, ``limit``, ``to_list`` and ``async for``
+        """
+        raise NotImplementedError
+
+    def aggregate(self, pipeline: List[dict], **kwargs):
+        """
+        :return: cursor with ``to_list`` and ``async for``
+        """
+        raise NotImplementedError
+
+    async def create_indexes(self, indexes: List[IndexModel], **kwargs) -> List[str]:
+        raise NotImplementedError
+
+    async def index_information(self, **kwargs) -> Dict[str, dict]:
+        raise NotImplementedError
+
+
+class MotorCollection(Collection):
+    supports_transactions = True
+
+    def __init__(self, collection: AgnosticCollection):
+        self.collection = collection
+        self.name = collection.name
+
+    async def find_one(self, filter, projection=None, **kwargs):
+        return await self.collection.find_one(filter, projection, **kwargs)
+
+    async def find_one_and_update(self, filter, update, projection=None, upsert=False,
+                                  return_document=ReturnDocument.BEFORE, **kwargs):
+        return await self.collection.find_one_and_update(filter, update, projection, upsert=upsert,
+                                                         return_document=return_document, **kwargs)
+
+    async def update_one(self, filter, update, upsert=False, **kwargs):
+        return await self.collection.update_one(filter, update, upsert=upsert, **kwargs)
+
+    async def update_many(self, filter, update, upsert=False, **kwargs):
+        return await self.collection.update_many(filter, update, upsert=upsert, **kwargs)
+
+    async def insert_one(self, document, **kwargs):
+        return await self.collection.insert_one(document, **kwargs)
+
+    async def insert_many(self, documents, ordered=True, **kwargs):
+        return await self.collection.insert_many(documents, ordered=ordered, **kwargs)
+
+    async def delete_many(self, filter, **kwargs):
+        return await self.collection.delete_many(filter, **kwargs)
+
+    async def bulk_write(self, requests, ordered=True, **kwargs):
+        return await self.collection.bulk_write(requests, ordered=ordered, **kwargs)
+
+    def find(self, filter=None, projection=None, **kwargs):
+        return self.collection.find(filter, projection, **kwargs)
+
+    def aggregate(self, pipeline, **kwargs):
+        return self.collection.aggregate(pipeline, **kwargs)
+
+    async def create_indexes(self, indexes, **kwargs):
+        return await self.collection.create_indexes(indexes, **kwargs)
+
+    async def index_information(self, **kwargs):
+        return await self.collection.index_information(**kwargs)
+
+
+_MISSING = object()
+
+
+def _copy(document: dict) -> dict:
+    return bson.decode(bson.encode(document, codec_options=codec_options), codec_options=codec_options)
+
+
+def _copy_stages(pipeline: List[dict]) -> List[dict]:
+    return _copy({'pipeline': pipeline})['pipeline']
+
+
+def _get(document: dict, path: str) -> Any:
+    value = document
+    for key in path.split('.'):
+        if not isinstance(value, dict) or key not in value:
+            return _MISSING
+        value = value[key]
+    return value
+
+
+def _set(document: dict, path: str, value: Any):
+    *parents, key = path.split('.')
+    for parent in parents:
+        document = document.setdefault(parent, {})
+    document[key] = value
+
+
+def _unset(document: dict, path: str):
+    *parents, key = path.split('.')
+    for parent in parents:
+        document = document.get(parent)
+        if not isinstance(document, dict):
+            return
+    document.pop(key, None)
+
+
+def _is_operator_dict(value: Any) -> bool:
+    return isinstance(value, dict) and bool(value) and all(key.startswith('$') for key in value)
+
+
+def _equals(value: Any, expected: Any) -> bool:
+    if value is _MISSING:
+        return expected is None
+    if isinstance(value, list) and not isinstance(expected, list):
+        return expected in value
+    return value == expected
+
+
+def _compare(value: Any, argument: Any, op) -> bool:
+    if value is _MISSING or value is None:
+        return False
+    try:
+        return op(value, argument)
+    except TypeError:
+        return False
+
+
+_QUERY_OPERATORS = {
+    '$eq': _equals,
+    '$ne': lambda value, argument: not _equals(value, argument),
+    '$in': lambda value, argument: any(_equals(value, item) for item in argument),
+    '$nin': lambda value, argument: not any(_equals(value, item) for item in argument),
+    '$gt': lambda value, argument: _compare(value, argument, lambda a, b: a > b),
+    '$gte': lambda value, argument: _compare(value, argument, lambda a, b: a >= b),
+    '$lt': lambda value, argument: _compare(value, argument, lambda a, b: a < b),
+    '$lte': lambda value, argument: _compare(value, argument, lambda a, b: a <= b),
+    '$exists': lambda value, argument: (value is not _MISSING) == bool(argument),
+}
+
+
+def _matches(document: dict, filter: dict) -> bool:
+    for path, condition in filter.items():
+        if path == '$and' or path == '$or':
+            matched = (_matches(document, clause) for clause in condition)
+            if not (all(matched) if path == '$and' else any(matched)):
+                return False
+            continue
+        value = _get(document, path)
+        if _is_operator_dict(condition):
+            for op, argument in condition.items():
+                if op not in _QUERY_OPERATORS:
+                    raise NotImplementedError(f'query operator {op}')
+                if not _QUERY_OPERATORS[op](value, argument):
+                    return False
+        elif not _equals(value, condition):
+            return False
+    return True
+
+
+def _apply_update(document: dict, update: dict, inserted: bool):
+    for op, fields in update.items():
+        if op == '$set' or (op == '$setOnInsert' and inserted):
+            for path, value in fields.items():
+                _set(document, path, value)
+        elif op == '$inc':
+            for path, value in fields.items():
+                current = _get(document, path)
+                _set(document, path, value if current is _MISSING else current + value)
+        elif op == '$unset':
+            for path in fields:
+                _unset(document, path)
+        elif op != '$setOnInsert':
+            raise NotImplementedError(f'update operator {op}')
+
+
+def _project(document: dict, projection: Optional[dict]) -> dict:
+    if not projection:
+        return document
+    include = {path for path, value in projection.items() if value}
+    if include:
+        out = {path: document[path] for path in include if path in document}
+        if projection.get('_id', 1) and '_id' in document:
+            out['_id'] = document['_id']
+        return out
+    return {key: value for key, value in document.items() if key not in projection}
+
+
+def _sort_key(value: Any) -> Tuple[bool, Any]:
+    # missing and null fields come first, like in MongoDB
+    return (value is not _MISSING and value is not None), (value if value is not _MISSING else None)
+
+
+def _sorted(documents: List[dict], keys: List[Tuple[str, int]]) -> List[dict]:
+    for path, direction in reversed(keys):
+        documents.sort(key=lambda document: _sort_key(_get(document, path)), reverse=direction < 0)
+    return documents
+
+
+def _evaluate(expression: Any, document: dict) -> Any:
+    if isinstance(expression, str) and expression.startswith('$'):
+        value = _get(document, expression[1:])
+        return None if value is _MISSING else value
+    if _is_operator_dict(expression):
+        (op, arguments), = expression.items()
+        if op == '$ifNull':
+            value = _evaluate(arguments[0], document)
+            return _evaluate(arguments[1], document) if value is None else value
+        raise NotImplementedError(f'expression operator {op}')
+    return expression
+
+
+def _is_number(value: Any) -> bool:
+    return isinstance(value, (int, float, Decimal)) and not isinstance(value, bool)
+
+
+def _accumulate(op: str, values: List[Any]) -> Any:
+    if op == '$sum':
+        return sum((value for value in values if _is_number(value)), 0)
+    present = [value for value in values if value is not None]
+    if op == '$min':
+        return min(present, default=None)
+    if op == '$max':
+        return max(present, default=None)
+    if op == '$first':
+        return values[0] if values else None
+    if op == '$last':
+        return values[-1] if values else None
+    raise NotImplementedError(f'accumulator {op}')
+
+
+def _group(documents: List[dict], spec: dict) -> List[dict]:
+    groups: Dict[Any, List[dict]] = {}
+    for document in documents:
+        groups.setdefault(_evaluate(spec['_id'], document), []).append(document)
+    out = []
+    for key, members in groups.items():
+        row = {'_id': key}
+        for field, accumulator in spec.items():
+            if field == '_id':
+                continue
+            (op, expression), = accumulator.items()
+            row[field] = _accumulate(op, [_evaluate(expression, member) for member in members])
+        out.append(row)
+    return out
+
+
+class MemoryCursor:
+    def __init__(self, documents: Iterable[dict], projection: Optional[dict] = None):
+        self._documents = documents
+        self._projection = projection
+        self._sort: List[Tuple[str, int]] = []
+        self._skip = 0
+        self._limit = 0
+
+    def sort(self, key_or_list: Union[str, List[Tuple[str, int]]], direction: int = ASCENDING) -> 'MemoryCursor':
+        self._sort = [(key_or_list, direction)] if isinstance(key_or_list, str) else list(key_or_list)
+        return self
+
+    def skip(self, skip: int) -> 'MemoryCursor':
+        self._skip = skip
+        return self
+
+    def limit(self, limit: int) -> 'MemoryCursor':
+        self._limit = limit
+        return self
+
+    def _results(self) -> Iterator[dict]:
+        documents = list(self._documents)
+        if self._sort:
+            documents = _sorted(documents, self._sort)
+        documents = documents[self._skip:self._skip + self._limit if self._limit else None]
+        for document in documents:
+            yield _copy(_project(document, self._projection))
+
+    async def to_list(self, length: Optional[int] = None) -> List[dict]:
+        results = self._results()
+        return [document for _, document in zip(range(length), results)] if length else list(results)
+
+    async def __aiter__(self):
+        for document in self._results():
+            yield document
+
+
+class MemoryCollection(Collection):
+    """
+    Documents in a dict by ``_id``, with hash indexes on the fields queried by equality (built on first use)
+    and uniqueness of single-field unique indexes
+    """
+
+    def __init__(self, name: str):
+        self.name = name
+        self._documents: Dict[Any, dict] = {}
+        # field -> value -> _ids, in insertion order
+        self._indexes: Dict[str, Dict[Any, Dict[Any, None]]] = {}
+        self._unique: Dict[str, str] = {}
+        self._index_models: Dict[str, dict] = {}
+
+    def __len__(self):
+        return len(self._documents)
+
+    @staticmethod
+    def _index_keys(value: Any) -> Iterator[Any]:
+        values = value if isinstance(value, list) else [value]
+        for value in values:
+            try:
+                hash(value)
+            except TypeError:
+                continue
+            yield None if value is _MISSING else value
+
+    def _index(self, path: str) -> Dict[Any, Dict[Any, None]]:
+        index = self._indexes.get(path)
+        if index is None:
+            index = self._indexes[path] = {}
+            for _id, document in self._documents.items():
+                for key in self._index_keys(_get(document, path)):
+                    index.setdefault(key, {})[_id] = None
+        return index
+
+    def _unindex(self, document: dict):
+        for path, index in self._indexes.items():
+            for key in self._index_keys(_get(document, path)):
+                ids = index.get(key)
+                if ids is not None:
+                    ids.pop(document['_id'], None)
+                    if not ids:
+                        del index[key]
+
+    def _check_unique(self, document: dict):
+        for path, name in self._unique.items():
+            for key in self._index_keys(_get(document, path)):
+                if any(_id != document['_id'] for _id in self._index(path).get(key, ())):
+                    raise DuplicateKeyError(f'E11000 duplicate key error collection: {self.name} index: {name} '
+                                            f'dup key: {{ {path}: {key!r} }}', 11000)
+
+    def _store(self, document: dict):
+        self._check_unique(document)
+        self._documents[document['_id']] = document
+        for path, index in self._indexes.items():
+            for key in self._index_keys(_get(document, path)):
+                index.setdefault(key, {})[document['_id']] = None
+
+    def _select(self, filter: Optional[dict]) -> List[dict]:
+        if not filter:
+            return list(self._documents.values())
+        filter = _copy(filter)
+        candidates = None
+        for path, condition in filter.items():
+            if _is_operator_dict(condition) or isinstance(condition, (dict, list)):
+                continue
+            try:
+                hash(condition)
+            except TypeError:
+                continue
+            if path == '_id':
+                document = self._documents.get(condition)
+                candidates = [document] if document is not None else []
+            else:
+                candidates = [self._documents[_id] for _id in self._index(path).get(condition, ())]
+            break
+        if candidates is None:
+            candidates = self._documents.values()
+        return [document for document in candidates if _matches(document, filter)]
+
+    def _insert(self, document: dict) -> Any:
+        document = _copy(document)
+        document.setdefault('_id', ObjectId())
+        if document['_id'] in self._documents:
+            raise DuplicateKeyError(f'E11000 duplicate key error collection: {self.name} index: _id_ '
+                                    f'dup key: {{ _id: {document["_id"]!r} }}', 11000)
+        self._store(document)
+        return document['_id']
+
+    def _update(self, filter: dict, update: dict, upsert: bool, multi: bool) -> Tuple[int, int, Any, Optional[dict],
+                                                                                      Optional[dict]]:
+        """
+        :return: matched, modified, upserted _id, the first document before and after the update
+        """
+        if not update or not all(key.startswith('$') for key in update):
+            raise NotImplementedError('replacement documents')
+        update = _copy(update)
+        documents = self._select(filter)
+        if not multi:
+            documents = documents[:1]
+        if not documents:
+            if not upsert:
+                return 0, 0, None, None, None
+            document = {path: value for path, value in _copy(filter).items() if not _is_operator_dict(value)}
+            _apply_update(document, update, inserted=True)
+            _id = self._insert(document)
+            return 0, 0, _id, None, self._documents[_id]
+        modified = 0
+        before = after = None
+        for document in documents:
+            # stored documents are replaced, never mutated, so ``document`` stays the state before the update
+            new = _copy(document)
+            _apply_update(new, update, inserted=False)
+            new = _copy(new)
+            if new != document:
+                self._unindex(document)
+                try:
+                    self._store(new)
+                except DuplicateKeyError:
+                    self._store(document)
+                    raise
+                modified += 1
+            if before is None:
+                before, after = document, new
+        return len(documents), modified, None, before, after
+
+    async def find_one(self, filter, projection=None, **kwargs):
+        documents = self._select(filter)
+        return _copy(_project(documents[0], projection)) if documents else None
+
+    async def find_one_and_update(self, filter, update, projection=None, upsert=False,
+                                  return_document=ReturnDocument.BEFORE, **kwargs):
+        _, _, _, before, after = self._update(filter, update, upsert, multi=False)
+        document = after if return_document == ReturnDocument.AFTER else before
+        return _copy(_project(document, projection)) if document is not None else None
+
+    async def update_one(self, filter, update, upsert=False, **kwargs):
+        matched, modified, upserted, _, _ = self._update(filter, update, upsert, multi=False)
+        return UpdateResult({'n': matched or int(upserted is not None), 'nModified': modified,
+                             'upserted': upserted}, True)
+
+    async def update_many(self, filter, update, upsert=False, **kwargs):
+        matched, modified, upserted, _, _ = self._update(filter, update, upsert, multi=True)
+        return UpdateResult({'n': matched or int(upserted is not None), 'nModified': modified,
+                             'upserted': upserted}, True)
+
+    async def insert_one(self, document, **kwargs):
+        _id = self._insert(document)
+        # like pymongo, the generated _id is added to the caller's document
+        document.setdefault('_id', _id)
+        return InsertOneResult(_id, True)
+
+    async def insert_many(self, documents, ordered=True, **kwargs):
+        ids = []
+        for document in documents:
+            ids.append((await self.insert_one(document)).inserted_id)
+        return InsertManyResult(ids, True)
+
+    async def delete_many(self, filter, **kwargs):
+        documents = self._select(filter)
+        for document in documents:
+            self._unindex(document)
+            del self._documents[document['_id']]
+        return DeleteResult({'n': len(documents)}, True)
+
+    async def bulk_write(self, requests, ordered=True, **kwargs):
+        result = {'nInserted': 0, 'nUpserted': 0, 'nMatched': 0, 'nModified': 0, 'nRemoved': 0, 'upserted': []}
+        for index, request in enumerate(requests):
+            if isinstance(request, InsertOne):
+                await self.insert_one(request._doc)
+                result['nInserted'] += 1
+            elif isinstance(request, (UpdateOne, UpdateMany)):
+                matched, modified, upserted, _, _ = self._update(request._filter, request._doc, request._upsert,
+                                                                 multi=isinstance(request, UpdateMany))
+                result['nMatched'] += matched
+                result['nModified'] += modified
+                if upserted is not None:
+                    result['nUpserted'] += 1
+                    result['upserted'].append({'index': index, '_id': upserted})
+            else:
+                raise NotImplementedError(f'bulk request {type(request).__name__}')
+        return BulkWriteResult(result, True)
+
+    def find(self, filter=None, projection=None, **kwargs):
+        return MemoryCursor(self._select(filter), projection)
+
+    def aggregate(self, pipeline, **kwargs):
+        documents = list(self._documents.values())
+        for stage in _copy_stages(pipeline):
+            (name, spec), = stage.items()
+            if name == '$match':
+                documents = [document for document in documents if _matches(document, spec)]
+            elif name == '$group':
+                documents = _group(documents, spec)
+            elif name == '$sort':
+                documents = _sorted(list(documents), list(spec.items()))
+            elif name == '$limit':
+                documents = documents[:spec]
+            else:
+                raise NotImplementedError(f'aggregation stage {name}')
+        return MemoryCursor(documents)
+
+    async def create_indexes(self, indexes, **kwargs):
+        names = []
+        for index in indexes:
+            document = index.document
+            self._index_models[document['name']] = document
+            keys = list(document['key'].items())
+            self._index(keys[0][0])
+            if document.get('unique') and len(keys) == 1 and 'partialFilterExpression' not in document:
+                self._unique[keys[0][0]] = document['name']
+                for stored in self._documents.values():
+                    self._check_unique(stored)
+            names.append(document['name'])
+        return names
+
+    async def index_information(self, **kwargs):
+        info = {'_id_': {'key': [('_id', ASCENDING)]}}
+        for name, document in self._index_models.items():
+            info[name] = {'key': list(document['key'].items()),
+                          **{key: value for key, value in document.items() if key not in ('key', 'name')}}
+        return info
+
+
+class MeteredCursor:
+    """
+    Records the time spent waiting for the documents of ``cursor``, once it is exhausted
+    """
+
+    def __init__(self, cursor, seconds: metrics.HistogramChild):
+        self._cursor = cursor
+        self._seconds = seconds
+
+    def sort(self, *args, **kwargs) -> 'MeteredCursor':
+        self._cursor = self._cursor.sort(*args, **kwargs)
+        return self
+
+    def skip(self, skip: int) -> 'MeteredCursor':
+        self._cursor = self._cursor.skip(skip)
+        return self
+
+    def limit(self, limit: int) -> 'MeteredCursor':
+        self._cursor = self._cursor.limit(limit)
+        return self
+
+    def __getattr__(self, name: str):
+        return getattr(self._cursor, name)
+
+    async def to_list(self, length: Optional[int] = None) -> List[dict]:
+        start = time.perf_counter()
+        try:
+            return await self._cursor.to_list(length)
+        finally:
+            self._seconds.observe(time.perf_counter() - start)
+
+    async def __aiter__(self):
+        iterator = self._cursor.__aiter__()
+        elapsed = 0.0
+        try:
+            while True:
+                start = time.perf_counter()
+                try:
+                    document = await iterator.__anext__()
+                except StopAsyncIteration:
+                    return
+                finally:
+                    elapsed += time.perf_counter() - start
+                yield document
+        finally:
+            self._seconds.observe(elapsed)
+
+
+class MeteredCollection(Collection):
+    """
+    Records the duration of every operation on ``collection`` in ``metrics.db_operations``
+    """
+    OPERATIONS = ('find_one', 'find_one_and_update', 'update_one', 'update_many', 'insert_one', 'insert_many',
+                  'delete_many', 'bulk_write', 'find', 'aggregate', 'create_indexes', 'index_information')
+
+    def __init__(self, collection: Collection):
+        self.collection = collection
+        self.name = collection.name
+        self.supports_transactions = collection.supports_transactions
+        self._seconds = {operation: metrics.db_operations.labels(self.name, operation)
+                         for operation in self.OPERATIONS}
+        self._span_details = {operation: f'{self.name}.{operation}' for operation in self.OPERATIONS}
+
+    async def _timed(self, operation: str, awaitable):
+        start = time.perf_counter()
+        try:
+            with span('db', self._span_details[operation]):
+                return await awaitable
+        finally:
+            self._seconds[operation].observe(time.perf_counter() - start)
+
+    async def find_one(self, filter, projection=None, **kwargs):
+        return await self._timed('find_one', self.collection.find_one(filter, projection, **kwargs))
+
+    async def find_one_and_update(self, filter, update, projection=None, upsert=False,
+                                  return_document=ReturnDocument.BEFORE, **kwargs):
+        return await self._timed('find_one_and_update', self.collection.find_one_and_update(
+            filter, update, projection, upsert=upsert, return_document=return_document, **kwargs))
+
+    async def update_one(self, filter, update, upsert=False, **kwargs):
+        return await self._timed('update_one', self.collection.update_one(filter, update, upsert=upsert, **kwargs))
+
+    async def update_many(self, filter, update, upsert=False, **kwargs):
+        return await self._timed('update_many', self.collection.update_many(filter, update, upsert=upsert, **kwargs))
+
+    async def insert_one(self, document, **kwargs):
+        return await self._timed('insert_one', self.collection.insert_one(document, **kwargs))
+
+    async def insert_many(self, documents, ordered=True, **kwargs):
+        return await self._timed('insert_many', self.collection.insert_many(documents, ordered=ordered, **kwargs))
+
+    async def delete_many(self, filter, **kwargs):
+        return await self._timed('delete_many', self.collection.delete_many(filter, **kwargs))
+
+    async def bulk_write(self, requests, ordered=True, **kwargs):
+        return await self._timed('bulk_write', self.collection.bulk_write(requests, ordered=ordered, **kwargs))
+
+    def find(self, filter=None, projection=None, **kwargs):
+        return MeteredCursor(self.collection.find(filter, projection, **kwargs), self._seconds['find'])
+
+    def aggregate(self, pipeline, **kwargs):
+        return MeteredCursor(self.collection.aggregate(pipeline, **kwargs), self._seconds['aggregate'])
+
+    async def create_indexes(self, indexes, **kwargs):
+        return await self._timed('create_indexes', self.collection.create_indexes(indexes, **kwargs))
+
+    async def index_information(self, **kwargs):
+        return await self._timed('index_information', self.collection.index_information(**kwargs))
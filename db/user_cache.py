@@ -0,0 +1,102 @@
+import asyncio
+import time
+import traceback
+from collections import OrderedDict
+from datetime import datetime
+from typing import Dict, Optional, Tuple
+
+from pymongo import UpdateOne
+
+from core.config_loader import config
+from core.invalidation import bus
+from core.logging_config import root_logger
+from db.engine import dbs
+from db.models import User
+
+# written by the game webapps, which can't invalidate the cache: reloaded on every update of a cached user
+EXTERNAL_FIELDS = ('balance', 'sum_revenue')
+
+
+class UserCache:
+    """
+    LRU/TTL cache in front of ``dbs.users``, except for ``EXTERNAL_FIELDS``.
+    ``last_active`` bumps of cached users are collected and written periodically with one bulk_write.
+    Code that changes a user document outside of the cached object (balances, admin actions)
+    has to call ``invalidate``, code that saves changes of the cached object has to call ``updated``.
+    """
+    logger = root_logger.getChild('UserCache')
+
+    def __init__(self, size: int, ttl: float, flush_interval: float):
+        self.size = size
+        self.ttl = ttl
+        self.flush_interval = flush_interval
+        # user_id -> (expires at, user, telegram profile the user was loaded with)
+        self._users: 'OrderedDict[int, Tuple[float, User, dict]]' = OrderedDict()
+        self._last_active: Dict[int, datetime] = {}
+        self._flusher: Optional[asyncio.Task] = None
+
+    def get(self, user_id: int) -> Optional[Tuple[User, dict]]:
+        entry = self._users.get(user_id)
+        if entry is None:
+            return None
+        expires, user, profile = entry
+        if expires < time.monotonic():
+            del self._users[user_id]
+            return None
+        self._users.move_to_end(user_id)
+        return user, profile
+
+    def put(self, user: User, profile: dict):
+        self._users[user.user_id] = (time.monotonic() + self.ttl, user, profile)
+        self._users.move_to_end(user.user_id)
+        while len(self._users) > self.size:
+            self._users.popitem(last=False)
+
+    def invalidate(self, user_id: int):
+        """
+        Drops the user here and in the other worker processes
+        """
+        self.drop(user_id)
+        bus.publish('user', user_id)
+
+    def updated(self, user_id: int):
+        """
+        The cached user was changed and saved by this process: drops the stale copies of the other workers
+        """
+        bus.publish('user', user_id)
+
+    def drop(self, user_id: int):
+        self._users.pop(user_id, None)
+
+    def touch(self, user_id: int, last_active: datetime):
+        self._last_active[user_id] = last_active
+        if self._flusher is None or self._flusher.done():
+            self._flusher = asyncio.create_task(self._flush_periodically())
+
+    async def flush(self):
+        if not self._last_active:
+            return
+        pending, self._last_active = self._last_active, {}
+        await dbs.users.bulk_write([UpdateOne({'user_id': user_id}, {'$set': {'last_active': last_active}})
+                                    for user_id, last_active in pending.items()], ordered=False)
+        self.logger.debug('flushed last_active of %s users', len(pending))
+
+    async def _flush_periodically(self):
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            try:
+                await self.flush()
+            except Exception:
+                self.logger.error(''.join(traceback.format_exc()))
+
+    async def close(self):
+        if self._flusher:
+            self._flusher.cancel()
+            self._flusher = None
+        await self.flush()
+
+
+user_cache = UserCache(size=config.user_cache.size,
+                       ttl=config.user_cache.ttl,
+                       flush_interval=config.user_cache.flush_interval)
+bus.subscribe('user', user_cache.drop)
@@ -6,6 +6,7 @@ from aiogram.utils.exceptions import MessageNotModified
 from core.aiogram_nodes.node import Shortcuts
 from core.aiogram_nodes.telegram_dispatcher import TelegramDispatcher
 from core.aiogram_nodes.util import encode_callback_data
+from core.outbox import outbox
 from handlers_bot.nodes.main_menu import MainMenu
 from i18n import _
 
@@ -14,12 +15,14 @@ async def callback_query_fallback(query: types.CallbackQuery):
     text = _('😐 *Oops....*\n'
              'Something unexpected happened.')
     buttons = [
-        [types.InlineKeyboardButton(MainMenu().title, callback_data=encode_callback_data({Shortcuts.TRANSITION_TO_NODE: MainMenu.state()}))]
+        [types.InlineKeyboardButton(MainMenu.title, callback_data=encode_callback_data({Shortcuts.TRANSITION_TO_NODE: MainMenu.state()}))]
     ]
     with suppress(MessageNotModified):
-        await query.message.edit_text(text,
-                                      reply_markup=types.InlineKeyboardMarkup(1, inline_keyboard=buttons),
-                                      parse_mode='markdown')
+        await outbox.edit_message_text(chat_id=query.message.chat.id,
+                                       message_id=query.message.message_id,
+                                       text=text,
+                                       reply_markup=types.InlineKeyboardMarkup(1, inline_keyboard=buttons),
+                                       parse_mode='markdown')
     await query.answer()
 
 
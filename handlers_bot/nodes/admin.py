@@ -1,15 +1,19 @@
 from typing import List
 
 from core.aiogram_nodes.node import Node, Button
+from core.aiogram_nodes.util import classproperty
+from core.aiogram_nodes.render_cache import RenderScope
 
 
 class AdminMenu(Node):
     commands = ['admin']
 
     only_admin = True
+    text_scope = RenderScope.STATIC
+    markup_scope = RenderScope.STATIC
 
-    @property
-    def title(self) -> str:
+    @classproperty
+    def title(cls) -> str:
         return 'Admin Menu'
 
     async def text(self) -> str:
@@ -1,24 +1,21 @@
 from typing import Any, List
 from pydantic import BaseModel
 
-from core.pure import to_decimal
 from core.aiogram_nodes.node import Node, TransitionButton, Button
+from core.aiogram_nodes.render_cache import RenderScope
 from i18n import _
 
 
 class Confirm(Node):
     emoji = '✅'
+    text_scope = RenderScope.STATIC
+    markup_scope = RenderScope.STATIC
 
     class Props(BaseModel):
         msg: str = 'continue'
         data: Any = ''
         next_state = ''
 
-        def __init__(self, **kwargs):
-            super().__init__(**kwargs)
-            if isinstance(self.data, float):
-                self.data = to_decimal(self.data)
-
     @property
     def header(self) -> str:
         return self.emoji + ' ' + _('Confirmation')
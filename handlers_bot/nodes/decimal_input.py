@@ -1,12 +1,11 @@
-import decimal
-from decimal import Decimal
 from typing import Union, List
 
 from aiogram import types
 from pydantic import BaseModel
 
-from core.pure import to_decimal
+from core.money import Money
 from core.aiogram_nodes.node import Node, TransitionButton, Button
+from core.aiogram_nodes.render_cache import RenderScope
 from core.aiogram_nodes.util import is_msg
 from handlers_bot.nodes.confirm import Confirm
 from i18n import _
@@ -14,14 +13,16 @@ from i18n import _
 
 class DecimalInput(Node):
     next_state: str = '1'
-    min: Decimal = to_decimal(1)
-    max: Decimal = to_decimal(100)
+    min: Money = Money.ton(1)
+    max: Money = Money.ton(100)
 
     on_text = True
+    text_scope = RenderScope.STATIC
+    markup_scope = RenderScope.STATIC
 
     class Props(BaseModel):
-        amounts: List[List[Decimal]] = [[to_decimal(5), to_decimal(10)], [to_decimal(50), to_decimal(100)]]
-        amount: Decimal = 0
+        amounts: List[List[Money]] = [[Money.ton(5), Money.ton(10)], [Money.ton(50), Money.ton(100)]]
+        amount: Money = Money(0)
         error_msg: str = ''
 
     @property
@@ -44,7 +45,7 @@ class DecimalInput(Node):
 
     @property
     def buttons(self) -> List[List[Button]]:
-        def btn_text(x: Decimal):
+        def btn_text(x: Money):
             string = str(x).split('.')[0]
             return f'{string} TON'
 
@@ -59,8 +60,8 @@ class DecimalInput(Node):
             await update.delete()
             self._logger.info('got new input. text = %s', update.text)
             try:
-                amount = to_decimal(update.text.replace(',', '.'))
-            except decimal.InvalidOperation:
+                amount = Money.ton(update.text.replace(',', '.'), places=2)
+            except ValueError:
                 self.props.error_msg = _('The entered value is not a number.')
                 return
 
@@ -5,7 +5,8 @@ from pydantic import BaseModel
 
 from core.config_loader import config
 from core.aiogram_nodes.node import Node, Button, TransitionButton, URLButton, NullNode
-from core.aiogram_nodes.util import is_cq
+from core.aiogram_nodes.render_cache import RenderScope
+from core.aiogram_nodes.util import classproperty, is_cq
 
 from i18n import _
 
@@ -13,12 +14,14 @@ from i18n import _
 class Games(Node):
     emoji: str = '🕹'
     back_to = 'MainMenu'
+    text_scope = RenderScope.STATIC
+    markup_scope = RenderScope.STATIC
 
     class Props(BaseModel):
         show_alert: int = 0
 
-    @property
-    def title(self) -> str:
+    @classproperty
+    def title(cls) -> str:
         return _('Games')
 
     @property
@@ -2,16 +2,17 @@ import datetime
 from typing import Union, List
 
 from aiogram import types
-from aiogram.utils.exceptions import BadRequest
 
-from bot import bot
 from core.aiogram_nodes.node import Node, Button, TransitionButton, URLButton
-from core.aiogram_nodes.util import get_current_user
+from core.aiogram_nodes.render_cache import RenderScope
+from core.aiogram_nodes.util import classproperty, get_current_user
 from core.aiogram_nodes.util import is_msg
 from core.config_loader import config
 from core.constants import URL_NEWS, URL_SUPPORT
+from core.operator_digest import operator_digest, Event
 from db.helpers import get_user_by_user_id
 from db.models import User
+from db.referral_stats import add_referral
 from handlers_bot.nodes.games import Games
 from handlers_bot.nodes.referral import Referral
 from handlers_bot.nodes.settings import Settings
@@ -33,9 +34,11 @@ def random_welcome():
 class MainMenu(Node):
     emoji = '🏠'
     commands = ['start', 'help', 'menu']
+    text_scope = RenderScope.DYNAMIC
+    markup_scope = RenderScope.STATIC
 
-    @property
-    def title(self) -> str:
+    @classproperty
+    def title(cls) -> str:
         return _('Main Menu')
 
     async def text(self) -> str:
@@ -71,12 +74,9 @@ class MainMenu(Node):
                 if referrer:
                     self._logger.info(f'referer: {referrer}')
                     user.deposit_bonus = config.referral_deposit_bonus
-                    user.referrer_user_id = referrer.user_id
-                try:
-                    await bot.send_message(chat_id=config.operator_id, text=f'New User\n'
-                                                                            f'user: {user}\n'
-                                                                            f'date: {user.date_registered}\n'
-                                                                            f'referrer: {referrer}')
-                except BadRequest as e:
-                    self._logger.error(f'Unable to send callback to operator: {e.args}')
+                    if user.referrer_user_id != referrer.user_id:
+                        # a repeated /start within the registration window is counted once
+                        user.referrer_user_id = referrer.user_id
+                        await add_referral(referrer.user_id)
+                operator_digest.add(Event.NEW_USER, f'{user}, referrer: {referrer}')
         return
@@ -3,22 +3,80 @@ from typing import Union, List
 from aiogram import types
 from pydantic import BaseModel
 
-from bot import bot
 from core.config_loader import config
 from core.constants import URL_SUPPORT
-from core.aiogram_nodes.node import Node, Button, TransitionButton, URLButton
-from core.aiogram_nodes.util import get_current_user
-from core.pure import to_decimal
-from db.helpers import user_referral_stats
+from core.aiogram_nodes.node import Node, Button, TransitionButton, URLButton, ErrorNode
+from core.aiogram_nodes.render_cache import RenderScope
+from core.aiogram_nodes.util import classproperty, get_current_user
+from core.money import Money
+from core.operator_digest import operator_digest
+from core.outbox import outbox
+from db.helpers import user_referral_stats, get_user_by_user_id
+from db.ledger import ledger
+from db.models import User, LedgerKind
+from db.user_cache import user_cache
+from handlers_bot.nodes.confirm import Confirm
 from i18n import _
 
 
+async def referral_unpaid(user: User) -> Money:
+    """
+    Referral income of the user not credited to the balance yet
+    """
+    share, total_revenue = (await user_referral_stats(user))[:2]
+    return total_revenue.percent(share) - user.referral_paid
+
+
+class ConfirmReferralPayoutAdmin(Node):
+    emoji = Confirm.emoji
+    only_admin = True
+    text_scope = RenderScope.DYNAMIC
+    markup_scope = RenderScope.DYNAMIC
+
+    class Props(BaseModel):
+        u: int = 0
+        msg: str = ''
+
+    @classproperty
+    def title(cls) -> str:
+        return _('Confirm')
+
+    async def text(self) -> str:
+        return self.props.msg
+
+    async def process(self, update: Union[types.CallbackQuery, types.Message]) -> Union['Node', None]:
+        user = await get_user_by_user_id(self.props.u)
+        if user is None:
+            self._logger.error('cannot find user %s', self.props.u)
+            return ErrorNode(msg='Cannot find user')
+        amount = await referral_unpaid(user)
+        if amount <= 0:
+            return ErrorNode(msg='nothing to pay')
+        # credited only if referral_paid is still the value the amount was computed from:
+        # of concurrent approvals only one pays
+        paid = user.referral_paid if user.referral_paid else {'$in': [0, None]}
+        if not await ledger.record_if({'referral_paid': paid}, user.user_id, LedgerKind.REFERRAL_PAYOUT, amount):
+            self._logger.warn('referral payout of %s changed meanwhile', user.user_id)
+            return ErrorNode(msg='paid meanwhile')
+        user_cache.invalidate(user.user_id)
+        outbox.notify(
+            chat_id=user.user_id,
+            text=_('✅ {amount} 💎 of referral income added to your wallet').format(amount=amount),
+            reply_markup=types.InlineKeyboardMarkup(1, inline_keyboard=[[
+                TransitionButton(to_node='MainMenu', text='Main Menu').compile()
+            ]])
+        )
+        return None
+
+
 class ReferralRules(Node):
     emoji = 'ℹ'
     back_to = 'Referral'
+    text_scope = RenderScope.STATIC
+    markup_scope = RenderScope.STATIC
 
-    @property
-    def title(self) -> str:
+    @classproperty
+    def title(cls) -> str:
         return _('Referral Program Rules')
 
     async def text(self) -> str:
@@ -58,12 +116,14 @@ class ReferralButton(Button):
 class ReferralWithdraw(Node):
     emoji = '💎'
     back_to = 'Referral'
+    text_scope = RenderScope.STATIC
+    markup_scope = RenderScope.STATIC
 
     class Props(BaseModel):
         error_msg: str = ''
 
-    @property
-    def title(self) -> str:
+    @classproperty
+    def title(cls) -> str:
         return _('Withdraw')
 
     async def text(self) -> str:
@@ -75,20 +135,19 @@ class ReferralWithdraw(Node):
 
     async def process(self, update: Union[types.CallbackQuery, types.Message]) -> Union['Node', None]:
         user = get_current_user()
-        share, total_revenue, count = await user_referral_stats(user)
-        referral_balance = to_decimal(total_revenue * to_decimal(share / 100))
-        if referral_balance <= config.wallet.min_withdraw:
+        unpaid = await referral_unpaid(user)
+        if unpaid <= config.wallet.min_withdraw:
             self.props.error_msg = '❌ ' + _('Nothing to withdraw')
             return
-        await bot.send_message(
-            chat_id=config.operator_id,
-            text=f'Кто-то захотел вывести реферальные деньги.\n'
-                 f'Нужно как-то это решать......\n'
-                 f'вперед, автоматика :)))\n\n'
-                 f'user id: {user.user_id}\n'
-                 f'total revenue: {total_revenue}\n'
-                 f'amount referrals: {count}\n'
-                 f'referral_balance: {referral_balance}')
+        operator_digest.send_now(
+            text=f'New referral payout request\n'
+                 f'User: {user}\n'
+                 f'Paid before: {user.referral_paid}\n'
+                 f'Amount: {unpaid}',
+            reply_markup=types.InlineKeyboardMarkup(1, inline_keyboard=[[
+                TransitionButton(to_node=ConfirmReferralPayoutAdmin, props={'u': user.user_id}).compile()
+            ]])
+        )
         return
 
 
@@ -96,15 +155,17 @@ class Referral(Node):
     emoji = '🤝'
     commands = ['referral']
     back_to = 'MainMenu'
+    text_scope = RenderScope.DYNAMIC
+    markup_scope = RenderScope.PER_USER
 
-    @property
-    def title(self) -> str:
+    @classproperty
+    def title(cls) -> str:
         return _('Referral Program')
 
     async def text(self) -> str:
         user = get_current_user()
         share, total_revenue, count = await user_referral_stats(user)
-        referral_balance = to_decimal(total_revenue * to_decimal(share / 100))
+        referral_balance = total_revenue.percent(share)
 
         return _('Invite your friends and earn up to *90%* of our revenue from bets placed by them!\n'
                  'Your referrals will get +10% to their first deposit.\n\n') + _(
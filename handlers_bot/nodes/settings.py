@@ -4,7 +4,8 @@ from aiogram import types
 from pydantic import BaseModel
 
 from core.aiogram_nodes.node import Node, Button, TransitionButton
-from core.aiogram_nodes.util import is_cq
+from core.aiogram_nodes.render_cache import RenderScope
+from core.aiogram_nodes.util import classproperty, is_cq
 from core.aiogram_nodes.util import get_current_user
 from i18n import _
 
@@ -27,12 +28,15 @@ class Settings(Node):
     emoji = '⚙'
     commands = ['settings']
     back_to = 'MainMenu'
+    text_scope = RenderScope.STATIC
+    # the flag follows the user's language, which may differ from the locale of this update
+    markup_scope = RenderScope.PER_USER
 
     class Props(BaseModel):
         lang: bool = False
 
-    @property
-    def title(self) -> str:
+    @classproperty
+    def title(cls) -> str:
         return _('Settings')
 
     async def text(self) -> str:
@@ -1,18 +1,15 @@
-import decimal
-from decimal import Decimal
 from typing import Union, List
 
-import aiohttp
-import ujson
 from aiogram import types
 from pydantic import BaseModel
-from ujson import JSONDecodeError
 
-from core.aiogram_nodes.util import get_current_user
+from core.aiogram_nodes.util import classproperty, get_current_user
 from core.config_loader import config
-from core.constants import URL_ENG_GUIDE, CRYPTO_PAY_URL
-from core.pure import to_decimal
+from core.constants import URL_ENG_GUIDE
+from core.crypto_pay import crypto_pay, CryptoPayError
+from core.money import Money
 from core.aiogram_nodes.node import Node, URLButton, Button, NullNode, ErrorNode
+from core.aiogram_nodes.render_cache import RenderScope
 from db.engine import dbs
 from db.models import Invoice
 from handlers_bot.nodes.decimal_input import DecimalInput
@@ -22,18 +19,15 @@ from i18n import _
 class DepositCryptoBot(Node):
     emoji = '🤖'
     menu_btn = True
+    text_scope = RenderScope.DYNAMIC
+    markup_scope = RenderScope.DYNAMIC
 
     class Props(BaseModel):
-        data: Decimal = to_decimal(0)
+        data: Money = Money(0)
         invoice_hash: str = ''
 
-        def __init__(self, **kwargs):
-            super().__init__(**kwargs)
-            if isinstance(self.data, float):
-                self.data = to_decimal(self.data)
-
-    @property
-    def title(self) -> str:
+    @classproperty
+    def title(cls) -> str:
         return _('Deposit via @CryptoBot')
 
     async def text(self) -> str:
@@ -51,40 +45,19 @@ class DepositCryptoBot(Node):
         ]
 
     async def process(self, update: Union[types.CallbackQuery, types.Message]) -> Union['Node', None]:
-        try:
-            amount = to_decimal(self.props.data)
-        except decimal.InvalidOperation:
-            self._logger.warn(f'invalid input data %s', self.props.data)
-            return NullNode()
-
+        amount = self.props.data
         if amount > config.wallet.max_deposit or amount < config.wallet.min_deposit:
             self._logger.warn(f'invalid input amount %s', amount)
             return NullNode()
-        headers = {
-            'Crypto-Pay-API-Token': config.crypto_pay_token,
-            'Content-Type': 'application/x-www-form-urlencoded'
-        }
-
-        async with aiohttp.ClientSession(headers=headers) as client_session:
-            resp = await client_session.post(CRYPTO_PAY_URL + 'createInvoice',
-                                             data={'asset': 'TON', 'amount': amount})
-            if resp.status != 200:
-                self._logger.error('response status %s', resp.status)
-                return ErrorNode(msg='Unable to deposit...')
-            text = await resp.text()
         try:
-            invoice_dict = ujson.loads(text)
-        except JSONDecodeError:
-            self._logger.error('unable to decode: %s', text)
-            return ErrorNode(msg='Unable to deposit...')
-
-        if not invoice_dict.get('ok'):
-            self._logger.error('invoice is not ok: %s', text)
+            cp_invoice = await crypto_pay.create_invoice(asset='TON', amount=amount)
+        except CryptoPayError as e:
+            self._logger.error('unable to create invoice: %s', e)
             return ErrorNode(msg='Unable to deposit...')
 
         invoice = Invoice(user_id=get_current_user().user_id,
                           amount=amount,
-                          hash=invoice_dict['result']['hash'])
+                          hash=cp_invoice.hash)
         await dbs.invoices.insert_one(invoice.dict())
         self._logger.info('new deposit invoice: %s', invoice)
         self.props.invoice_hash = invoice.hash
@@ -100,8 +73,8 @@ class CryptoBotDI(DecimalInput):
 
     back_to = 'MainMenu'
 
-    @property
-    def title(self) -> str:
+    @classproperty
+    def title(cls) -> str:
         return _('Deposit')
 
     @property
@@ -1,24 +1,22 @@
-from contextlib import suppress
-from decimal import Decimal
-from typing import Union, List
+from typing import Union, List, Optional
 
-import aiohttp
-import ujson
 from aiogram import types
-from aiogram.utils.exceptions import TelegramAPIError
 from pydantic import BaseModel
-from ujson import JSONDecodeError
 
-from bot import bot
 from core.aiogram_nodes.node import Node, TransitionButton, Button, ErrorNode
-from core.aiogram_nodes.util import get_current_user
+from core.aiogram_nodes.render_cache import RenderScope
+from core.aiogram_nodes.util import classproperty, get_current_user
 from core.aiogram_nodes.util import is_cq
 from core.config_loader import config
-from core.constants import CRYPTO_PAY_URL
-from core.pure import to_decimal
+from core.crypto_pay import crypto_pay, CryptoPayError
+from core.money import Money
+from core.operator_digest import operator_digest
+from core.outbox import outbox
 from db.engine import dbs
 from db.helpers import get_user_by_user_id
-from db.models import WithdrawRequest as WR, PyObjectId
+from db.ledger import ledger
+from db.models import WithdrawRequest as WR, PyObjectId, LedgerKind
+from db.user_cache import user_cache
 from handlers_bot.nodes.confirm import Confirm
 from handlers_bot.nodes.decimal_input import DecimalInput
 from i18n import _
@@ -27,95 +25,91 @@ from i18n import _
 class ConfirmWithdrawalAdmin(Node):
     emoji = Confirm.emoji
     only_admin = True
+    text_scope = RenderScope.DYNAMIC
+    markup_scope = RenderScope.DYNAMIC
 
     class Props(BaseModel):
-        r: str = ''
+        r: Optional[PyObjectId] = None
         msg: str = ''
 
-    @property
-    def title(self) -> str:
+    @classproperty
+    def title(cls) -> str:
         return _('Confirm')
 
     async def text(self) -> str:
         return self.props.msg
 
+    @staticmethod
+    async def _unclaim(request: WR):
+        await dbs.withdraw_requests.update_one({'_id': request.id}, {'$set': {'is_payed': False}})
+
     async def process(self, update: Union[types.CallbackQuery, types.Message]) -> Union['Node', None]:
         if not is_cq(update):
             pass
         request_id = PyObjectId(self.props.r)
-        request_query = await dbs.withdraw_requests.find_one({'_id': request_id})
+        # claimed before the transfer, as invoices are: of concurrent approvals only one pays
+        request_query = await dbs.withdraw_requests.find_one_and_update({'_id': request_id, 'is_payed': False},
+                                                                        {'$set': {'is_payed': True}})
         if not request_query:
+            if await dbs.withdraw_requests.find_one({'_id': request_id}):
+                self._logger.warn('request is paid %s', request_id)
+                return ErrorNode(msg='request is paid')
             self._logger.error('cannot find request with id %s', request_id)
             return ErrorNode(msg='Cannot find request')
-        request = WR(**request_query)
+        request = WR.from_db(request_query)
         request_user = await get_user_by_user_id(request.user_id)
 
-        if request.is_payed:
-            self._logger.warn('request is paid %s', request)
-            return ErrorNode(msg='request is paid')
-        if request_user.balance < request.amount:
+        # debited before the transfer, only if the balance covers it
+        if not await ledger.record_if({'balance': {'$gte': request.amount}}, request_user.user_id,
+                                      LedgerKind.WITHDRAWAL, -request.amount, ref=request.id):
             self._logger.warn('request is canceled. not enough funds %s', request)
-            with suppress(TelegramAPIError):
-                await bot.send_message(
-                    chat_id=request_user.user_id,
-                    text=_('❌ Your withdrawal request has been declined.\n'
-                           'Reason: not enough funds in your wallet'),
-                    reply_markup=types.InlineKeyboardMarkup(1, inline_keyboard=[[
-                        TransitionButton(to_node='MainMenu', text='Main Menu').compile()
-                    ]])
-                )
-            return ErrorNode(msg=f'user has not enough funds\n'
-                                 f'balance: {request_user.balance}\n'
-                                 f'amount: {request.amount}')
-        headers = {
-            'Crypto-Pay-API-Token': config.crypto_pay_token,
-            'Content-Type': 'application/x-www-form-urlencoded'
-        }
-        data = {'asset': 'TON',
-                'amount': request.amount,
-                'user_id': request_user.user_id,
-                'spend_id': str(hash(str(request.spend_id) + '.Iasgfuih'))}
-        async with aiohttp.ClientSession(headers=headers) as client_session:
-            resp = await client_session.post(CRYPTO_PAY_URL + 'transfer', data=data)
-            text = await resp.text()
-            if resp.status != 200:
-                self._logger.error('response status %s. %s', resp.status, text)
-                return ErrorNode(msg=f'Unable to transfer. response status: {resp.status}\n```{text}```')
-        try:
-            response_data = ujson.loads(text)
-        except JSONDecodeError:
-            self._logger.error('unable to decode: %s', text)
-            return ErrorNode(msg=f'Unable to decode.\n```{text}```')
-
-        if not response_data.get('ok'):
-            self._logger.error('transfer is not ok: %s', text)
-            return ErrorNode(msg=f'Unable to transfer.\n```{text}```')
-
-        request_user.balance -= request.amount
-        request.is_payed = True
-        await dbs.users.update_one({'_id': request_user.id},
-                                   {'$set': request_user.dict()})
-        await dbs.withdraw_requests.update_one({'_id': request.id},
-                                               {'$set': request.dict()})
-
-        with suppress(TelegramAPIError):
-            await bot.send_message(
+            await self._unclaim(request)
+            outbox.notify(
                 chat_id=request_user.user_id,
-                text=_('✅ Your withdrawal request has been processed.\n'
-                       '{amount} 💎 sent to you wallet').format(amount=request.amount),
+                text=_('❌ Your withdrawal request has been declined.\n'
+                       'Reason: not enough funds in your wallet'),
                 reply_markup=types.InlineKeyboardMarkup(1, inline_keyboard=[[
                     TransitionButton(to_node='MainMenu', text='Main Menu').compile()
                 ]])
             )
+            return ErrorNode(msg=f'user has not enough funds\n'
+                                 f'balance: {request_user.balance}\n'
+                                 f'amount: {request.amount}')
+        try:
+            await crypto_pay.transfer(user_id=request_user.user_id,
+                                      asset='TON',
+                                      amount=request.amount,
+                                      # the same for every approval of the request, in every process:
+                                      # Crypto Pay makes repeated transfers a no-op
+                                      spend_id=str(request.id))
+        except CryptoPayError as e:
+            self._logger.error('unable to transfer: %s', e)
+            await ledger.record(request_user.user_id, LedgerKind.REFUND, request.amount, ref=request.id)
+            user_cache.invalidate(request_user.user_id)
+            await self._unclaim(request)
+            return ErrorNode(msg=f'Unable to transfer.\n```{e}```')
+
+        user_cache.invalidate(request_user.user_id)
+
+        outbox.notify(
+            chat_id=request_user.user_id,
+            text=_('✅ Your withdrawal request has been processed.\n'
+                   '{amount} 💎 sent to you wallet').format(amount=request.amount),
+            reply_markup=types.InlineKeyboardMarkup(1, inline_keyboard=[[
+                TransitionButton(to_node='MainMenu', text='Main Menu').compile()
+            ]])
+        )
 
         return None
 
 
 class WithdrawRules(Node):
     back_to = 'WithdrawDI'
+    text_scope = RenderScope.STATIC
+    markup_scope = RenderScope.STATIC
 
-    @property
-    def title(self) -> str:
+    @classproperty
+    def title(cls) -> str:
         return _('About withdrawals')
 
     async def text(self) -> str:
@@ -130,17 +124,14 @@ class WithdrawRequest(Node):
     emoji = '⌛'
 
     menu_btn = True
+    text_scope = RenderScope.DYNAMIC
+    markup_scope = RenderScope.DYNAMIC
 
     class Props(BaseModel):
-        data: Decimal = Decimal(0)
-
-        def __init__(self, **kwargs):
-            super().__init__(**kwargs)
-            if isinstance(self.data, float):
-                self.data = to_decimal(self.data)
+        data: Money = Money(0)
 
-    @property
-    def title(self) -> str:
+    @classproperty
+    def title(cls) -> str:
         return _('Withdrawal Request')
 
     async def text(self) -> str:
@@ -149,22 +140,21 @@ class WithdrawRequest(Node):
                  '⚠ Conversion rate: 1 💎 = 1 TON')
 
     async def process(self, update: Union[types.CallbackQuery, types.Message]) -> Union['Node', None]:
-        amount = to_decimal(self.props.data)
+        amount = self.props.data
         if is_cq(update):
             self._logger.info('request withdraw: %s', amount)
         user = get_current_user()
         request = WR(user_id=user.user_id, amount=amount)
         await dbs.withdraw_requests.insert_one(request.dict())
 
-        await bot.send_message(
-            chat_id=config.operator_id,
+        operator_digest.send_now(
             text=f'New withdrawal request\n'
                  f'User: {user}\n'
                  f'User balance: {user.balance}\n'
                  f'Amount:{request.amount}',
             reply_markup=types.InlineKeyboardMarkup(1, inline_keyboard=[[
                 TransitionButton(to_node=ConfirmWithdrawalAdmin,
-                                 props={'r': str(request.id)}).compile()
+                                 props={'r': request.id}).compile()
             ]])
         )
         return None
@@ -177,9 +167,11 @@ class WithdrawDI(DecimalInput):
 
     next_state = WithdrawRequest.state()
     back_to = 'MainMenu'
+    # shows the balance
+    text_scope = RenderScope.DYNAMIC
 
-    @property
-    def title(self) -> str:
+    @classproperty
+    def title(cls) -> str:
         return _('Withdraw')
 
     @property
@@ -1,20 +1,18 @@
 import logging
-from contextlib import suppress
 
 import ujson
-from aiogram import Dispatcher, types
-from aiogram.utils.exceptions import TelegramAPIError
+from aiogram import types
+from aiogram.dispatcher.webhook import AnswerCallbackQuery
 from aiohttp import web
 from aiohttp.web_response import Response
 
-from bot import bot
 from core.aiogram_nodes.node import TransitionButton
+from core.aiogram_nodes.update_pool import UpdatePool
 from core.config_loader import config
 from core.logging_config import root_logger
-from core.pure import to_decimal
-from db.engine import dbs
-from db.helpers import get_user_by_user_id
-from db.models import Invoice
+from core.operator_digest import operator_digest, Event
+from core.outbox import outbox
+from db.helpers import settle_invoice
 from handlers_bot.nodes.games import Games
 from handlers_bot.nodes.main_menu import MainMenu
 from i18n import _
@@ -23,9 +21,23 @@ from i18n import _
 async def telegram_webhook(request: web.Request):
     update_text = await request.text()
     logging.info('=== New update ===')
-    dp: Dispatcher = request.app['dp']
-    with suppress(Exception):
-        await dp.process_updates([types.Update(**ujson.loads(update_text))])
+    pool: UpdatePool = request.app['update_pool']
+    try:
+        update = types.Update(**ujson.loads(update_text))
+    except Exception:
+        root_logger.error('telegram_webhook. unable to parse update: %s', update_text)
+        return Response(text='ok')
+
+    if pool.submit(update):
+        return Response(text='ok')
+
+    query = update.callback_query
+    if query and config.workers.shed_load:
+        root_logger.warning('telegram_webhook. queue is full, shedding %s', update.update_id)
+        return AnswerCallbackQuery(query.id,
+                                   text=_('⏳ Too many requests. Please try again in a few seconds.',
+                                          locale=query.from_user.language_code)).get_web_response()
+    await pool.put(update)
     return Response(text='ok')
 
 
@@ -36,52 +48,24 @@ async def crypto_pay_webhook(request: web.Request):
     if update.get('update_type') != 'invoice_paid' or update['payload'].get('status') != 'paid':
         return Response(text='not ok')
     invoice_hash = update['payload']['hash']
-    invoice_query = await dbs.invoices.find_one({'hash': invoice_hash})
-    if invoice_query is None:
+    settlement = await settle_invoice(invoice_hash)
+    if settlement is None:
         return Response(text='ok')
-
-    invoice = Invoice(**invoice_query)
-    invoice_user = await get_user_by_user_id(invoice.user_id)
-
+    invoice, invoice_user, amount, bonus = settlement
     root_logger.info(f'crypto_pay_webhook; {invoice=}')
-    if invoice.is_payed:
-        return Response(text='ok')
-    if not invoice_user:
-        root_logger.error('user not found')
-        return Response(text='ok')
 
     buttons = [
         [TransitionButton(to_node=MainMenu).compile()],
         [TransitionButton(to_node=Games).compile()]
     ]
-
-    invoice.is_payed = True
-    amount = invoice.amount
-    admin_bonus_text = ''
-    if invoice_user.deposit_bonus:
-        bonus = (amount / 100 * invoice_user.deposit_bonus)
-        admin_bonus_text = f'\n\ndeposit bonus activated. User got {bonus} free TON'
-        amount += bonus
-        invoice_user.deposit_bonus = to_decimal(0)
-    amount = to_decimal(amount)
-    invoice_user.balance += amount
-    invoice_user.sum_deposit += invoice.amount
-
-    await dbs.users.update_one({'_id': invoice_user.id}, {'$set': invoice_user.dict()})
-
-    await dbs.invoices.update_one({'_id': invoice.id}, {'$set': invoice.dict()})
-
     text = _('You deposited {amount} 💎 to you wallet!\n\n').format(amount=amount)
-    with suppress(TelegramAPIError):
-        await bot.send_message(
-            text=text,
-            chat_id=invoice_user.user_id,
-            parse_mode='markdown',
-            reply_markup=types.InlineKeyboardMarkup(1, buttons),
-        )
-        await bot.send_message(config.operator_id,
-                               text=f'DEPOSIT\n'
-                                    f'user: {invoice_user}\n'
-                                    f'amount: {invoice.amount}'
-                                    f'{admin_bonus_text}')
+    outbox.notify(
+        text=text,
+        chat_id=invoice_user.user_id,
+        parse_mode='markdown',
+        reply_markup=types.InlineKeyboardMarkup(1, buttons),
+    )
+    operator_digest.add(Event.DEPOSIT,
+                        f'{invoice_user} {invoice.amount}' + (f' (+{bonus} bonus)' if bonus else ''),
+                        amount=invoice.amount)
     return Response(text='ok')
@@ -0,0 +1,159 @@
+"""
+Production runner: N worker processes serving the Telegram and Crypto Pay webhooks on one port (SO_REUSEPORT).
+
+    python runner.py --workers 4 --port 8855 --metrics-port 9100
+
+The workers share the bot's global message limit (config.outbox.global_rate), each sends at most its part of it.
+Worker 0 sends the operator digest, the other workers forward their events to it.
+With --metrics-port, worker N also serves its /metrics on port 9100 + N: on the shared port
+a scrape would reach a random worker. The master process sets the webhook once, relays cache invalidations between the workers
+and stops all of them on SIGTERM/SIGINT or when any of them exits.
+"""
+import argparse
+import asyncio
+import multiprocessing
+import os
+import signal
+import socket
+import traceback
+from typing import List, Tuple, Optional
+
+from aiohttp import web
+
+from core.logging_config import root_logger, stop_logging
+
+logger = root_logger.getChild('runner')
+
+STOP_TIMEOUT = 30
+
+
+def run_worker(index: int, count: int, sock: socket.socket, inherited: List[socket.socket], host: str, port: int,
+               metrics_port: Optional[int]):
+    for other in inherited:
+        other.close()
+    # imported here: the master must not create the app, database clients and sessions of the workers
+    from core.config_loader import config
+    from core.invalidation import bus
+    from core.metrics import metrics_app
+    from core.operator_digest import operator_digest
+    from core.outbox import outbox
+    from server import make_app
+
+    async def start_bus(_):
+        await bus.start()
+
+    async def close_bus(_):
+        await bus.close()
+
+    async def start_metrics(app: web.Application):
+        app['metrics_runner'] = web.AppRunner(metrics_app())
+        await app['metrics_runner'].setup()
+        await web.TCPSite(app['metrics_runner'], host, metrics_port + index).start()
+
+    async def stop_metrics(app: web.Application):
+        await app['metrics_runner'].cleanup()
+
+    bus.connect(sock)
+    # each chat is served by one worker at a time: only the bot-wide rate is split
+    outbox.set_rates(config.outbox.global_rate / count, config.outbox.chat_rate)
+    operator_digest.collecting = index == 0
+    app = make_app(init_bot=True, manage_webhook=False)
+    app.on_startup.insert(0, start_bus)
+    app.on_cleanup.append(close_bus)
+    if metrics_port is not None:
+        app.on_startup.append(start_metrics)
+        app.on_cleanup.append(stop_metrics)
+    logger.info('worker %s (pid %s) is starting', index, os.getpid())
+    web.run_app(app, host=host, port=port, reuse_port=True, print=None)
+    # multiprocessing ends the worker with os._exit, atexit handlers do not run
+    stop_logging()
+
+
+async def relay(index: int, reader: asyncio.StreamReader, writers: List[asyncio.StreamWriter]):
+    while True:
+        line = await reader.readline()
+        if not line:
+            return
+        for i, writer in enumerate(writers):
+            if i != index and not writer.is_closing():
+                writer.write(line)
+
+
+async def set_webhook():
+    from bot import bot
+    from core.config_loader import config
+    from core.constants import WEBHOOK_PATH
+    try:
+        await bot.delete_webhook(drop_pending_updates=True)
+        await bot.set_webhook(config.server_name + WEBHOOK_PATH)
+    except Exception:
+        logger.error(''.join(traceback.format_exc()))
+    finally:
+        await bot.close()
+
+
+async def supervise(workers: List[Tuple[multiprocessing.Process, socket.socket]]):
+    loop = asyncio.get_running_loop()
+    stop = asyncio.Event()
+    for sig in (signal.SIGTERM, signal.SIGINT):
+        loop.add_signal_handler(sig, stop.set)
+
+    streams = [await asyncio.open_unix_connection(sock=sock) for _, sock in workers]
+    writers = [writer for _, writer in streams]
+    relays = [asyncio.create_task(relay(i, reader, writers)) for i, (reader, _) in enumerate(streams)]
+
+    await set_webhook()
+
+    while not stop.is_set():
+        exited = [process for process, _ in workers if not process.is_alive()]
+        if exited:
+            logger.error('worker pid %s exited with %s, stopping', exited[0].pid, exited[0].exitcode)
+            break
+        try:
+            await asyncio.wait_for(stop.wait(), 1)
+        except asyncio.TimeoutError:
+            pass
+
+    logger.warning('stopping %s workers', len(workers))
+    for process, _ in workers:
+        if process.is_alive():
+            os.kill(process.pid, signal.SIGTERM)
+    deadline = loop.time() + STOP_TIMEOUT
+    for process, _ in workers:
+        await loop.run_in_executor(None, process.join, max(0.0, deadline - loop.time()))
+        if process.is_alive():
+            logger.error('worker pid %s did not stop, killing', process.pid)
+            process.kill()
+    for task in relays:
+        task.cancel()
+    for writer in writers:
+        writer.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Serve the bot with several worker processes')
+    parser.add_argument('--workers', type=int, default=os.cpu_count())
+    parser.add_argument('--host', default='0.0.0.0')
+    parser.add_argument('--port', type=int, default=8855)
+    parser.add_argument('--metrics-port', type=int, help='worker N serves /metrics on this port + N')
+    args = parser.parse_args()
+
+    context = multiprocessing.get_context('fork')
+    pairs = [socket.socketpair() for _ in range(args.workers)]
+    workers = []
+    for index, (master_sock, worker_sock) in enumerate(pairs):
+        # the master ends of all pairs are inherited by every worker
+        inherited = [sock for sock, _ in pairs] + [sock for i, (_, sock) in enumerate(pairs) if i != index]
+        process = context.Process(target=run_worker,
+                                  args=(index, args.workers, worker_sock, inherited, args.host, args.port,
+                                        args.metrics_port))
+        process.start()
+        workers.append((process, master_sock))
+    for _, worker_sock in pairs:
+        worker_sock.close()
+    asyncio.run(supervise(workers))
+    logger.warning('Bye!')
+
+
+if __name__ == '__main__':
+    main()
@@ -1,8 +1,6 @@
 import asyncio
 import threading
 import traceback
-from pathlib import Path
-from typing import Type
 
 from aiogram import Dispatcher, executor
 from aiohttp import web
@@ -12,10 +10,19 @@ from bot import bot
 from core.aiogram_nodes.debug_whitelist_middleware import DebugWhitelistMiddleware
 from core.aiogram_nodes.get_user_middleware import GetUserMiddleware
 from core.config_loader import config
-from core.constants import WEBHOOK_PATH, CRYPTO_PAY_WEBHOOK_PATH, BASE_DIR
+from core.crypto_pay import crypto_pay
+from core.constants import WEBHOOK_PATH, CRYPTO_PAY_WEBHOOK_PATH
 from core.logging_config import root_logger
-from core.aiogram_nodes.node import Node
+from core.metrics import metrics_handler
+from core.tracing import traces_handler
+from core.operator_digest import operator_digest
+from core.outbox import outbox
+from core.aiogram_nodes.registry import load_nodes
 from core.aiogram_nodes.telegram_dispatcher import TelegramDispatcher
+from core.aiogram_nodes.update_pool import UpdatePool
+from db.indexes import ensure_indexes
+from db.ledger import ledger
+from db.user_cache import user_cache
 from handlers_bot.fallback import setup as setup_fallback
 from handlers_bot.inline_queries import inline_query_referral
 from handlers_server import webhooks
@@ -37,32 +44,7 @@ def init_dispatcher() -> Dispatcher:
 
     dp.register_errors_handler(error_handler)
 
-    def all_subclasses(cls: Type):
-        def _all_subclasses(cls: Type):
-            out = []
-            for sub in cls.__subclasses__():
-                out.append(sub)
-                out.extend(_all_subclasses(sub))
-            return out
-
-        subclasses = list(set(_all_subclasses(cls)))
-        subclasses.sort(key=lambda x: x.__name__)
-        return subclasses
-
-    def import_node_dir(directory: Path, parent: str):
-        for path in directory.iterdir():
-            if path.name.startswith('_'):
-                continue
-            if path.is_dir():
-                import_node_dir(path, parent + '.' + path.name)
-            else:
-                string = f'from {parent} import {path.name}'[:-3:]
-                root_logger.info('DYNAMIC IMPORT: %s', string)
-                exec(string)
-
-    import_node_dir(BASE_DIR / 'handlers_bot/nodes', 'handlers_bot.nodes')
-
-    for node_cls in all_subclasses(Node):
+    for node_cls in load_nodes():
         root_logger.info('init_dispatcher. connect %s', node_cls)
         node_cls().setup(dp)
 
@@ -73,7 +55,11 @@ def init_dispatcher() -> Dispatcher:
     return dp
 
 
-def make_app(init_bot=False):
+def make_app(init_bot=False, manage_webhook=True):
+    """
+    :param manage_webhook: set the webhook on startup and remove it on shutdown.
+        Off in the workers of runner.py, the master sets it once
+    """
     @web.middleware
     async def cors_middleware(request: web.Request, handler):
         response = await handler(request)
@@ -99,6 +85,10 @@ def make_app(init_bot=False):
         root_logger.info('Initializing bot')
         dp = init_dispatcher()
         app['dp'] = dp
+        app['update_pool'] = UpdatePool(dp, workers=config.workers.count, queue_size=config.workers.queue_size)
+        app['update_pool'].start()
+        if not manage_webhook:
+            return
         try:
             await dp.bot.delete_webhook(drop_pending_updates=True)
 
@@ -106,13 +96,30 @@ def make_app(init_bot=False):
         except Exception:
             root_logger.error(''.join(traceback.format_exc()))
 
+    async def startup_database(app: web.Application):
+        await ensure_indexes()
+
+    async def shutdown_database(app: web.Application):
+        await ledger.close()
+
+    async def startup_crypto_pay(app: web.Application):
+        await crypto_pay.start()
+
+    async def shutdown_crypto_pay(app: web.Application):
+        await crypto_pay.close()
+
     async def shutdown_telegram_bot(app: web.Application):
         root_logger.warning('Shutting down..')
 
         dp = app['dp']
+        await app['update_pool'].stop()
+        await operator_digest.close()
+        await outbox.close()
+        await user_cache.close()
 
         # Remove webhook (not acceptable in some cases)
-        await bot.bot.delete_webhook()
+        if manage_webhook:
+            await bot.bot.delete_webhook()
 
         # Close DB connection (if used)
         await dp.storage.close()
@@ -124,6 +131,11 @@ def make_app(init_bot=False):
     if config.debug:
         aiohttp_app.middlewares.insert(0, debug_middleware)
 
+    aiohttp_app.on_startup.append(startup_database)
+    aiohttp_app.on_startup.append(startup_crypto_pay)
+    aiohttp_app.on_cleanup.append(shutdown_database)
+    aiohttp_app.on_cleanup.append(shutdown_crypto_pay)
+
     if init_bot:
         aiohttp_app.router.add_route('POST', WEBHOOK_PATH, webhooks.telegram_webhook)
 
@@ -133,6 +145,10 @@ def make_app(init_bot=False):
     root_logger.info('Initializing routes')
 
     aiohttp_app.router.add_route('POST', CRYPTO_PAY_WEBHOOK_PATH, webhooks.crypto_pay_webhook)
+    if config.metrics.enabled:
+        aiohttp_app.router.add_route('GET', '/metrics', metrics_handler)
+    if config.tracing.endpoint:
+        aiohttp_app.router.add_route('GET', '/debug/traces', traces_handler)
 
     return aiohttp_app
 
@@ -142,9 +158,15 @@ def run_polling():
         root_logger.info('--- DEV MODE ---')
     dp = init_dispatcher()
 
+    async def on_shutdown(_):
+        await operator_digest.close()
+        await outbox.close()
+        await ledger.close()
+        await user_cache.close()
+
     def polling_thread(loop):
         asyncio.set_event_loop(loop)
-        executor.start_polling(dp, skip_updates=True)
+        executor.start_polling(dp, skip_updates=True, on_shutdown=on_shutdown)
 
     def run_server_thread(loop):
         asyncio.set_event_loop(loop)